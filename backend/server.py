@@ -1,40 +1,57 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+import time
+SERVER_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+import asyncio
+import functools
+import contextvars
+import threading
+import importlib
+import sys
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Callable, List, Optional
 import uuid
+import hashlib
+import base64
+import json
+import heapq
+import re
+import zipfile
+from collections import deque
+from collections import OrderedDict
+from contextlib import contextmanager
+from importlib import metadata
+from dataclasses import dataclass
 from urllib.parse import quote
 from datetime import datetime, timezone
 import tempfile
 import shutil
+import copy
+import html
+import posixpath
 from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
 from PIL import Image
-import img2pdf
-from pdf2docx import Converter
 import io
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
-import openpyxl
-from docx import Document
-import pytesseract
-from pygments import highlight
-from pygments.lexers import CppLexer, PythonLexer
-from pygments.formatters import HtmlFormatter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Preformatted
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from pygments.lexers import get_lexer_by_name, TextLexer
+from pygments.token import Token, Comment, Keyword, Name, Number, Operator, String
+from pygments.util import ClassNotFound
 from reportlab.lib.colors import HexColor
-from reportlab.lib.enums import TA_LEFT
-from reportlab.lib.units import inch
-import nbformat
-from nbconvert import PDFExporter
-from nbconvert.preprocessors import ExecutePreprocessor
 import subprocess
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
@@ -42,22 +59,645 @@ from xml.dom import minidom
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection (optional - for future use)
-try:
-    mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
-    db = client[os.environ.get('DB_NAME', 'test_database')]
-    # Test connection
-    client.admin.command('ping')
-    logging.info("MongoDB connected successfully")
-except Exception as e:
-    logging.warning(f"MongoDB connection failed: {e}. Running without database.")
-    client = None
-    db = None
-
-# Create temporary upload directory
-UPLOAD_DIR = ROOT_DIR / 'temp_uploads'
-UPLOAD_DIR.mkdir(exist_ok=True)
+# MongoDB connection (optional)
+# The client is created and checked at startup (set MONGO_URL="" to run without it).
+# Without a reachable server, job records and operation metadata stay in memory.
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+MONGO_DB_NAME = os.environ.get('DB_NAME', 'test_database')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 20))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_TIMEOUT_MS = int(os.environ.get('MONGO_TIMEOUT_MS', 3000))
+MONGO_HEALTH_INTERVAL_SECONDS = float(os.environ.get('MONGO_HEALTH_INTERVAL_SECONDS', 10))
+
+class MongoConnection:
+    """
+    Owns the Motor client: connects and pings it at startup, reports its health and
+    closes it at shutdown. status is 'disabled', 'connected' or 'unavailable'.
+    """
+
+    def __init__(self, url: str, db_name: str, max_pool_size: int, min_pool_size: int, timeout_ms: int):
+        self.url = url
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.timeout_ms = timeout_ms
+        self.client = None
+        self.db = None
+        self.status = 'disabled'
+        self.error = None
+        self.latency_ms = None
+        self._checked_at = None
+
+    @property
+    def available(self) -> bool:
+        return self.status == 'connected'
+
+    async def connect(self) -> bool:
+        """Create the client and ping the server; returns whether it answered"""
+        if not self.url:
+            return False
+        self.client = AsyncIOMotorClient(
+            self.url,
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=self.min_pool_size,
+            serverSelectionTimeoutMS=self.timeout_ms,
+            connectTimeoutMS=self.timeout_ms,
+        )
+        self.db = self.client[self.db_name]
+        await self.ping()
+        if self.available:
+            logging.info(f"MongoDB connected ({self.latency_ms} ms, pool size {self.min_pool_size}-{self.max_pool_size})")
+        else:
+            logging.warning(f"MongoDB connection failed: {self.error}. Running without database.")
+        return self.available
+
+    async def ping(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.client.admin.command('ping'), timeout=self.timeout_ms / 1000 + 1)
+            self.status, self.error = 'connected', None
+            self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            self.status, self.error, self.latency_ms = 'unavailable', str(e) or type(e).__name__, None
+        self._checked_at = time.monotonic()
+
+    async def health(self) -> dict:
+        """Status and ping latency, pinging again if the last check is older than the health interval"""
+        if self.client is not None and time.monotonic() - self._checked_at >= MONGO_HEALTH_INTERVAL_SECONDS:
+            await self.ping()
+        health = {"status": self.status}
+        if self.latency_ms is not None:
+            health["latency_ms"] = self.latency_ms
+        if self.error:
+            health["error"] = self.error
+        return health
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+            self.status = 'disabled'
+
+mongo = MongoConnection(MONGO_URL, MONGO_DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_TIMEOUT_MS)
+
+# Scratch space
+# Uploads and intermediate files live in UPLOAD_DIR. Each API request gets a workspace
+# that owns the files it creates and deletes them once the response has been sent,
+# whatever way the request ends. Files that must outlive their request (document
+# sessions, background jobs) are held until deleted with cleanup_files. A periodic
+# sweep removes anything else older than SCRATCH_MAX_AGE_SECONDS, and new uploads are
+# refused with 503 while the directory is over SCRATCH_QUOTA_MB. Small uploads can be
+# placed on a RAM-backed directory (e.g. SCRATCH_RAM_DIR=/dev/shm/pdf-master).
+UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', ROOT_DIR / 'temp_uploads'))
+SCRATCH_QUOTA_MB = int(os.environ.get('SCRATCH_QUOTA_MB', 10240))
+SCRATCH_MAX_AGE_SECONDS = int(os.environ.get('SCRATCH_MAX_AGE_SECONDS', 6 * 3600))
+SCRATCH_SWEEP_SECONDS = int(os.environ.get('SCRATCH_SWEEP_SECONDS', 60))
+SCRATCH_RAM_DIR = os.environ.get('SCRATCH_RAM_DIR', '')
+SCRATCH_RAM_MAX_MB = int(os.environ.get('SCRATCH_RAM_MAX_MB', 256))
+SCRATCH_RAM_FILE_MAX_MB = int(os.environ.get('SCRATCH_RAM_FILE_MAX_MB', 8))
+# Files younger than this are never evicted, so a file being created is not swept
+SCRATCH_MIN_AGE_SECONDS = 300
+SCRATCH_RETRY_AFTER_SECONDS = 30
+
+def path_size(path: Path) -> int:
+    """Size of a file, or of everything under a directory"""
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+        return sum(entry.stat().st_size for entry in path.rglob('*') if entry.is_file())
+    except OSError:
+        return 0
+
+def remove_path(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+class ScratchSpace:
+    """
+    Allocates scratch file paths, tracks which ones are in use and evicts the rest.
+
+    usage_bytes is measured by each sweep and grows with the uploads written since,
+    so the quota is enforced approximately between sweeps. ram_usage_bytes counts the
+    size reserved for each RAM directory path until the path is released or its file
+    is gone, plus the files a sweep found there that were never reserved (e.g. left
+    by a previous run).
+    """
+
+    def __init__(self, directory: Path, quota_bytes: int, max_age_seconds: int,
+                 ram_directory: Optional[Path] = None, ram_max_bytes: int = 0, ram_file_max_bytes: int = 0):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.ram_directory = ram_directory
+        self.ram_max_bytes = ram_max_bytes
+        self.ram_file_max_bytes = ram_file_max_bytes
+        self.usage_bytes = 0
+        self.ram_usage_bytes = 0
+        self.stats = {'sweeps': 0, 'swept_files': 0, 'swept_bytes': 0, 'rejected': 0}
+        self._held = set()
+        self._workspaces = set()
+        self._ram_paths = {}
+        self._ram_untracked_bytes = 0
+        self._ram_lock = threading.Lock()
+        self._task = None
+
+    def create_directories(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.ram_directory is not None:
+            try:
+                self.ram_directory.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                logging.warning(f"RAM scratch directory {self.ram_directory} is not usable: {e}")
+                self.ram_directory = None
+
+    def new_path(self, suffix: str = "", size: Optional[int] = None) -> Path:
+        """A fresh path; small files of known size go to the RAM directory while it has room"""
+        name = f"{uuid.uuid4()}{suffix}"
+        if self.ram_directory is not None and size is not None and size <= self.ram_file_max_bytes:
+            with self._ram_lock:
+                if self.ram_usage_bytes + size <= self.ram_max_bytes:
+                    path = self.ram_directory / name
+                    self._ram_paths[path] = (size, time.time())
+                    self.ram_usage_bytes += size
+                    return path
+        return self.directory / name
+
+    def _free_ram(self, paths):
+        """Return the RAM reserved for paths that are going away"""
+        with self._ram_lock:
+            for path in paths:
+                size, _ = self._ram_paths.pop(path, (0, None))
+                self.ram_usage_bytes -= size
+
+    def workspace(self) -> 'ScratchWorkspace':
+        workspace = ScratchWorkspace(self)
+        self._workspaces.add(workspace)
+        return workspace
+
+    def release_workspace(self, workspace: 'ScratchWorkspace') -> set:
+        """Forget a closing workspace and return its paths that nobody holds"""
+        self._workspaces.discard(workspace)
+        unheld = workspace.paths - self._held
+        self._free_ram(unheld)
+        return unheld
+
+    def hold(self, *paths):
+        """Keep paths past the request that created them, until they are released"""
+        for path in paths:
+            if path:
+                self._held.add(Path(path))
+
+    def release(self, *paths):
+        """Stop holding paths that are being deleted (see cleanup_files)"""
+        paths = [Path(path) for path in paths if path]
+        self._held.difference_update(paths)
+        self._free_ram(paths)
+
+    def add_usage(self, size: int):
+        self.usage_bytes += size
+
+    def over_quota(self, incoming: int = 0) -> bool:
+        return self.usage_bytes + incoming > self.quota_bytes
+
+    def check_quota(self, incoming: int = 0):
+        """Raise 503 when incoming more bytes would not fit in the quota"""
+        if self.over_quota(incoming):
+            self.stats['rejected'] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="The server is short of scratch space. Please try again shortly.",
+                headers={"Retry-After": str(SCRATCH_RETRY_AFTER_SECONDS)},
+            )
+
+    def in_use(self) -> set:
+        """Paths held or owned by an open workspace"""
+        in_use = set(self._held)
+        for workspace in self._workspaces:
+            in_use.update(workspace.paths)
+        return in_use
+
+    def sweep(self, in_use: Optional[set] = None) -> int:
+        """
+        Measure usage and remove files nobody owns that are older than max_age_seconds,
+        or (oldest first) that keep usage over the quota. Returns the bytes removed.
+        """
+        now = time.time()
+        if in_use is None:
+            in_use = self.in_use()
+        usage = {}
+        unowned = []
+        for directory in (self.directory, self.ram_directory):
+            if directory is None:
+                continue
+            usage[directory] = 0
+            for path in directory.iterdir():
+                try:
+                    modified = path.stat().st_mtime
+                except OSError:
+                    continue
+                size = path_size(path)
+                usage[directory] += size
+                if path not in in_use and now - modified > SCRATCH_MIN_AGE_SECONDS:
+                    unowned.append((modified, path, size, directory))
+        
+        total = sum(usage.values())
+        removed = 0
+        for modified, path, size, directory in sorted(unowned):
+            if now - modified <= self.max_age_seconds and total - removed <= self.quota_bytes:
+                continue
+            remove_path(path)
+            usage[directory] -= size
+            removed += size
+            self.stats['swept_files'] += 1
+        
+        # Drop reservations whose file is gone without having been released, and
+        # count what is in the RAM directory without a reservation
+        with self._ram_lock:
+            reserved = dict(self._ram_paths)
+        vanished = [
+            path for path, (_, reserved_at) in reserved.items()
+            if path not in in_use and now - reserved_at > SCRATCH_MIN_AGE_SECONDS and not path.exists()
+        ]
+        self._free_ram(vanished)
+        if self.ram_directory is not None:
+            untracked = usage[self.ram_directory] - sum(
+                path_size(path) for path in reserved if path not in vanished and path.exists()
+            )
+            with self._ram_lock:
+                self.ram_usage_bytes += max(0, untracked) - self._ram_untracked_bytes
+                self._ram_untracked_bytes = max(0, untracked)
+        
+        self.usage_bytes = sum(usage.values())
+        self.stats['sweeps'] += 1
+        self.stats['swept_bytes'] += removed
+        return removed
+
+    def start(self, interval: float, evict: Optional[Callable[[], int]] = None):
+        """Sweep every interval seconds; evict() frees held files (returning bytes) while over quota"""
+        self.create_directories()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval, evict))
+
+    async def _run(self, interval: float, evict):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep, self.in_use())
+                while evict is not None and self.over_quota():
+                    freed = evict()
+                    if not freed:
+                        break
+                    self.usage_bytes -= freed
+            except Exception as e:
+                logging.warning(f"Scratch space sweep failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            'directory': str(self.directory),
+            'usage_bytes': self.usage_bytes,
+            'quota_bytes': self.quota_bytes,
+            'ram_directory': str(self.ram_directory) if self.ram_directory else None,
+            'ram_usage_bytes': self.ram_usage_bytes,
+            'ram_max_bytes': self.ram_max_bytes,
+            'workspaces': len(self._workspaces),
+            'held': len(self._held),
+            **self.stats,
+        }
+
+class ScratchWorkspace:
+    """The scratch files and directories of one request, removed together by close()"""
+
+    def __init__(self, space: ScratchSpace):
+        self.space = space
+        self.paths = set()
+
+    def file(self, suffix: str = "", size: Optional[int] = None) -> Path:
+        path = self.space.new_path(suffix, size)
+        self.paths.add(path)
+        return path
+
+    def directory(self, suffix: str = "") -> Path:
+        path = self.space.new_path(suffix)
+        path.mkdir()
+        self.paths.add(path)
+        return path
+
+    def close(self):
+        """Remove every path not held by a longer-lived owner"""
+        for path in self.space.release_workspace(self):
+            remove_path(path)
+        self.paths.clear()
+
+scratch = ScratchSpace(
+    UPLOAD_DIR,
+    SCRATCH_QUOTA_MB * 1024 * 1024,
+    SCRATCH_MAX_AGE_SECONDS,
+    Path(SCRATCH_RAM_DIR) if SCRATCH_RAM_DIR else None,
+    SCRATCH_RAM_MAX_MB * 1024 * 1024,
+    SCRATCH_RAM_FILE_MAX_MB * 1024 * 1024,
+)
+
+# The workspace of the request being handled
+current_workspace = contextvars.ContextVar('current_workspace', default=None)
+
+def scratch_file(suffix: str = "", size: Optional[int] = None) -> Path:
+    """A new scratch path owned by the current request (or unowned, and swept, outside one)"""
+    workspace = current_workspace.get()
+    if workspace is None:
+        return scratch.new_path(suffix, size)
+    return workspace.file(suffix, size)
+
+def scratch_dir(suffix: str = "") -> Path:
+    """A new scratch directory owned by the current request"""
+    workspace = current_workspace.get()
+    if workspace is None:
+        path = scratch.new_path(suffix)
+        path.mkdir()
+        return path
+    return workspace.directory(suffix)
+
+# Upload size limits (in MB). MAX_UPLOAD_MB is the default request body limit;
+# UPLOAD_LIMITS_MB overrides it per endpoint, e.g. "merge=1000,ocr=50".
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 200))
+DEFAULT_UPLOAD_LIMITS_MB = {
+    'merge': 500,
+    'batch': 2000,
+    'pipeline': 500,
+    'cpp-to-pdf': 20,
+    'c-to-pdf': 20,
+    'js-to-pdf': 20,
+    'php-to-pdf': 20,
+    'ts-to-pdf': 20,
+    'java-to-pdf': 20,
+    'python-to-pdf': 20,
+    'xml-to-pdf': 20,
+    'html-to-pdf': 20,
+    'css-to-pdf': 20,
+}
+
+def parse_upload_limits(value: str) -> dict:
+    """Parse per-endpoint limits such as 'merge=1000,ocr=50' (values in MB)"""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        endpoint, size = (part.strip() for part in item.split('=', 1))
+        try:
+            limits[endpoint] = int(size)
+        except ValueError:
+            logging.warning(f"Ignoring upload limit {item!r}: size must be a whole number of MB")
+    return limits
+
+UPLOAD_LIMITS_MB = {**DEFAULT_UPLOAD_LIMITS_MB, **parse_upload_limits(os.environ.get('UPLOAD_LIMITS_MB', ''))}
+
+# Worker pool configuration
+# Threads suit short calls and work that shares this process's state (session readers,
+# thumbnails). PyMuPDF's bindings hold the GIL while MuPDF renders, and pypdf,
+# reportlab, pdf2docx and openpyxl are pure Python, so CPU-heavy work (rasterizing
+# included) needs processes to use more than one core.
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1))
+WORKER_START_METHOD = os.environ.get('WORKER_START_METHOD', 'spawn')
+
+DEFAULT_OPERATION_ROUTES = {
+    'merge': 'process',
+    'split': 'process',
+    'compress': 'process',
+    'rotate': 'process',
+    'pdf-to-jpg': 'process',
+    'pdf-to-png': 'process',
+    'page-count': 'thread',
+    'image-to-pdf': 'thread',
+    'pdf-to-word': 'process',
+    'word-to-pdf': 'process',
+    'excel-to-pdf': 'process',
+    'pdf-to-excel': 'process',
+    'code-to-pdf': 'process',
+    'ocr-scan': 'process',
+    'ocr': 'process',
+    'searchable-pdf': 'process',
+    'watermark': 'process',
+    'protect': 'process',
+    'unlock': 'process',
+    'sign': 'process',
+    'ipynb-to-pdf': 'process',
+    'add-page-numbers': 'process',
+    'pipeline': 'process',
+    'preview-pages': 'thread',
+    'reorder': 'process',
+    'delete-pages': 'process',
+    # Document session operations run on threads so they share this process's
+    # cache of parsed readers
+    'document-open': 'thread',
+    'document-rotate': 'thread',
+    'document-reorder': 'thread',
+    'document-delete-pages': 'thread',
+    'thumbnail': 'thread',
+}
+
+def parse_operation_routes(value: str) -> dict:
+    """Parse route overrides such as 'merge=thread,ocr=process'"""
+    routes = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        operation, kind = (part.strip() for part in item.split('=', 1))
+        if kind not in ('thread', 'process'):
+            logging.warning(f"Ignoring worker route {item!r}: pool must be 'thread' or 'process'")
+            continue
+        routes[operation] = kind
+    return routes
+
+# Tool dependencies
+# Heavy converter libraries are imported inside the functions that use them, so a
+# cold start (and every spawned worker process) only pays for the tools it runs.
+# WARMUP_TOOLS ('all' or e.g. "pdf-to-word,ocr") imports a tool's modules at startup
+# instead, in the server and in each worker process as it starts.
+TOOL_MODULES = {
+    'merge': ('fitz',),
+    'compress': ('fitz',),
+    'pdf-to-jpg': ('fitz',),
+    'pdf-to-png': ('fitz',),
+    'preview-pages': ('fitz',),
+    'thumbnail': ('fitz',),
+    'image-to-pdf': ('img2pdf',),
+    'pdf-to-word': ('pdf2docx',),
+    'word-to-pdf': ('reportlab.platypus',),
+    'excel-to-pdf': ('openpyxl',),
+    'pdf-to-excel': ('fitz', 'openpyxl'),
+    'ocr': ('fitz', 'pytesseract'),
+    'searchable-pdf': ('fitz', 'pytesseract'),
+    'ipynb-to-pdf': ('nbformat', 'reportlab.platypus'),
+}
+
+def parse_warmup_tools(value: str) -> List[str]:
+    """Parse WARMUP_TOOLS ('all' or a comma-separated list of tools) into a module list"""
+    tools = list(TOOL_MODULES) if value.strip() == 'all' else [t.strip() for t in value.split(',') if t.strip()]
+    modules = []
+    for tool in tools:
+        if tool not in TOOL_MODULES:
+            logging.warning(f"Ignoring warm-up tool {tool!r}: use one of {', '.join(TOOL_MODULES)}")
+            continue
+        modules.extend(module for module in TOOL_MODULES[tool] if module not in modules)
+    return modules
+
+WARMUP_MODULES = parse_warmup_tools(os.environ.get('WARMUP_TOOLS', ''))
+startup_report = {}
+
+def import_modules(modules) -> dict:
+    """Import modules that are not loaded yet and return the seconds each import took"""
+    timings = {}
+    for name in modules:
+        if name in sys.modules:
+            continue
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.warning(f"Could not import {name}: {e}")
+            continue
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+class InvalidInputError(Exception):
+    """Raised by worker functions when the request input is invalid (maps to HTTP 400)"""
+
+class WorkerPool:
+    """
+    Runs blocking PDF work off the event loop.
+
+    Each operation is routed to a thread or process pool. Pools are created on first
+    use so importing the module stays cheap, and in-flight counts are tracked so the
+    queue depth of each pool can be reported.
+    """
+
+    def __init__(self, thread_workers: int, process_workers: int, routes: dict, start_method: str = 'spawn', warmup_modules=()):
+        self.thread_workers = max(1, thread_workers)
+        self.process_workers = max(1, process_workers)
+        self.routes = routes
+        self.start_method = start_method
+        self.warmup_modules = tuple(warmup_modules)
+        self._executors = {}
+        self._lock = threading.Lock()
+        self._pool_stats = {
+            kind: {'in_flight': 0, 'submitted': 0, 'completed': 0, 'failed': 0}
+            for kind in ('thread', 'process')
+        }
+        self._operation_stats = {}
+
+    def route(self, operation: str) -> str:
+        return self.routes.get(operation, 'thread')
+
+    def _get_executor(self, kind: str):
+        with self._lock:
+            executor = self._executors.get(kind)
+            if executor is None:
+                if kind == 'process':
+                    executor = ProcessPoolExecutor(
+                        max_workers=self.process_workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                        initializer=import_modules if self.warmup_modules else None,
+                        initargs=(self.warmup_modules,),
+                    )
+                else:
+                    executor = ThreadPoolExecutor(
+                        max_workers=self.thread_workers,
+                        thread_name_prefix='pdf-worker',
+                    )
+                self._executors[kind] = executor
+            return executor
+
+    def _reset_executor(self, kind: str, executor):
+        with self._lock:
+            if self._executors.get(kind) is executor:
+                del self._executors[kind]
+        executor.shutdown(wait=False)
+
+    async def run(self, operation: str, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the pool configured for this operation"""
+        kind = self.route(operation)
+        executor = self._get_executor(kind)
+        pool_stats = self._pool_stats[kind]
+        op_stats = self._operation_stats.setdefault(
+            operation, {'pool': kind, 'calls': 0, 'errors': 0, 'in_flight': 0, 'total_seconds': 0.0}
+        )
+        pool_stats['in_flight'] += 1
+        pool_stats['submitted'] += 1
+        op_stats['in_flight'] += 1
+        op_stats['calls'] += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+            pool_stats['completed'] += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. a crash inside a native library); start a fresh pool next time
+            self._reset_executor(kind, executor)
+            pool_stats['failed'] += 1
+            op_stats['errors'] += 1
+            raise
+        except Exception:
+            pool_stats['failed'] += 1
+            op_stats['errors'] += 1
+            raise
+        finally:
+            pool_stats['in_flight'] -= 1
+            op_stats['in_flight'] -= 1
+            op_stats['total_seconds'] += time.perf_counter() - start
+
+    async def warm_up(self) -> dict:
+        """
+        Import the warm-up modules in this process and start the process pool, whose
+        workers import them as they start. Returns the seconds each local import took.
+        """
+        timings = await asyncio.to_thread(import_modules, self.warmup_modules)
+        executor = self._get_executor('process')
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self.process_workers)))
+        return timings
+
+    def metrics(self) -> dict:
+        pools = {}
+        for kind, stats in self._pool_stats.items():
+            workers = self.process_workers if kind == 'process' else self.thread_workers
+            pools[kind] = {
+                **stats,
+                'workers': workers,
+                'running': min(stats['in_flight'], workers),
+                'queued': max(0, stats['in_flight'] - workers),
+                'started': kind in self._executors,
+            }
+        operations = {
+            name: {**stats, 'avg_seconds': round(stats['total_seconds'] / stats['calls'], 4) if stats['calls'] else 0.0}
+            for name, stats in self._operation_stats.items()
+        }
+        return {'pools': pools, 'operations': operations}
+
+    def shutdown(self):
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+worker_pool = WorkerPool(
+    WORKER_THREADS,
+    WORKER_PROCESSES,
+    {**DEFAULT_OPERATION_ROUTES, **parse_operation_routes(os.environ.get('WORKER_ROUTES', ''))},
+    WORKER_START_METHOD,
+    WARMUP_MODULES,
+)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -65,19 +705,131 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Utility function to save uploaded file
-async def save_upload_file(upload_file: UploadFile) -> Path:
-    file_id = str(uuid.uuid4())
+class UploadLimitMiddleware:
+    """
+    Rejects request bodies larger than the endpoint's upload limit with 413.
+
+    Requests with a Content-Length over the limit are refused before any of the body
+    is read; chunked requests are counted as they stream in and stopped as soon as
+    they cross the limit.
+    """
+
+    def __init__(self, app, default_limit_mb: int, limits_mb: dict, prefix: str = "/api/"):
+        self.app = app
+        self.default_limit = default_limit_mb * 1024 * 1024
+        self.limits = {name: mb * 1024 * 1024 for name, mb in limits_mb.items()}
+        self.prefix = prefix
+
+    def limit_for(self, path: str) -> int:
+        endpoint = path[len(self.prefix):] if path.startswith(self.prefix) else path
+        endpoint = endpoint.strip('/')
+        # Fall back to the first path segment, so 'batch' covers every /batch/<tool>
+        return self.limits.get(endpoint, self.limits.get(endpoint.split('/')[0], self.default_limit))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+        
+        limit = self.limit_for(scope["path"])
+        detail = f"Upload exceeds the {limit // (1024 * 1024)} MB limit for this endpoint"
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+class ScratchWorkspaceMiddleware:
+    """
+    Give each API request a scratch workspace and remove it once the response (and its
+    background tasks) are done, also when the handler fails or the client disconnects.
+    Uploads are refused with 503 while the scratch space is over its quota.
+    """
+
+    def __init__(self, app, space: ScratchSpace, prefix: str = "/api/"):
+        self.app = app
+        self.space = space
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["method"] in ("POST", "PUT", "PATCH"):
+            content_length = dict(scope["headers"]).get(b"content-length")
+            incoming = int(content_length) if content_length and content_length.isdigit() else 0
+            try:
+                self.space.check_quota(incoming)
+            except HTTPException as e:
+                response = JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+                await response(scope, receive, send)
+                return
+        
+        workspace = self.space.workspace()
+        token = current_workspace.set(workspace)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_workspace.reset(token)
+            await asyncio.to_thread(workspace.close)
+
+@dataclass
+class StoredUpload:
+    """An upload written to scratch space, with its size and SHA-256 content hash"""
+    path: Path
+    size: int
+    sha256: str
+
+# Utility function to stream an uploaded file to disk in chunks, hashing it on the way
+async def ingest_upload_file(upload_file: UploadFile) -> StoredUpload:
     file_extension = Path(upload_file.filename).suffix
-    temp_path = UPLOAD_DIR / f"{file_id}{file_extension}"
+    temp_path = scratch_file(file_extension, upload_file.size)
     
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await asyncio.to_thread(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            scratch.check_quota(len(chunk))
+            scratch.add_usage(len(chunk))
+            digest.update(chunk)
+            size += len(chunk)
+            await asyncio.to_thread(buffer.write, chunk)
+    except BaseException:
+        buffer.close()
+        cleanup_files(temp_path)
+        raise
+    buffer.close()
+    await upload_file.close()
     
-    return temp_path
+    return StoredUpload(path=temp_path, size=size, sha256=digest.hexdigest())
 
-# Utility function to cleanup temp files
+# Utility function to save uploaded file
+async def save_upload_file(upload_file: UploadFile) -> Path:
+    stored = await ingest_upload_file(upload_file)
+    return stored.path
+
+# Utility function to cleanup temp files (and release any hold on them)
 def cleanup_files(*files):
+    scratch.release(*files)
     for file in files:
         try:
             if file and Path(file).exists():
@@ -112,7 +864,7 @@ def create_file_response(file_path: Path, filename: str, media_type: str, cleanu
         file_path: Path to the file to send
         filename: The desired download filename
         media_type: MIME type of the file
-        cleanup_callback: Optional callback for cleanup
+        cleanup_callback: Optional callback for cleanup, run once the file is sent
     
     Returns:
         FileResponse with proper headers
@@ -125,7 +877,7 @@ def create_file_response(file_path: Path, filename: str, media_type: str, cleanu
         path=str(file_path),
         media_type=media_type,
         filename=filename,
-        background=cleanup_callback
+        background=BackgroundTask(cleanup_callback) if cleanup_callback else None
     )
     
     # Override Content-Disposition header with both formats for maximum compatibility
@@ -134,125 +886,3723 @@ def create_file_response(file_path: Path, filename: str, media_type: str, cleanu
     
     return response
 
-def build_code_pdf(code_text: str, output_path: Path, color_mode: str = "bw"):
-    """Render source code to PDF. color_mode: 'bw' or 'colorful'"""
-    from reportlab.lib import colors
-
-    KEYWORDS_BLUE = {
-        'def', 'class', 'import', 'from', 'return', 'if', 'else', 'elif',
-        'for', 'while', 'try', 'except', 'with', 'as', 'in', 'not', 'and',
-        'or', 'True', 'False', 'None', 'int', 'float', 'str', 'bool',
-        'public', 'private', 'protected', 'static', 'void', 'new', 'this',
-        'super', 'extends', 'implements', 'interface', 'abstract',
-        'const', 'let', 'var', 'function', 'async', 'await', 'typeof',
-        '#include', '#define', '#ifndef', '#endif', '#pragma',
-        'struct', 'typedef', 'enum', 'namespace', 'using', 'template',
-        'echo', 'print', 'foreach', 'switch', 'case', 'break', 'continue',
-        'package', 'throws', 'throw', 'final', 'synchronized',
-        'lambda', 'yield', 'pass', 'del', 'global', 'nonlocal',
-        'raise', 'assert'
-    }
+# Utility function to create StreamingResponse with the same Content-Disposition handling
+def create_streaming_response(content, filename: str, media_type: str, cleanup_callback=None):
+    """Stream an (async) iterator of bytes as a download named filename"""
+    background = BackgroundTask(cleanup_callback) if cleanup_callback else None
+    response = StreamingResponse(content, media_type=media_type, background=background)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"; filename*=UTF-8\'\'{quote(filename)}'
+    return response
 
-    def colorize_line(line: str):
-        if color_mode != "colorful":
-            return colors.black
-        stripped = line.strip()
-        if not stripped:
-            return colors.black
-        if (stripped.startswith('//') or stripped.startswith('#')
-                or stripped.startswith('*') or stripped.startswith('/*')
-                or stripped.startswith('*/')):
-            return HexColor('#2e7d32')   # green for comments
-        if '"' in stripped or "'" in stripped:
-            return HexColor('#b5490a')   # orange for strings
-        first_token = stripped.split()[0].rstrip('(;:{') if stripped.split() else ''
-        if first_token in KEYWORDS_BLUE:
-            return HexColor('#1565c0')   # blue for keywords
-        if stripped[0].isdigit():
-            return HexColor('#7b1fa2')   # purple for numbers
-        return colors.black
-
-    doc = SimpleDocTemplate(
-        str(output_path), pagesize=letter,
-        leftMargin=50, rightMargin=50,
-        topMargin=50, bottomMargin=50
-    )
-    styles = getSampleStyleSheet()
-    story = []
-
-    for line in code_text.split('\n'):
-        text_color = colorize_line(line)
-        safe = (line
-                .replace('&', '&amp;')
-                .replace('<', '&lt;')
-                .replace('>', '&gt;')
-                .replace(' ', '&nbsp;')
-                .replace('\t', '&nbsp;&nbsp;&nbsp;&nbsp;'))
-        if not safe.strip():
-            safe = '&nbsp;'
-
-        line_style = ParagraphStyle(
-            'CodeLine',
-            parent=styles['Code'],
-            fontName='Courier',
-            fontSize=9,
-            leading=11,
-            alignment=TA_LEFT,
-            textColor=text_color,
-            spaceBefore=0,
-            spaceAfter=0,
+class ZipStreamBuffer(io.RawIOBase):
+    """Write-only sink for zipfile that hands written bytes back to a streaming response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def add_file_to_zip(zip_file: zipfile.ZipFile, path: Path, arcname: str):
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb") as src, zip_file.open(info, "w", force_zip64=True) as dst:
+        shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+
+async def stream_zip(entries):
+    """
+    Build a ZIP (store mode, no recompression) from an async iterator of (arcname, content)
+    pairs and yield it as it is written. content is a file path, which is deleted once
+    added, or bytes.
+    """
+    buffer = ZipStreamBuffer()
+    zip_file = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    async for arcname, content in entries:
+        if isinstance(content, bytes):
+            zip_file.writestr(arcname, content)
+        else:
+            await asyncio.to_thread(add_file_to_zip, zip_file, content, arcname)
+            cleanup_files(content)
+        yield buffer.drain()
+    zip_file.close()
+    yield buffer.drain()
+
+def parse_page_ranges(pages: str) -> List[int]:
+    """Parse page ranges like '1-3,5,7-9' into zero-based page indexes"""
+    page_list = []
+    for part in pages.split(','):
+        if not part.strip():
+            continue
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            page_list.extend(range(start - 1, end))
+        else:
+            page_list.append(int(part) - 1)
+    return page_list
+
+# Result cache configuration
+# Conversions are cached by (input hash, endpoint, parameters, library versions).
+# Bump RESULT_CACHE_VERSION whenever a cached renderer's output changes.
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+RESULT_CACHE_DIR = Path(os.environ.get('RESULT_CACHE_DIR', ROOT_DIR / 'result_cache'))
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', 1024))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 24 * 3600))
+RESULT_CACHE_VERSION = 5
+RESULT_CACHE_LIBRARIES = ('pypdf', 'PyMuPDF', 'pdf2docx', 'reportlab', 'Pygments', 'openpyxl', 'Pillow')
+
+def library_versions(packages=RESULT_CACHE_LIBRARIES) -> dict:
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+class ResultCache:
+    """
+    Disk-backed, content-addressed store of conversion outputs.
+
+    Entries are hard-linked from the finished output file when possible, so storing a
+    result costs no extra copy. Entries expire after ttl_seconds and the least recently
+    used ones are evicted once the store grows past max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl_seconds: int, versions: dict, enabled: bool = True):
+        self.enabled = enabled
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        """
+        Create the store and index entries left from a previous run, oldest first.
+        Called from the startup hook, so worker processes importing this module never
+        scan or evict the shared directory.
+        """
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.glob('*/*'):
+            if path.suffix or path.name in self._entries:
+                # Metadata sidecars, unfinished writes and entries already indexed
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        with self._lock:
+            # Ahead of anything stored since startup, oldest first
+            for created, path, size in sorted(files, reverse=True):
+                self._entries[path.name] = (path, size, created)
+                self._entries.move_to_end(path.name, last=False)
+                self._total_bytes += size
+            self._evict()
+
+    def key(self, endpoint: str, *input_hashes: str, **params) -> str:
+        """Build the cache key for an endpoint, its input content hashes and form parameters"""
+        payload = json.dumps({
+            'endpoint': endpoint,
+            'inputs': list(input_hashes),
+            'params': {name: value for name, value in params.items() if value is not None},
+            'versions': self.versions,
+            'cache_version': RESULT_CACHE_VERSION,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Path]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path, size, created = entry
+            if time.time() - created > self.ttl_seconds or not path.exists():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return path
+
+    def get_metadata(self, key: str) -> Optional[dict]:
+        """Return the metadata stored with an entry, if any"""
+        path = self.directory / key[:2] / f"{key}.json"
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, source: Path, metadata: Optional[dict] = None) -> Optional[Path]:
+        """Store a copy of source (and optional JSON metadata) under key; returns the cached path"""
+        if not self.enabled:
+            return None
+        path = self.directory / key[:2] / key
+        path.parent.mkdir(exist_ok=True)
+        if metadata is not None:
+            path.with_suffix('.json').write_text(json.dumps(metadata), encoding='utf-8')
+        tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not store result in cache: {e}")
+            cleanup_files(tmp_path)
+            return None
+        size = path.stat().st_size
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][1]
+            self._entries[key] = (path, size, time.time())
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._evict()
+        return path
+
+    def put_bytes(self, key: str, data: bytes, metadata: Optional[dict] = None) -> Optional[Path]:
+        """Store data under key, for results that are not produced as files"""
+        if not self.enabled:
+            return None
+        source = self.directory / f"{uuid.uuid4().hex}.tmp"
+        try:
+            source.write_bytes(data)
+            return self.put(key, source, metadata)
+        finally:
+            cleanup_files(source)
+
+    def _remove(self, key: str):
+        path, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        cleanup_files(path, path.with_suffix('.json'))
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, _, created) in self._entries.items() if now - created > self.ttl_seconds]:
+            self._remove(key)
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def metrics(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+result_cache = ResultCache(
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_MB * 1024 * 1024,
+    RESULT_CACHE_TTL_SECONDS,
+    library_versions(),
+    enabled=RESULT_CACHE_ENABLED,
+)
+
+def cached_result_response(cache_key: str, filename: str, media_type: str, *temp_files):
+    """Return a response for a cached result (cleaning up temp_files), or None on a miss"""
+    cached_file = result_cache.get(cache_key)
+    if cached_file is None:
+        return None
+    cleanup_files(*temp_files)
+    return create_file_response(cached_file, filename, media_type)
+
+async def store_cached_result(cache_key: str, output_file: Path, metadata: Optional[dict] = None):
+    """Copy a finished output into the result cache without blocking the event loop"""
+    if result_cache.enabled:
+        await asyncio.to_thread(result_cache.put, cache_key, output_file, metadata)
+
+# Document session configuration
+# A session keeps an uploaded PDF on disk (and its parsed reader warm) so page
+# tools can run several operations without re-uploading the file.
+DOCUMENT_SESSION_IDLE_SECONDS = int(os.environ.get('DOCUMENT_SESSION_IDLE_SECONDS', 30 * 60))
+DOCUMENT_SESSION_MAX = int(os.environ.get('DOCUMENT_SESSION_MAX', 200))
+
+@dataclass
+class DocumentSession:
+    document_id: str
+    path: Path
+    filename: str
+    sha256: Optional[str]
+    size: int
+    pages: List[dict]
+    revision: int = 1
+    last_access: float = 0.0
+
+    def info(self) -> dict:
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "size": self.size,
+            "revision": self.revision,
+            "total_pages": len(self.pages),
+            "pages": self.pages,
+        }
+
+class DocumentSessionStore:
+    """
+    Bounded registry of document sessions.
+
+    Sessions idle for longer than idle_seconds are evicted, as are the least recently
+    used ones once more than max_sessions are open. Evicting a session deletes its file.
+    A file that a request is still reading (see acquire()) is deleted once the last
+    such request finishes.
+    """
+
+    def __init__(self, idle_seconds: int, max_sessions: int):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._readers = {}
+        self._retired = set()
+
+    def create(self, upload: StoredUpload, filename: str, pages: List[dict]) -> DocumentSession:
+        session = DocumentSession(
+            document_id=uuid.uuid4().hex,
+            path=upload.path,
+            filename=filename,
+            sha256=upload.sha256,
+            size=upload.size,
+            pages=pages,
+            last_access=time.time(),
         )
-        story.append(Paragraph(safe, line_style))
+        scratch.hold(session.path)
+        self._sessions[session.document_id] = session
+        self.sweep()
+        return session
 
-    doc.build(story)
+    def get(self, document_id: str) -> DocumentSession:
+        self.sweep()
+        session = self._sessions.get(document_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Document not found or expired. Please upload it again.")
+        session.last_access = time.time()
+        self._sessions.move_to_end(document_id)
+        return session
 
-    
-@api_router.get("/")
-async def root():
-    return {"message": "PDF Master API"}
+    def acquire(self, session: DocumentSession) -> Path:
+        """Return the session's current file, kept on disk until release(path)"""
+        path = session.path
+        self._readers[path] = self._readers.get(path, 0) + 1
+        return path
 
-@api_router.api_route("/health", methods=["GET", "HEAD"])
-async def health_check():
-    """Health check endpoint for monitoring services like UptimeRobot"""
-    return {"status": "ok", "timestamp": datetime.now(timezone.utc).isoformat()}
+    def release(self, path: Path):
+        self._readers[path] -= 1
+        if not self._readers[path]:
+            del self._readers[path]
+            if path in self._retired:
+                self._retired.discard(path)
+                self._discard(path)
 
-@api_router.post("/merge")
-async def merge_pdfs(files: List[UploadFile] = File(...)):
-    """Merge multiple PDF files into one"""
-    temp_files = []
-    output_file = None
-    
-    try:
-        # Save all uploaded files
-        for file in files:
-            if not file.filename.lower().endswith('.pdf'):
-                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
-            temp_path = await save_upload_file(file)
-            temp_files.append(temp_path)
-        
-        # Merge PDFs
-        pdf_writer = PdfWriter()
-        for pdf_path in temp_files:
-            pdf_reader = PdfReader(str(pdf_path))
-            for page in pdf_reader.pages:
-                pdf_writer.add_page(page)
-        
-        # Save merged PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_merged.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
-        
-        # Use first file's name as base for output
-        output_filename = get_output_filename(files[0].filename, 'pdf', '_merged')
-        
-        # Return file
-        return create_file_response(
-            output_file,
-            output_filename,
-            "application/pdf",
-            lambda: cleanup_files(*temp_files, output_file)
+    @contextmanager
+    def reading(self, session: DocumentSession):
+        """Yield the session's current file, kept on disk until the block ends"""
+        path = self.acquire(session)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def _discard(self, path: Path):
+        """Delete a file no session uses any more, or retire it while it is being read"""
+        if path in self._readers:
+            self._retired.add(path)
+            return
+        forget_pdf_reader(path)
+        cleanup_files(path)
+
+    def replace(self, session: DocumentSession, path: Path, pages: List[dict]):
+        """Make path the session's current document, deleting the previous revision"""
+        old_path = session.path
+        scratch.hold(path)
+        session.path = path
+        session.pages = pages
+        session.size = path.stat().st_size
+        session.sha256 = None
+        session.revision += 1
+        self._discard(old_path)
+
+    def delete(self, document_id: str):
+        session = self._sessions.pop(document_id, None)
+        if session is not None:
+            self._discard(session.path)
+
+    def sweep(self):
+        now = time.time()
+        for document_id in [d for d, s in self._sessions.items() if now - s.last_access > self.idle_seconds]:
+            self.delete(document_id)
+        while len(self._sessions) > self.max_sessions:
+            self.delete(next(iter(self._sessions)))
+
+    def evict_oldest(self) -> int:
+        """Delete the least recently used session to free disk space; returns its size"""
+        if not self._sessions:
+            return 0
+        session = self._sessions[next(iter(self._sessions))]
+        self.delete(session.document_id)
+        return session.size
+
+    def close(self):
+        for document_id in list(self._sessions):
+            self.delete(document_id)
+
+document_sessions = DocumentSessionStore(DOCUMENT_SESSION_IDLE_SECONDS, DOCUMENT_SESSION_MAX)
+
+# Rendered page thumbnails, kept in memory and bounded by total size
+THUMBNAIL_CACHE_MB = int(os.environ.get('THUMBNAIL_CACHE_MB', 64))
+
+class ThumbnailCache:
+    """In-memory LRU of encoded thumbnails, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def get(self, key) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._total_bytes -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._total_bytes += len(data)
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted)
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_MB * 1024 * 1024)
+
+# Background job configuration
+# Long conversions can be submitted as jobs: the request returns a job id at once,
+# the work runs in a bounded scheduler, and clients poll or subscribe (SSE) for
+# progress and fetch the result when it is done.
+JOB_MAX_RUNNING = int(os.environ.get('JOB_MAX_RUNNING', WORKER_PROCESSES))
+JOB_MAX_RUNNING_PER_CLIENT = int(os.environ.get('JOB_MAX_RUNNING_PER_CLIENT', 2))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 500))
+JOB_MAX_QUEUED_PER_CLIENT = int(os.environ.get('JOB_MAX_QUEUED_PER_CLIENT', 50))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get('JOB_RESULT_TTL_SECONDS', 3600))
+JOB_PROGRESS_POLL_SECONDS = 0.5
+JOB_STORE = os.environ.get('JOB_STORE', 'auto')
+JOB_FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+
+class ProgressFile:
+    """
+    Progress channel from worker functions back to the job scheduler.
+
+    Workers may run in other processes, so progress is written to a small JSON file
+    (atomically, at most a few times per second) that the scheduler polls.
+    """
+
+    def __init__(self, path: Path, min_interval: float = 0.25):
+        self.path = path
+        self.min_interval = min_interval
+        self._last_write = 0.0
+
+    def update(self, done: int, total: Optional[int] = None, stage: Optional[str] = None):
+        now = time.monotonic()
+        if (total is None or done < total) and now - self._last_write < self.min_interval:
+            return
+        self._last_write = now
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"done": done, "total": total, "stage": stage}), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+    def read(self) -> Optional[dict]:
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+def report_progress(progress: Optional[ProgressFile], done: int, total: Optional[int] = None, stage: Optional[str] = None):
+    """Forward progress to a ProgressFile when the caller runs as a job"""
+    if progress is not None:
+        progress.update(done, total, stage)
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    client_id: str
+    priority: int
+    filename: str
+    media_type: str
+    run: Callable
+    input_files: List[Path]
+    output_file: Path
+    progress_file: ProgressFile
+    status: str = 'queued'
+    progress: Optional[dict] = None
+    error: Optional[str] = None
+    result_size: Optional[int] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def info(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": self.progress,
+            "error": self.error,
+            "filename": self.filename,
+            "result_size": self.result_size,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class MemoryJobStore:
+    """Keeps job records in this process only"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._records = {}
+
+    async def save(self, record: dict):
+        self._records[record["job_id"]] = record
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        return self._records.get(job_id)
+
+    async def delete(self, job_id: str):
+        self._records.pop(job_id, None)
+
+class MongoJobStore:
+    """
+    Keeps job records in MongoDB so any server process can report a job's state.
+
+    Records expire through a TTL index once their result has expired.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, collection, ttl_seconds: int):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def save(self, record: dict):
+        document = {
+            **record,
+            "expires_at": datetime.fromtimestamp(
+                (record["finished_at"] or record["created_at"]) + self.ttl_seconds, timezone.utc
+            ),
+        }
+        await self.collection.replace_one({"_id": record["job_id"]}, {"_id": record["job_id"], **document}, upsert=True)
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        document = await self.collection.find_one({"_id": job_id}, {"_id": 0, "expires_at": 0})
+        return document
+
+    async def delete(self, job_id: str):
+        await self.collection.delete_one({"_id": job_id})
+
+class JobScheduler:
+    """
+    Bounded, prioritized runner for background jobs.
+
+    At most max_running jobs run at once and at most max_running_per_client of them
+    belong to the same client; the next job is the highest-priority (then oldest)
+    queued job whose client is under its limit. Finished jobs keep their result for
+    result_ttl seconds. Job records are mirrored to a JobStore; the running state and
+    files stay in this process.
+    """
+
+    def __init__(self, max_running: int, max_running_per_client: int, max_queued: int,
+                 max_queued_per_client: int, result_ttl: int, store=None):
+        self.max_running = max(1, max_running)
+        self.max_running_per_client = max(1, max_running_per_client)
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.result_ttl = result_ttl
+        self.store = store or MemoryJobStore()
+        self._jobs = {}
+        self._queue = []
+        self._sequence = 0
+        self._tasks = {}
+        self._running_by_client = {}
+        self._changed = asyncio.Condition()
+
+    def _queued_for(self, client_id: str) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == 'queued' and job.client_id == client_id)
+
+    async def submit(self, kind: str, client_id: str, priority: int, run, input_files: List[Path],
+                     output_suffix: str, filename: str, media_type: str) -> Job:
+        """
+        Queue run(job) -> awaitable; it must write job.output_file and may report
+        progress through job.progress_file. input_files are deleted when the job ends.
+        """
+        await self.sweep()
+        if len(self._queue) >= self.max_queued:
+            raise HTTPException(status_code=503, detail="The job queue is full. Please try again later.")
+        if self._queued_for(client_id) >= self.max_queued_per_client:
+            raise HTTPException(status_code=429, detail="Too many queued jobs for this client.")
+        job_id = uuid.uuid4().hex
+        job = Job(
+            job_id=job_id,
+            kind=kind,
+            client_id=client_id,
+            priority=priority,
+            filename=filename,
+            media_type=media_type,
+            run=run,
+            input_files=list(input_files),
+            output_file=scratch.new_path(output_suffix),
+            progress_file=ProgressFile(scratch.new_path(".progress")),
+            created_at=time.time(),
         )
-    
+        scratch.hold(*job.input_files, job.output_file, job.progress_file.path)
+        self._jobs[job_id] = job
+        self._sequence += 1
+        heapq.heappush(self._queue, (-priority, self._sequence, job_id))
+        await self._save(job)
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """Start queued jobs while there is capacity"""
+        skipped = []
+        while self._queue and len(self._tasks) < self.max_running:
+            entry = heapq.heappop(self._queue)
+            job = self._jobs.get(entry[2])
+            if job is None or job.status != 'queued':
+                continue
+            if self._running_by_client.get(job.client_id, 0) >= self.max_running_per_client:
+                skipped.append(entry)
+                continue
+            self._running_by_client[job.client_id] = self._running_by_client.get(job.client_id, 0) + 1
+            job.status = 'running'
+            job.started_at = time.time()
+            # Created inside a fresh context, so the job does not inherit the workspace or
+            # operation record of the request (or previous job) that happened to dispatch it
+            self._tasks[job.job_id] = contextvars.Context().run(asyncio.create_task, self._run(job))
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    async def _run(self, job: Job):
+        await self._save(job)
+        watcher = asyncio.create_task(self._watch_progress(job))
+        try:
+            await job.run(job)
+            if job.status == 'running':
+                job.result_size = job.output_file.stat().st_size
+                job.status = 'succeeded'
+        except asyncio.CancelledError:
+            job.status = 'cancelling'
+        except Exception as e:
+            if job.status == 'running':
+                job.status = 'failed'
+                job.error = e.detail if isinstance(e, HTTPException) else str(e)
+        finally:
+            watcher.cancel()
+            if job.status == 'cancelling':
+                job.status = 'cancelled'
+            if job.status != 'succeeded':
+                cleanup_files(job.output_file)
+            job.finished_at = time.time()
+            self._read_progress(job)
+            cleanup_files(*job.input_files, job.progress_file.path)
+            self._tasks.pop(job.job_id, None)
+            self._running_by_client[job.client_id] -= 1
+            if not self._running_by_client[job.client_id]:
+                del self._running_by_client[job.client_id]
+            self._dispatch()
+        await self._save(job)
+
+    def _read_progress(self, job: Job) -> bool:
+        progress = job.progress_file.read()
+        if progress is None or progress == job.progress:
+            return False
+        job.progress = progress
+        return True
+
+    async def _watch_progress(self, job: Job):
+        while True:
+            await asyncio.sleep(JOB_PROGRESS_POLL_SECONDS)
+            if self._read_progress(job):
+                await self._save(job)
+
+    async def _save(self, job: Job):
+        record = job.info()
+        async with self._changed:
+            self._changed.notify_all()
+        try:
+            await self.store.save(record)
+        except Exception as e:
+            logging.warning(f"Could not store job {job.job_id} in {self.store.name} job store: {e}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def info(self, job_id: str) -> dict:
+        """Current record of a job, from this process or the job store"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.info()
+        record = None
+        try:
+            record = await self.store.load(job_id)
+        except Exception as e:
+            logging.warning(f"Could not load job {job_id} from {self.store.name} job store: {e}")
+        if record is None:
+            raise HTTPException(status_code=404, detail="Job not found or expired.")
+        return record
+
+    async def wait_for_change(self, timeout: float):
+        """Wait until any job changes state or progress, or timeout passes"""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cancel(self, job_id: str) -> str:
+        """Cancel a queued or running job, or discard a finished job's result; returns the new status"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found or expired.")
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            # Drop the heap entry now so it stops counting against max_queued
+            self._queue = [entry for entry in self._queue if entry[2] != job_id]
+            heapq.heapify(self._queue)
+            cleanup_files(*job.input_files)
+            await self._save(job)
+        elif job.status == 'running':
+            # Work already handed to the worker pool cannot be interrupted, so the job
+            # keeps its slot until the worker returns and its output is then discarded
+            job.status = 'cancelling'
+            await self._save(job)
+        elif job.status in JOB_FINISHED_STATES:
+            await self._forget(job)
+            return 'deleted'
+        return job.status
+
+    async def _forget(self, job: Job):
+        self._jobs.pop(job.job_id, None)
+        cleanup_files(*job.input_files, job.output_file, job.progress_file.path)
+        try:
+            await self.store.delete(job.job_id)
+        except Exception as e:
+            logging.warning(f"Could not delete job {job.job_id} from {self.store.name} job store: {e}")
+
+    async def sweep(self):
+        """Forget finished jobs whose result has expired"""
+        now = time.time()
+        for job in [j for j in self._jobs.values() if j.status in JOB_FINISHED_STATES]:
+            if now - job.finished_at > self.result_ttl:
+                await self._forget(job)
+
+    def metrics(self) -> dict:
+        counts = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "store": self.store.name,
+            "max_running": self.max_running,
+            "max_running_per_client": self.max_running_per_client,
+            "running": len(self._tasks),
+            "queued": counts.get('queued', 0),
+            "jobs": counts,
+        }
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        for job in list(self._jobs.values()):
+            cleanup_files(*job.input_files, job.output_file, job.progress_file.path)
+        self._jobs.clear()
+
+job_scheduler = JobScheduler(
+    JOB_MAX_RUNNING,
+    JOB_MAX_RUNNING_PER_CLIENT,
+    JOB_MAX_QUEUED,
+    JOB_MAX_QUEUED_PER_CLIENT,
+    JOB_RESULT_TTL_SECONDS,
+)
+
+# Operation metadata
+# Every tool request is recorded (endpoint, status, request/response bytes, pages,
+# duration) without blocking it: records are queued and written to MongoDB in
+# batches by a background task, or kept in a ring buffer when MongoDB is unavailable.
+OPERATION_LOG_BATCH_SIZE = int(os.environ.get('OPERATION_LOG_BATCH_SIZE', 100))
+OPERATION_LOG_FLUSH_SECONDS = float(os.environ.get('OPERATION_LOG_FLUSH_SECONDS', 2))
+OPERATION_LOG_QUEUE_SIZE = int(os.environ.get('OPERATION_LOG_QUEUE_SIZE', 10000))
+OPERATION_LOG_BUFFER_SIZE = int(os.environ.get('OPERATION_LOG_BUFFER_SIZE', 1000))
+OPERATION_LOG_RETRY_SECONDS = 30
+
+# The record of the request being handled, so handlers can add details such as pages
+current_operation = contextvars.ContextVar('current_operation', default=None)
+
+def note_operation(**details):
+    """Add details (e.g. pages=12) to the current request's operation record"""
+    record = current_operation.get()
+    if record is not None:
+        record.update(details)
+
+class OperationLog:
+    """Batched, non-blocking writer of operation records to MongoDB with an in-memory fallback"""
+
+    def __init__(self, connection: MongoConnection, batch_size: int, flush_seconds: float, queue_size: int, buffer_size: int):
+        self.connection = connection
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.recent = deque(maxlen=buffer_size)
+        self.stats = {'recorded': 0, 'written': 0, 'buffered': 0, 'dropped': 0, 'failed_batches': 0}
+        self.queue_size = queue_size
+        self._queue = None
+        self._task = None
+        self._retry_at = 0.0
+
+    def record(self, entry: dict):
+        """Queue a record for writing; drops it (and counts the drop) if the queue is full"""
+        if self._queue is None:
+            self.recent.append(entry)
+            self.stats['recorded'] += 1
+            self.stats['buffered'] += 1
+            return
+        try:
+            self._queue.put_nowait(entry)
+            self.stats['recorded'] += 1
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size and loop.time() < deadline:
+                if self._queue.empty():
+                    await asyncio.sleep(min(0.05, self.flush_seconds))
+                else:
+                    batch.append(self._queue.get_nowait())
+            await self._write(batch)
+
+    async def _write(self, batch: List[dict]):
+        if self.connection.db is not None and time.monotonic() >= self._retry_at:
+            try:
+                # insert_many adds an _id to what it inserts, so give it copies
+                await self.connection.db.operations.insert_many([dict(entry) for entry in batch], ordered=False)
+                self.stats['written'] += len(batch)
+                return
+            except Exception as e:
+                logging.warning(f"Could not write {len(batch)} operation records to MongoDB: {e}")
+                self.stats['failed_batches'] += 1
+                self._retry_at = time.monotonic() + OPERATION_LOG_RETRY_SECONDS
+        self.recent.extend(batch)
+        self.stats['buffered'] += len(batch)
+
+    async def close(self):
+        """Stop the writer and flush whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        remaining = []
+        while self._queue is not None and not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        self._queue = None
+        if remaining:
+            await self._write(remaining)
+
+    def metrics(self, limit: int = 50) -> dict:
+        recent = list(self.recent)[-limit:] if limit > 0 else []
+        return {
+            **self.stats,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'store': 'mongodb' if self.connection.available else 'memory',
+            'recent': [{**entry, 'timestamp': entry['timestamp'].isoformat()} for entry in recent],
+        }
+
+operation_log = OperationLog(
+    mongo, OPERATION_LOG_BATCH_SIZE, OPERATION_LOG_FLUSH_SECONDS, OPERATION_LOG_QUEUE_SIZE, OPERATION_LOG_BUFFER_SIZE
+)
+
+class OperationLogMiddleware:
+    """Records endpoint, status, request/response bytes and duration of every POST to the API"""
+
+    def __init__(self, app, operation_log: OperationLog, prefix: str = "/api/"):
+        self.app = app
+        self.operation_log = operation_log
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        
+        record = {}
+        token = current_operation.set(record)
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        status = 500
+        
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+        
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+        
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            current_operation.reset(token)
+            route = scope.get("route")
+            record.update(
+                endpoint=route.path if route is not None else scope["path"],
+                status=status,
+                input_bytes=received,
+                output_bytes=sent,
+                duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                timestamp=datetime.now(timezone.utc),
+            )
+            self.operation_log.record(record)
+
+# Code rendering settings
+# Source files are drawn straight onto the canvas as monospace text objects;
+# every row has the same height, so pagination is plain arithmetic.
+CODE_FONT = "Courier"
+CODE_FONT_SIZE = 9
+CODE_LEADING = 11
+CODE_MARGIN = 50
+CODE_TAB_SIZE = 4
+CODE_GUTTER_COLOR = HexColor('#9e9e9e')
+CODE_TEXT_COLOR = HexColor('#000000')
+CODE_TRAILING_WHITESPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+
+# Colors for pygments token types; a token takes the color of its closest
+# listed ancestor, e.g. String.Double -> String.
+CODE_TOKEN_COLORS = {
+    Token: CODE_TEXT_COLOR,
+    Comment: HexColor('#2e7d32'),            # green for comments
+    Comment.Preproc: HexColor('#1565c0'),    # blue for #include, #define
+    Comment.PreprocFile: HexColor('#b5490a'),
+    Keyword: HexColor('#1565c0'),            # blue for keywords
+    Operator.Word: HexColor('#1565c0'),
+    Name.Builtin: HexColor('#1565c0'),
+    Name.Tag: HexColor('#1565c0'),
+    String: HexColor('#b5490a'),             # orange for strings
+    Number: HexColor('#7b1fa2'),             # purple for numbers
+    Name.Attribute: HexColor('#7b1fa2'),
+}
+
+@functools.lru_cache(maxsize=None)
+def get_token_color(token_type):
+    """Resolve a pygments token type to its rendering color"""
+    while token_type not in CODE_TOKEN_COLORS:
+        token_type = token_type.parent
+    return CODE_TOKEN_COLORS[token_type]
+
+@functools.lru_cache(maxsize=32)
+def get_code_lexer(language: str):
+    """Return a shared pygments lexer for a language alias such as 'cpp' or 'python'"""
+    try:
+        return get_lexer_by_name(language, stripnl=False)
+    except ClassNotFound:
+        return TextLexer(stripnl=False)
+
+def iter_code_spans(code_text: str, language: str, color_mode: str):
+    """Yield (color, text) spans, merging consecutive tokens of the same color"""
+    if color_mode != "colorful":
+        yield CODE_TEXT_COLOR, code_text
+        return
+    lexer = get_code_lexer(language)
+    span_color = None
+    span_parts = []
+    for token_type, value in lexer.get_tokens(code_text):
+        color = get_token_color(token_type)
+        if color is not span_color and span_parts:
+            yield span_color, ''.join(span_parts)
+            span_parts = []
+        span_color = color
+        span_parts.append(value)
+    if span_parts:
+        yield span_color, ''.join(span_parts)
+
+def iter_code_rows(spans, columns: int):
+    """Split spans into rows of at most `columns` characters.
+
+    Yields (line_number, spans) for the first row of every source line and
+    (None, spans) for its wrapped continuation rows.
+    """
+    line_number = 1
+    label = 1
+    row = []
+    width = 0
+    for color, text in spans:
+        for index, part in enumerate(text.split('\n')):
+            if index:
+                yield label, row
+                line_number += 1
+                label = line_number
+                row = []
+                width = 0
+            while part:
+                if width == columns:
+                    yield label, row
+                    label = None
+                    row = []
+                    width = 0
+                piece = part[:columns - width]
+                part = part[len(piece):]
+                if row and row[-1][0] is color:
+                    row[-1] = (color, row[-1][1] + piece)
+                else:
+                    row.append((color, piece))
+                width += len(piece)
+    if row:
+        yield label, row
+
+def build_code_pdf(code_text: str, output_path: Path, color_mode: str = "bw", language: str = "text"):
+    """Render source code to PDF. color_mode: 'bw' or 'colorful'"""
+    page_width, page_height = letter
+    code_text = CODE_TRAILING_WHITESPACE.sub('', code_text.expandtabs(CODE_TAB_SIZE))
+    if not code_text.endswith('\n'):
+        code_text += '\n'
+
+    # Layout: "<line number>  <code>", long lines wrap under the code column
+    char_width = pdfmetrics.stringWidth(' ', CODE_FONT, CODE_FONT_SIZE)
+    number_width = len(str(code_text.count('\n')))
+    gutter_width = (number_width + 2) * char_width
+    columns = max(1, int((page_width - 2 * CODE_MARGIN - gutter_width) // char_width))
+    rows_per_page = max(1, int((page_height - 2 * CODE_MARGIN) // CODE_LEADING))
+    first_baseline = page_height - CODE_MARGIN - CODE_FONT_SIZE
+
+    pdf = canvas.Canvas(str(output_path), pagesize=letter)
+    gutter = code = None
+    rows = rows_per_page
+
+    for label, spans in iter_code_rows(iter_code_spans(code_text, language, color_mode), columns):
+        if rows == rows_per_page:
+            if code is not None:
+                pdf.drawText(gutter)
+                pdf.drawText(code)
+                pdf.showPage()
+            gutter = pdf.beginText(CODE_MARGIN, first_baseline)
+            gutter.setFont(CODE_FONT, CODE_FONT_SIZE, CODE_LEADING)
+            gutter.setFillColor(CODE_GUTTER_COLOR)
+            code = pdf.beginText(CODE_MARGIN + gutter_width, first_baseline)
+            code.setFont(CODE_FONT, CODE_FONT_SIZE, CODE_LEADING)
+            code_color = None
+            rows = 0
+        gutter.textLine(str(label).rjust(number_width) if label else '')
+        for color, text in spans:
+            if color is not code_color:
+                code.setFillColor(color)
+                code_color = color
+            code.textOut(text)
+        code.textLine('')
+        rows += 1
+
+    if code is not None:
+        pdf.drawText(gutter)
+        pdf.drawText(code)
+    pdf.save()
+
+def read_code_file(input_path: Path, pretty_xml: bool = False) -> str:
+    """Read an uploaded source file as UTF-8, re-indented first when pretty_xml is set"""
+    try:
+        if pretty_xml:
+            root = ET.parse(str(input_path)).getroot()
+            return minidom.parseString(ET.tostring(root, encoding='unicode')).toprettyxml(indent="  ")
+        with open(input_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        raise InvalidInputError("File must be UTF-8 encoded.")
+    except ET.ParseError as e:
+        raise InvalidInputError(f"Invalid XML file: {str(e)}")
+
+def code_file_to_pdf(input_path: Path, output_path: Path, color_mode: str = "bw",
+                     language: str = "text", pretty_xml: bool = False):
+    """Read a source file and render it with build_code_pdf, both inside the worker"""
+    build_code_pdf(read_code_file(input_path, pretty_xml), output_path, color_mode, language)
+
+# Worker functions
+# These run inside the worker pool, so they only take picklable arguments (paths,
+# strings, numbers) and write their result to output_path.
+
+# Parsed readers for document session files, kept per process so repeated
+# operations on the same session skip re-parsing the file and its xref table.
+# pypdf resolves objects lazily through the reader's one file handle, so each
+# cached reader has a lock that is held for as long as an operation uses it.
+READER_CACHE_SIZE = int(os.environ.get('READER_CACHE_SIZE', 8))
+_reader_cache = OrderedDict()
+_reader_cache_lock = threading.Lock()
+
+@contextmanager
+def open_pdf_reader(input_path: Path, cached: bool = False):
+    """
+    Yield a PdfReader, optionally reusing a parsed copy from this process's cache.
+
+    Cached readers are shared, so callers must not modify their pages; add pages
+    to a PdfWriter first and change the writer's copy instead, and finish writing
+    inside the block, since the writer still reads page content from the reader.
+    """
+    if not cached:
+        yield PdfReader(str(input_path))
+        return
+    stat = Path(input_path).stat()
+    key = (str(input_path), stat.st_mtime_ns, stat.st_size)
+    with _reader_cache_lock:
+        entry = _reader_cache.get(key)
+        if entry is not None:
+            _reader_cache.move_to_end(key)
+    if entry is None:
+        parsed = (PdfReader(str(input_path)), threading.Lock())
+        with _reader_cache_lock:
+            # Another thread may have parsed the same file meanwhile; keep its reader
+            entry = _reader_cache.setdefault(key, parsed)
+            while len(_reader_cache) > READER_CACHE_SIZE:
+                _reader_cache.popitem(last=False)
+    reader, lock = entry
+    with lock:
+        yield reader
+
+def forget_pdf_reader(input_path: Path):
+    """Drop every cached reader for input_path"""
+    with _reader_cache_lock:
+        for key in [k for k in _reader_cache if k[0] == str(input_path)]:
+            del _reader_cache[key]
+
+def describe_pdf_file(input_path: Path, cached: bool = False) -> List[dict]:
+    """Return the number and size (in points) of every page"""
+    with open_pdf_reader(input_path, cached) as pdf_reader:
+        return [
+            {
+                "page_number": page_num + 1,
+                "width": float(page.mediabox.width),
+                "height": float(page.mediabox.height),
+                "rotation": page.rotation,
+            }
+            for page_num, page in enumerate(pdf_reader.pages)
+        ]
+
+def append_pdf_pages(pdf_writer: PdfWriter, input_paths: List[Path], progress: Optional[ProgressFile] = None):
+    """Add every page of the PDFs at input_paths to pdf_writer, in order"""
+    pdf_readers = [PdfReader(str(pdf_path)) for pdf_path in input_paths]
+    total_pages = len(pdf_writer.pages) + sum(len(pdf_reader.pages) for pdf_reader in pdf_readers)
+    for pdf_reader in pdf_readers:
+        for page in pdf_reader.pages:
+            pdf_writer.add_page(page)
+            report_progress(progress, len(pdf_writer.pages), total_pages, "merging pages")
+
+# Merging appends finished inputs to the output file once this many input bytes are
+# pending, so memory stays bounded however large the merge is
+MERGE_FLUSH_MB = int(os.environ.get('MERGE_FLUSH_MB', 256))
+# Objects that stay distinct when merging even if their content matches another's:
+# these types, and any dictionary with one of these keys (annotations, form fields,
+# structure elements and outline items point back at their parent or page)
+MERGE_UNIQUE_TYPES = ("/Catalog", "/Pages", "/Page", "/Outlines", "/Annot")
+MERGE_UNIQUE_KEYS = frozenset(("Parent", "P", "Rect", "Kids", "First", "Last", "FT", "StructParent", "StructParents"))
+# Tokens of PDF object source: "(" opening a string literal, a hex string, a name, or
+# an indirect reference ("12 0 R") standing on its own
+PDF_OBJECT_TOKEN = re.compile(
+    r"(\()|(?<!<)<(?!<)|/[^\s()<>\[\]{}/%]*"
+    r"|(?<![^\s()<>\[\]{}/%])(\d+)\s+\d+\s+R(?![^\s()<>\[\]{}/%])"
+)
+
+def pdf_reference_spans(source: str) -> List[tuple]:
+    """(start, end, xref) of each indirect reference in PDF object source, skipping strings and names"""
+    spans = []
+    position = 0
+    while True:
+        match = PDF_OBJECT_TOKEN.search(source, position)
+        if match is None:
+            return spans
+        position = match.end()
+        if match.group(2):
+            spans.append((match.start(), position, int(match.group(2))))
+        elif match.group(1):
+            depth = 1
+            while depth and position < len(source):
+                char = source[position]
+                if char == '\\':
+                    position += 1
+                elif char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                position += 1
+        elif match.group(0) == '<':
+            position = source.find('>', position) + 1 or len(source)
+
+def pdf_object_entries(pdf_document, xref: int) -> List[tuple]:
+    """
+    The top-level (key, type, value, reference spans) entries of an object, typed by
+    xref_get_key. References nested in dict and array values are located with
+    pdf_reference_spans; an object that is not a dictionary is one entry with key None.
+    """
+    keys = pdf_document.xref_get_keys(xref)
+    if not keys:
+        source = pdf_document.xref_object(xref, compressed=True)
+        return [(None, None, source, pdf_reference_spans(source))]
+    entries = []
+    for key in keys:
+        kind, value = pdf_document.xref_get_key(xref, key)
+        if kind == "xref":
+            spans = [(0, len(value), int(value.split()[0]))]
+        elif kind in ("dict", "array"):
+            spans = pdf_reference_spans(value)
+        else:
+            spans = []
+        entries.append((key, kind, value, spans))
+    return entries
+
+def remap_pdf_references(value: str, spans: List[tuple], target: Callable[[int], int]) -> str:
+    """value with each reference in spans pointed at target(xref)"""
+    pieces = []
+    last = 0
+    for start, end, xref in spans:
+        new_xref = target(xref)
+        if new_xref != xref:
+            pieces.append(value[last:start])
+            pieces.append(f"{new_xref} 0 R")
+            last = end
+    if not pieces:
+        return value
+    pieces.append(value[last:])
+    return "".join(pieces)
+
+def is_unique_pdf_object(entries: List[tuple]) -> bool:
+    for key, kind, value, spans in entries:
+        if key in MERGE_UNIQUE_KEYS or (key == "Type" and value in MERGE_UNIQUE_TYPES):
+            return True
+    return False
+
+def dedupe_pdf_objects(pdf_document, entries: dict, seen: dict, stream_hashes: dict) -> dict:
+    """
+    Find objects in entries ({xref: pdf_object_entries}) that are identical to an object
+    in seen (or an earlier one in entries) and return a {duplicate: original} mapping.
+    
+    An object is keyed by its entries, with references to known duplicates pointed at
+    their originals, plus a hash of its raw stream. Matching repeats until nothing new
+    is found, so once a font file matches, the descriptor and font dict pointing at it
+    match too. Keys of the objects that stay are added to seen.
+    """
+    duplicates = {}
+    candidates = [xref for xref, object_entries in entries.items() if not is_unique_pdf_object(object_entries)]
+    
+    def original(xref: int) -> int:
+        while xref in duplicates:
+            xref = duplicates[xref]
+        return xref
+    
+    while True:
+        keys = {}
+        found = {}
+        for xref in candidates:
+            if xref in duplicates:
+                continue
+            key = hashlib.sha256(repr([
+                (name, kind, remap_pdf_references(value, spans, original))
+                for name, kind, value, spans in entries[xref]
+            ]).encode())
+            if pdf_document.xref_is_stream(xref):
+                if xref not in stream_hashes:
+                    stream_hashes[xref] = hashlib.sha256(pdf_document.xref_stream_raw(xref)).digest()
+                key.update(stream_hashes[xref])
+            key = key.digest()
+            match = seen.get(key) or keys.setdefault(key, xref)
+            if match != xref:
+                found[xref] = match
+        if not found:
+            for key, xref in keys.items():
+                seen.setdefault(key, xref)
+            return {xref: original(xref) for xref in duplicates}
+        duplicates.update(found)
+
+def merge_pdf_files(input_paths: List[Path], output_path: Path, progress: Optional[ProgressFile] = None):
+    """
+    Merge PDFs in order into output_path, keeping their outlines.
+    
+    Inputs are opened one at a time and closed once their pages are copied. Objects
+    identical to ones already merged (fonts, images, color profiles, shared content)
+    are deduplicated as each input is added: references are pointed at the first copy
+    and the duplicate streams emptied. Whenever MERGE_FLUSH_MB of input is pending, the
+    merged document is appended to output_path with an incremental save and reopened
+    from it, so memory is bounded by the flush size rather than the total input; a
+    final save compacts the file and drops the emptied duplicates.
+    """
+    import fitz
+    total_inputs = len(input_paths)
+    flush_bytes = MERGE_FLUSH_MB * 1024 * 1024
+    compact_path = output_path.with_name(f"{output_path.name}.compact")
+    seen = {}
+    stream_hashes = {}
+    outline = []
+    pending_bytes = 0
+    flushed = False
+    merged = fitz.open()
+    
+    try:
+        for index, input_path in enumerate(input_paths):
+            first_xref = merged.xref_length()
+            page_offset = merged.page_count
+            try:
+                source = fitz.open(str(input_path))
+            except Exception:
+                raise InvalidInputError(f"File {index + 1} is not a valid PDF")
+            with source:
+                if source.needs_pass:
+                    raise InvalidInputError(f"File {index + 1} is password protected")
+                merged.insert_pdf(source)
+                outline.extend(
+                    [level, title, page_offset + max(page, 1)] for level, title, page in source.get_toc()
+                )
+            
+            entries = {xref: pdf_object_entries(merged, xref) for xref in range(first_xref, merged.xref_length())}
+            duplicates = dedupe_pdf_objects(merged, entries, seen, stream_hashes)
+            if duplicates:
+                def target(xref: int) -> int:
+                    return duplicates.get(xref, xref)
+                for xref, object_entries in entries.items():
+                    if xref in duplicates:
+                        continue
+                    for key, kind, value, spans in object_entries:
+                        remapped = remap_pdf_references(value, spans, target)
+                        if remapped == value:
+                            continue
+                        if key is None:
+                            merged.update_object(xref, remapped)
+                        else:
+                            merged.xref_set_key(xref, key, remapped)
+                for xref in duplicates:
+                    if stream_hashes.pop(xref, None) is not None:
+                        merged.update_stream(xref, b"", compress=0)
+            
+            # Duplicates are emptied before the flush, so their content is never written
+            pending_bytes += Path(input_path).stat().st_size
+            if pending_bytes >= flush_bytes and index + 1 < total_inputs:
+                if flushed:
+                    merged.saveIncr()
+                else:
+                    merged.save(str(output_path))
+                merged.close()
+                merged = fitz.open(str(output_path))
+                flushed = True
+                pending_bytes = 0
+            report_progress(progress, index + 1, total_inputs, "merging files")
+        
+        if outline:
+            merged.set_toc(outline)
+        report_progress(progress, total_inputs, total_inputs, "writing")
+        # Unreferenced duplicates are dropped and the xref table compacted on save
+        if flushed:
+            merged.save(str(compact_path), garbage=2, deflate=True, use_objstms=1)
+            merged.close()
+            os.replace(compact_path, output_path)
+        else:
+            merged.save(str(output_path), garbage=2, deflate=True, use_objstms=1)
+    finally:
+        if not merged.is_closed:
+            merged.close()
+        remove_path(compact_path)
+
+def split_pdf_file(input_path: Path, output_path: Path, page_list: List[int]):
+    """Write the zero-based pages in page_list to output_path, skipping out-of-range pages"""
+    pdf_reader = PdfReader(str(input_path))
+    pdf_writer = PdfWriter()
+    for page_num in page_list:
+        if 0 <= page_num < len(pdf_reader.pages):
+            pdf_writer.add_page(pdf_reader.pages[page_num])
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+# Compression presets: images above 1.5x the target DPI are downsampled to it and
+# re-encoded as JPEG at the given quality
+COMPRESSION_PRESETS = {
+    "screen": {"dpi": 72, "quality": 40},
+    "ebook": {"dpi": 150, "quality": 60},
+    "print": {"dpi": 300, "quality": 80},
+}
+
+def pdf_size_breakdown(input_path: Path) -> dict:
+    """Split a PDF's file size into images, fonts, page content and everything else (bytes)"""
+    import fitz
+    sizes = {"images": 0, "fonts": 0, "content": 0}
+    with fitz.open(str(input_path)) as pdf_document:
+        content_xrefs = {xref for page in pdf_document for xref in page.get_contents()}
+        font_xrefs = set()
+        for xref in range(1, pdf_document.xref_length()):
+            if pdf_document.xref_get_key(xref, "Type")[1] == "/FontDescriptor":
+                for key in ("FontFile", "FontFile2", "FontFile3"):
+                    kind, value = pdf_document.xref_get_key(xref, key)
+                    if kind == "xref":
+                        font_xrefs.add(int(value.split()[0]))
+        for xref in range(1, pdf_document.xref_length()):
+            if not pdf_document.xref_is_stream(xref):
+                continue
+            if pdf_document.xref_get_key(xref, "Subtype")[1] == "/Image":
+                category = "images"
+            elif xref in font_xrefs:
+                category = "fonts"
+            elif xref in content_xrefs:
+                category = "content"
+            else:
+                continue
+            sizes[category] += len(pdf_document.xref_stream_raw(xref))
+    total = Path(input_path).stat().st_size
+    sizes["other"] = max(0, total - sum(sizes.values()))
+    sizes["total"] = total
+    return sizes
+
+# fitz save options for compressed output: merge identical objects, drop unused ones
+# and write the rest into compressed object streams
+COMPRESSION_SAVE_OPTIONS = dict(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, use_objstms=1)
+
+def shrink_pdf_document(pdf_document, preset: str = "ebook", grayscale: bool = False):
+    """Downsample and re-encode the images of an open fitz document per the preset and subset its fonts"""
+    settings = COMPRESSION_PRESETS[preset]
+    pdf_document.rewrite_images(
+        dpi_threshold=int(settings["dpi"] * 1.5),
+        dpi_target=settings["dpi"],
+        quality=settings["quality"],
+        set_to_gray=grayscale,
+    )
+    try:
+        pdf_document.subset_fonts()
+    except Exception as e:
+        logging.warning(f"Font subsetting skipped: {e}")
+
+def compress_pdf_file(input_path: Path, output_path: Path, preset: str = "ebook", grayscale: bool = False) -> dict:
+    """
+    Shrink a PDF and report its size per category before and after.
+    
+    Images are downsampled and re-encoded per the preset, fonts are subset, identical
+    objects are merged, unused objects dropped and the rest written into compressed
+    object streams. If the result is not smaller, the original is kept.
+    """
+    import fitz
+    before = pdf_size_breakdown(input_path)
+    
+    with fitz.open(str(input_path)) as pdf_document:
+        shrink_pdf_document(pdf_document, preset, grayscale)
+        pdf_document.save(str(output_path), **COMPRESSION_SAVE_OPTIONS)
+    
+    after = pdf_size_breakdown(output_path)
+    if after["total"] >= before["total"]:
+        shutil.copyfile(input_path, output_path)
+        after = before
+    return {"preset": preset, "grayscale": grayscale, "before": before, "after": after}
+
+def rotate_pdf_file(input_path: Path, output_path: Path, angle: int, cached: bool = False):
+    """Rotate every page by angle degrees"""
+    with open_pdf_reader(input_path, cached) as pdf_reader:
+        pdf_writer = PdfWriter()
+        for page in pdf_reader.pages:
+            pdf_writer.add_page(page).rotate(angle)
+        with open(output_path, "wb") as f:
+            pdf_writer.write(f)
+
+def count_pdf_pages(input_path: Path) -> int:
+    import fitz
+    with fitz.open(str(input_path)) as pdf_document:
+        return len(pdf_document)
+
+def rasterize_pdf_pages(
+    input_path: Path,
+    output_dir: Path,
+    page_indexes: List[int],
+    image_format: str = "jpg",
+    dpi: int = 144,
+    colorspace: str = "rgb",
+    quality: int = 95
+) -> List[Path]:
+    """Render the given pages to image files in output_dir, one file per page, in order"""
+    import fitz
+    cs = fitz.csGRAY if colorspace == "gray" else fitz.csRGB
+    output_paths = []
+    with fitz.open(str(input_path)) as pdf_document:
+        for page_index in page_indexes:
+            pix = pdf_document[page_index].get_pixmap(dpi=dpi, colorspace=cs, alpha=False)
+            output_path = output_dir / f"page_{page_index + 1}.{image_format}"
+            if image_format == "jpg":
+                pix.save(str(output_path), jpg_quality=quality)
+            else:
+                pix.save(str(output_path))
+            output_paths.append(output_path)
+    return output_paths
+
+def render_page_previews(input_path: Path, zoom: float = 1.5) -> List[dict]:
+    """Render every page to a base64 PNG data URL"""
+    import fitz
+    import base64
+    previews = []
+    with fitz.open(str(input_path)) as pdf_document:
+        for page_num in range(len(pdf_document)):
+            pix = pdf_document[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            img_base64 = base64.b64encode(pix.tobytes("png")).decode('utf-8')
+            previews.append({
+                "page_number": page_num + 1,
+                "imageData": f"data:image/png;base64,{img_base64}",
+                "width": pix.width,
+                "height": pix.height
+            })
+    return previews
+
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+def render_page_thumbnail(input_path: Path, page_index: int, scale: float, image_format: str, quality: int) -> bytes:
+    """Render one page at the given scale and encode it as WebP, JPEG or PNG"""
+    import fitz
+    with fitz.open(str(input_path)) as pdf_document:
+        pix = pdf_document[page_index].get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    if image_format == "png":
+        return pix.tobytes("png")
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    buffer = io.BytesIO()
+    img.save(buffer, format=THUMBNAIL_FORMATS[image_format][0], quality=quality)
+    return buffer.getvalue()
+
+def image_to_pdf_file(input_path: Path, output_path: Path):
+    """Wrap a JPG/PNG image in a PDF without re-encoding it"""
+    import img2pdf
+    with open(output_path, "wb") as f:
+        f.write(img2pdf.convert(str(input_path)))
+
+class Pdf2DocxProgressHandler(logging.Handler):
+    """Turn pdf2docx's '(i/n) Page p' log records from this thread into progress updates"""
+
+    STAGES = {'[3/4]': "parsing pages", '[4/4]': "creating pages"}
+
+    def __init__(self, progress: ProgressFile):
+        super().__init__(level=logging.INFO)
+        self.progress = progress
+        self.thread = threading.get_ident()
+        self.stage = None
+
+    def emit(self, record):
+        if record.thread != self.thread:
+            return
+        message = str(record.msg)
+        for marker, stage in self.STAGES.items():
+            if marker in message:
+                self.stage = stage
+        if self.stage and message.startswith('(%d/%d) Page') and len(record.args) == 3:
+            done, total, _ = record.args
+            self.progress.update(done, total, self.stage)
+
+def pdf_to_docx_file(input_path: Path, output_path: Path, progress: Optional[ProgressFile] = None,
+                     pages: Optional[List[int]] = None):
+    """Convert a PDF (or only the given zero-based pages) to DOCX with pdf2docx"""
+    from pdf2docx import Converter
+    handler = Pdf2DocxProgressHandler(progress) if progress is not None else None
+    if handler:
+        logging.getLogger().addHandler(handler)
+    cv = Converter(str(input_path))
+    try:
+        cv.convert(str(output_path), pages=pages)
+    finally:
+        cv.close()
+        if handler:
+            logging.getLogger().removeHandler(handler)
+
+DOCX_RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+def copy_docx_styles(source, target):
+    """Add the styles of source that target does not define"""
+    from docx.oxml.ns import qn
+    target_styles = target.styles.element
+    known = {style.get(qn('w:styleId')) for style in target_styles.findall(qn('w:style'))}
+    for style in source.styles.element.findall(qn('w:style')):
+        if style.get(qn('w:styleId')) not in known:
+            target_styles.append(copy.deepcopy(style))
+
+def copy_docx_numbering(source, target) -> dict:
+    """Copy the list definitions used in source's body into target; returns {old numId: new numId}"""
+    from docx.oxml.ns import qn
+    used = {num_id.get(qn('w:val')) for num_id in source.element.body.iter(qn('w:numId'))} - {'0'}
+    if not used:
+        return {}
+    source_numbering = source.part.numbering_part.element
+    target_numbering = target.part.numbering_part.element
+    abstracts = {a.get(qn('w:abstractNumId')): a for a in source_numbering.findall(qn('w:abstractNum'))}
+    next_abstract_id = max((int(a.get(qn('w:abstractNumId'))) for a in target_numbering.findall(qn('w:abstractNum'))), default=-1) + 1
+    next_num_id = max((int(n.get(qn('w:numId'))) for n in target_numbering.findall(qn('w:num'))), default=0) + 1
+    
+    mapping = {}
+    for num in source_numbering.findall(qn('w:num')):
+        if num.get(qn('w:numId')) not in used:
+            continue
+        abstract = copy.deepcopy(abstracts[num.find(qn('w:abstractNumId')).get(qn('w:val'))])
+        abstract.set(qn('w:abstractNumId'), str(next_abstract_id))
+        # Every abstractNum must come before the first num
+        first_num = target_numbering.find(qn('w:num'))
+        if first_num is not None:
+            first_num.addprevious(abstract)
+        else:
+            target_numbering.append(abstract)
+        new_num = copy.deepcopy(num)
+        new_num.set(qn('w:numId'), str(next_num_id))
+        new_num.find(qn('w:abstractNumId')).set(qn('w:val'), str(next_abstract_id))
+        target_numbering.append(new_num)
+        mapping[num.get(qn('w:numId'))] = str(next_num_id)
+        next_abstract_id += 1
+        next_num_id += 1
+    return mapping
+
+def copy_docx_relationship(relationship, target_part) -> str:
+    """Relate target_part to what relationship points at (deduplicating images); returns the new rId"""
+    from docx.opc.constants import RELATIONSHIP_TYPE
+    if relationship.is_external:
+        return target_part.relate_to(relationship.target_ref, relationship.reltype, is_external=True)
+    if relationship.reltype == RELATIONSHIP_TYPE.IMAGE:
+        rel_id, _ = target_part.get_or_add_image(io.BytesIO(relationship.target_part.blob))
+        return rel_id
+    return target_part.relate_to(relationship.target_part, relationship.reltype)
+
+def stitch_docx_files(input_paths: List[Path], output_path: Path):
+    """
+    Join DOCX files converted from consecutive parts of one PDF into one document.
+
+    Each file's sections follow the previous file's, and the styles, list numbering,
+    images and hyperlinks its body refers to are carried over.
+    """
+    from docx import Document
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    
+    document = Document(str(input_paths[0]))
+    body = document.element.body
+    relationship_attr = f"{{{DOCX_RELATIONSHIP_NS}}}"
+    
+    for input_path in input_paths[1:]:
+        part = Document(str(input_path))
+        copy_docx_styles(part, document)
+        num_ids = copy_docx_numbering(part, document)
+        
+        # Close the last section so far with a paragraph carrying its properties, the
+        # way pdf2docx separates its own sections
+        section_end = OxmlElement('w:p')
+        section_end.append(OxmlElement('w:pPr'))
+        section_end[0].append(copy.deepcopy(body.sectPr))
+        body.sectPr.addprevious(section_end)
+        
+        rel_ids = {}
+        for element in part.element.body.iterchildren():
+            if element.tag == qn('w:sectPr'):
+                continue
+            element = copy.deepcopy(element)
+            for node in element.iter():
+                for name, value in list(node.attrib.items()):
+                    if name.startswith(relationship_attr):
+                        if value not in rel_ids:
+                            rel_ids[value] = copy_docx_relationship(part.part.rels[value], document.part)
+                        node.set(name, rel_ids[value])
+                if node.tag == qn('w:numId') and node.get(qn('w:val')) in num_ids:
+                    node.set(qn('w:val'), num_ids[node.get(qn('w:val'))])
+            body.sectPr.addprevious(element)
+        body.replace(body.sectPr, copy.deepcopy(part.element.body.sectPr))
+    
+    # Drawing ids must be unique within the document
+    for number, drawing in enumerate(body.iter(qn('wp:docPr')), 1):
+        drawing.set('id', str(number))
+    document.save(str(output_path))
+
+# Word rendering settings
+# DOCX files are rendered with platypus. document.xml is read as a stream, one top-level
+# paragraph or table at a time, and the flowables made from it are laid out while the
+# rest is still being read, so memory stays bounded by the lookahead plus the images.
+DOCX_NAMESPACES = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing',
+    'v': 'urn:schemas-microsoft-com:vml',
+    'r': DOCX_RELATIONSHIP_NS,
+    'pr': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+DOCX_LOOKAHEAD = 64            # flowables produced ahead of the layout
+DOCX_FONT_SIZE = 11
+DOCX_TWIPS_PER_POINT = 20
+DOCX_EMU_PER_POINT = 12700
+DOCX_PAGE = {'width': 12240, 'height': 15840, 'top': 1440, 'bottom': 1440, 'left': 1440, 'right': 1440}
+DOCX_IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff')
+DOCX_LINK_COLOR = '#0563C1'
+DOCX_FONT_FAMILIES = {
+    'sans': ('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Helvetica-BoldOblique'),
+    'serif': ('Times-Roman', 'Times-Bold', 'Times-Italic', 'Times-BoldItalic'),
+    'mono': ('Courier', 'Courier-Bold', 'Courier-Oblique', 'Courier-BoldOblique'),
+}
+DOCX_SERIF_FONTS = ('times', 'cambria', 'georgia', 'garamond', 'palatino', 'book antiqua', 'serif')
+DOCX_MONO_FONTS = ('courier', 'consolas', 'menlo', 'monaco', 'lucida console', 'mono')
+DOCX_ALIGNMENTS = {'left': 0, 'start': 0, 'center': 1, 'right': 2, 'end': 2, 'both': 4, 'distribute': 4}
+DOCX_IMAGE_ALIGNMENTS = {0: 'LEFT', 1: 'CENTER', 2: 'RIGHT'}
+DOCX_OFF_VALUES = ('0', 'false', 'off', 'none')
+
+@functools.lru_cache(maxsize=None)
+def docx_tag(name: str) -> str:
+    """Clark notation for a prefixed name, e.g. 'w:p'"""
+    prefix, local = name.split(':')
+    return f"{{{DOCX_NAMESPACES[prefix]}}}{local}"
+
+def docx_attr(element, name: str, default=None):
+    if element is None:
+        return default
+    return element.get(docx_tag(name), default)
+
+def docx_flag(element) -> bool:
+    """Value of an on/off property such as <w:b/> or <w:b w:val="0"/>"""
+    return docx_attr(element, 'w:val', 'true') not in DOCX_OFF_VALUES
+
+def docx_flag_attr(element, name: str) -> bool:
+    """Value of an on/off attribute such as w:default="1" (off when missing)"""
+    return docx_attr(element, name, '0') not in DOCX_OFF_VALUES
+
+def docx_has_borders(borders) -> bool:
+    """Whether a w:tblBorders element draws any line"""
+    return any(docx_attr(border, 'w:val', 'none') not in ('none', 'nil') for border in borders)
+
+def docx_points(element, name: str, scale: float = DOCX_TWIPS_PER_POINT) -> Optional[float]:
+    value = docx_attr(element, name)
+    try:
+        return float(value) / scale if value is not None else None
+    except ValueError:
+        return None
+
+@functools.lru_cache(maxsize=256)
+def docx_font(family: Optional[str], bold: bool, italic: bool) -> str:
+    """Pick the standard PDF font closest to a Word font family"""
+    name = (family or '').lower()
+    if any(font in name for font in DOCX_MONO_FONTS):
+        fonts = DOCX_FONT_FAMILIES['mono']
+    elif any(font in name for font in DOCX_SERIF_FONTS):
+        fonts = DOCX_FONT_FAMILIES['serif']
+    else:
+        fonts = DOCX_FONT_FAMILIES['sans']
+    return fonts[bool(bold) + 2 * bool(italic)]
+
+def parse_docx_run_properties(rpr) -> dict:
+    """Run formatting set by a w:rPr element"""
+    props = {}
+    if rpr is None:
+        return props
+    for child in rpr:
+        tag = child.tag
+        if tag == docx_tag('w:rFonts'):
+            font = docx_attr(child, 'w:ascii') or docx_attr(child, 'w:hAnsi')
+            if font:
+                props['font'] = font
+        elif tag == docx_tag('w:sz'):
+            size = docx_points(child, 'w:val', 2)
+            if size:
+                props['size'] = size
+        elif tag in (docx_tag('w:b'), docx_tag('w:i'), docx_tag('w:strike'), docx_tag('w:vanish')):
+            props[tag.rsplit('}', 1)[1]] = docx_flag(child)
+        elif tag == docx_tag('w:u'):
+            props['u'] = docx_attr(child, 'w:val', 'single') not in DOCX_OFF_VALUES
+        elif tag == docx_tag('w:color'):
+            color = docx_attr(child, 'w:val')
+            if color and color != 'auto':
+                props['color'] = f"#{color}"
+        elif tag == docx_tag('w:vertAlign'):
+            props['vert'] = docx_attr(child, 'w:val')
+    return props
+
+def parse_docx_paragraph_properties(ppr) -> dict:
+    """Paragraph formatting set by a w:pPr element"""
+    props = {}
+    if ppr is None:
+        return props
+    for child in ppr:
+        tag = child.tag
+        if tag == docx_tag('w:jc'):
+            props['align'] = DOCX_ALIGNMENTS.get(docx_attr(child, 'w:val'), 0)
+        elif tag == docx_tag('w:ind'):
+            for key, names in (('left', ('w:left', 'w:start')), ('right', ('w:right', 'w:end'))):
+                for name in names:
+                    value = docx_points(child, name)
+                    if value is not None:
+                        props[key] = value
+                        break
+            first_line = docx_points(child, 'w:firstLine')
+            hanging = docx_points(child, 'w:hanging')
+            if hanging is not None:
+                props['first_line'] = -hanging
+            elif first_line is not None:
+                props['first_line'] = first_line
+        elif tag == docx_tag('w:spacing'):
+            for key, name in (('before', 'w:before'), ('after', 'w:after')):
+                value = docx_points(child, name)
+                if value is not None:
+                    props[key] = value
+            line = docx_attr(child, 'w:line')
+            if line is not None and line.lstrip('-').isdigit():
+                rule = docx_attr(child, 'w:lineRule', 'auto')
+                props['line'] = (rule, int(line) / 240 if rule == 'auto' else int(line) / DOCX_TWIPS_PER_POINT)
+        elif tag == docx_tag('w:numPr'):
+            num_id = docx_attr(child.find(docx_tag('w:numId')), 'w:val')
+            if num_id is not None:
+                props['num'] = (num_id, int(docx_attr(child.find(docx_tag('w:ilvl')), 'w:val', '0')))
+        elif tag == docx_tag('w:keepNext'):
+            props['keep_next'] = docx_flag(child)
+        elif tag == docx_tag('w:contextualSpacing'):
+            props['contextual'] = docx_flag(child)
+        elif tag == docx_tag('w:pageBreakBefore'):
+            props['page_break_before'] = docx_flag(child)
+    return props
+
+class DocxStyles:
+    """Styles from styles.xml with basedOn chains resolved once per style"""
+
+    def __init__(self, styles_xml: Optional[bytes]):
+        self._styles = {}
+        self._resolved = {}
+        self.default_paragraph = None
+        self.default_paragraph_props = {}
+        self.default_run_props = {}
+        if not styles_xml:
+            return
+        root = ET.fromstring(styles_xml)
+        defaults = root.find(docx_tag('w:docDefaults'))
+        if defaults is not None:
+            self.default_run_props = parse_docx_run_properties(defaults.find(f"{docx_tag('w:rPrDefault')}/{docx_tag('w:rPr')}"))
+            self.default_paragraph_props = parse_docx_paragraph_properties(defaults.find(f"{docx_tag('w:pPrDefault')}/{docx_tag('w:pPr')}"))
+        for style in root.findall(docx_tag('w:style')):
+            style_id = docx_attr(style, 'w:styleId')
+            self._styles[style_id] = style
+            if docx_attr(style, 'w:type') == 'paragraph' and docx_flag_attr(style, 'w:default'):
+                self.default_paragraph = style_id
+
+    def resolve(self, style_id: Optional[str]) -> tuple:
+        """(paragraph props, run props, table has borders) of a style, including what it is based on"""
+        if style_id in self._resolved:
+            return self._resolved[style_id]
+        # Mark the style first so a basedOn cycle ends here
+        self._resolved[style_id] = ({}, {}, None)
+        style = self._styles.get(style_id)
+        if style is None:
+            resolved = ({}, {}, None)
+        else:
+            base_id = docx_attr(style.find(docx_tag('w:basedOn')), 'w:val')
+            base_paragraph, base_run, base_borders = self.resolve(base_id) if base_id else ({}, {}, None)
+            borders = style.find(f"{docx_tag('w:tblPr')}/{docx_tag('w:tblBorders')}")
+            resolved = (
+                {**base_paragraph, **parse_docx_paragraph_properties(style.find(docx_tag('w:pPr')))},
+                {**base_run, **parse_docx_run_properties(style.find(docx_tag('w:rPr')))},
+                docx_has_borders(borders) if borders is not None else base_borders,
+            )
+        self._resolved[style_id] = resolved
+        return resolved
+
+    def paragraph(self, style_id: Optional[str]) -> tuple:
+        """(paragraph props, run props) for a paragraph style, on top of the document defaults"""
+        paragraph_props, run_props, _ = self.resolve(style_id or self.default_paragraph)
+        return {**self.default_paragraph_props, **paragraph_props}, {**self.default_run_props, **run_props}
+
+    def character(self, style_id: Optional[str]) -> dict:
+        return self.resolve(style_id)[1] if style_id else {}
+
+    def table_borders(self, style_id: Optional[str]) -> bool:
+        return bool(style_id and self.resolve(style_id)[2])
+
+def roman_numeral(number: int) -> str:
+    numerals = [(1000, 'm'), (900, 'cm'), (500, 'd'), (400, 'cd'), (100, 'c'), (90, 'xc'),
+                (50, 'l'), (40, 'xl'), (10, 'x'), (9, 'ix'), (5, 'v'), (4, 'iv'), (1, 'i')]
+    result = ''
+    for value, numeral in numerals:
+        while number >= value:
+            result += numeral
+            number -= value
+    return result
+
+def format_list_number(number: int, number_format: str) -> str:
+    if number_format in ('lowerLetter', 'upperLetter'):
+        letters = ''
+        while number > 0:
+            number, remainder = divmod(number - 1, 26)
+            letters = chr(ord('a') + remainder) + letters
+        return letters.upper() if number_format == 'upperLetter' else letters
+    if number_format in ('lowerRoman', 'upperRoman'):
+        numeral = roman_numeral(number)
+        return numeral.upper() if number_format == 'upperRoman' else numeral
+    return str(number)
+
+class DocxNumbering:
+    """List definitions from numbering.xml and the running counters of each list"""
+
+    def __init__(self, numbering_xml: Optional[bytes]):
+        self._levels = {}
+        self._nums = {}
+        self._counters = {}
+        if not numbering_xml:
+            return
+        root = ET.fromstring(numbering_xml)
+        for abstract in root.findall(docx_tag('w:abstractNum')):
+            levels = {}
+            for level in abstract.findall(docx_tag('w:lvl')):
+                levels[int(docx_attr(level, 'w:ilvl', '0'))] = (
+                    docx_attr(level.find(docx_tag('w:numFmt')), 'w:val', 'decimal'),
+                    docx_attr(level.find(docx_tag('w:lvlText')), 'w:val', ''),
+                    int(docx_attr(level.find(docx_tag('w:start')), 'w:val', '1')),
+                    parse_docx_paragraph_properties(level.find(docx_tag('w:pPr'))),
+                )
+            self._levels[docx_attr(abstract, 'w:abstractNumId')] = levels
+        for num in root.findall(docx_tag('w:num')):
+            self._nums[docx_attr(num, 'w:numId')] = docx_attr(num.find(docx_tag('w:abstractNumId')), 'w:val')
+
+    def label(self, num_id: str, level: int) -> tuple:
+        """Advance the list's counter and return (label text, level paragraph props)"""
+        abstract_id = self._nums.get(num_id)
+        levels = self._levels.get(abstract_id)
+        if not levels or level not in levels:
+            return None, {}
+        counters = self._counters.setdefault(abstract_id, {})
+        number_format, text, start, props = levels[level]
+        counters[level] = counters.get(level, start - 1) + 1
+        for deeper in [l for l in counters if l > level]:
+            del counters[deeper]
+        if number_format == 'bullet':
+            # Symbol-font bullets are private-use characters the PDF fonts lack
+            return (text if text and text.isprintable() and ord(text[0]) < 0x2500 else '•'), props
+        if number_format == 'none':
+            return None, props
+        for index in range(level + 1):
+            format_for_level = levels.get(index, ('decimal',))[0]
+            value = counters.get(index, levels.get(index, (None, None, 1))[2])
+            text = text.replace(f"%{index + 1}", format_list_number(value, format_for_level))
+        return text, props
+
+@functools.lru_cache(maxsize=None)
+def streaming_doc_template_class():
+    """The streaming doc template, defined on first use so only rendering imports platypus"""
+    from reportlab.platypus import BaseDocTemplate
+
+    class StreamingDocTemplate(BaseDocTemplate):
+        """
+        A doc template that lays out flowables from an iterator while they are still
+        being produced. build() feeds handle_flowable itself from a buffer kept
+        lookahead deep, so keepWithNext runs can still be grouped, instead of relying
+        on how BaseDocTemplate.build walks a list. The hooks it calls are reportlab
+        internals; tests/test_rendering.py compares its layout with the stock build.
+        """
+
+        def build(self, flowables, lookahead: int = DOCX_LOOKAHEAD):
+            source = iter(flowables)
+            pending = []
+            self._startBuild()
+            canv = self.canv
+            canv._doctemplate = self
+            try:
+                while True:
+                    while source is not None and len(pending) < lookahead:
+                        flowable = next(source, None)
+                        if flowable is None:
+                            source = None
+                        else:
+                            pending.append(flowable)
+                    if not pending:
+                        break
+                    self.clean_hanging()
+                    self.handle_flowable(pending)
+            finally:
+                del canv._doctemplate
+            self._endBuild()
+
+    return StreamingDocTemplate
+
+class DocxRenderer:
+    """Turns the body of a DOCX archive into platypus flowables"""
+
+    def __init__(self, archive: zipfile.ZipFile):
+        self.archive = archive
+        names = set(archive.namelist())
+        read = lambda name: archive.read(name) if name in names else None
+        self.styles = DocxStyles(read('word/styles.xml'))
+        self.numbering = DocxNumbering(read('word/numbering.xml'))
+        self.relationships = {}
+        rels = read('word/_rels/document.xml.rels')
+        if rels:
+            for rel in ET.fromstring(rels).findall(docx_tag('pr:Relationship')):
+                self.relationships[rel.get('Id')] = (rel.get('Target'), rel.get('TargetMode') == 'External')
+        self._paragraph_styles = {}
+        self._previous = None
+        self.frame_width = self.frame_height = 0
+
+    def body_elements(self):
+        """Yield the top-level elements of the body one at a time, dropping each once used"""
+        with self.archive.open('word/document.xml') as stream:
+            depth = 0
+            body = None
+            for event, element in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and element.tag == docx_tag('w:body'):
+                        body = element
+                    continue
+                depth -= 1
+                if depth == 2 and body is not None:
+                    yield element
+                    body.remove(element)
+
+    def sections(self) -> List[dict]:
+        """Page size, margins and start type of every section, in order"""
+        sections = []
+        for element in self.body_elements():
+            if element.tag == docx_tag('w:sectPr'):
+                sections.append(self.parse_section(element))
+            else:
+                section = element.find(f"{docx_tag('w:pPr')}/{docx_tag('w:sectPr')}")
+                if section is not None:
+                    sections.append(self.parse_section(section))
+        return sections or [self.parse_section(None)]
+
+    @staticmethod
+    def parse_section(section) -> dict:
+        size = section.find(docx_tag('w:pgSz')) if section is not None else None
+        margins = section.find(docx_tag('w:pgMar')) if section is not None else None
+        geometry = {}
+        for key, element in (('width', size), ('height', size), ('top', margins), ('bottom', margins), ('left', margins), ('right', margins)):
+            value = docx_points(element, f"w:{'w' if key == 'width' else 'h' if key == 'height' else key}")
+            geometry[key] = abs(value) if value is not None else DOCX_PAGE[key] / DOCX_TWIPS_PER_POINT
+        start = docx_attr(section.find(docx_tag('w:type')), 'w:val', 'nextPage') if section is not None else 'nextPage'
+        return {**geometry, 'start': start}
+
+    def flowables(self, sections: List[dict]):
+        """Yield the flowables of the whole body, switching page templates at section breaks"""
+        from reportlab.platypus import NextPageTemplate, PageBreak
+        section_index = 0
+        self.use_section(sections[0])
+        # Each element's flowables are held back until the next element is read, so
+        # contextual spacing can still change the last paragraph before it is laid out
+        pending = []
+        for element in self.body_elements():
+            current = self.block_flowables(element, self.frame_width)
+            yield from pending
+            pending = current
+            section = element.find(f"{docx_tag('w:pPr')}/{docx_tag('w:sectPr')}") if element.tag == docx_tag('w:p') else None
+            if section is not None and section_index + 1 < len(sections):
+                section_index += 1
+                self.use_section(sections[section_index])
+                pending.append(NextPageTemplate(f"section{section_index}"))
+                if sections[section_index]['start'] != 'continuous':
+                    pending.append(PageBreak())
+        yield from pending
+
+    def use_section(self, section: dict):
+        self.frame_width = section['width'] - section['left'] - section['right']
+        self.frame_height = section['height'] - section['top'] - section['bottom']
+
+    def block_flowables(self, element, width: float) -> list:
+        if element.tag == docx_tag('w:p'):
+            return self.paragraph_flowables(element, width)
+        if element.tag == docx_tag('w:tbl'):
+            self._previous = None
+            table = self.table_flowable(element, width)
+            self._previous = None
+            return [table] if table is not None else []
+        if element.tag == docx_tag('w:sdt'):
+            content = element.find(docx_tag('w:sdtContent'))
+            return [f for child in (content if content is not None else []) for f in self.block_flowables(child, width)]
+        return []
+
+    def paragraph_style(self, props: dict, run_props: dict):
+        """A ParagraphStyle for the resolved properties, shared by all paragraphs that match"""
+        from reportlab.lib.styles import ParagraphStyle
+        size = run_props.get('size', DOCX_FONT_SIZE)
+        rule, line = props.get('line', ('auto', 1.0))
+        if rule == 'auto':
+            leading = size * 1.2 * line
+        elif rule == 'exact':
+            leading = line
+        else:
+            leading = max(line, size * 1.2)
+        key = (
+            docx_font(run_props.get('font'), run_props.get('b'), run_props.get('i')), size, round(leading, 2),
+            run_props.get('color'), props.get('align', 0), props.get('left', 0), props.get('right', 0),
+            props.get('first_line', 0), props.get('before', 0), props.get('after', 0), props.get('keep_next', False),
+        )
+        style = self._paragraph_styles.get(key)
+        if style is None:
+            font, size, leading, color, align, left, right, first_line, before, after, keep_next = key
+            style = ParagraphStyle(
+                f"docx{len(self._paragraph_styles)}",
+                fontName=font, fontSize=size, leading=leading, autoLeading='max',
+                textColor=color or '#000000', alignment=align,
+                leftIndent=max(left, 0), rightIndent=max(right, 0), firstLineIndent=first_line,
+                spaceBefore=before, spaceAfter=after, keepWithNext=keep_next,
+            )
+            self._paragraph_styles[key] = style
+        return style
+
+    def paragraph_runs(self, element, link=None):
+        """Yield (run, link target) for the runs of a paragraph, looking into hyperlinks and insertions"""
+        for child in element:
+            if child.tag == docx_tag('w:r'):
+                yield child, link
+            elif child.tag == docx_tag('w:hyperlink'):
+                target = self.relationships.get(docx_attr(child, 'r:id'), (None, False))[0]
+                anchor = docx_attr(child, 'w:anchor')
+                yield from self.paragraph_runs(child, target or (f"#{anchor}" if anchor else link))
+            elif child.tag in (docx_tag('w:ins'), docx_tag('w:smartTag'), docx_tag('w:fldSimple'),
+                               docx_tag('w:sdt'), docx_tag('w:sdtContent')):
+                yield from self.paragraph_runs(child, link)
+
+    def run_markup(self, text: str, props: dict, base: dict, link: Optional[str]) -> str:
+        """Paragraph markup for a run's text, with tags only for what differs from the paragraph"""
+        attrs = []
+        font = docx_font(props.get('font'), props.get('b'), props.get('i'))
+        if font != docx_font(base.get('font'), base.get('b'), base.get('i')):
+            attrs.append(f'name="{font}"')
+        if props.get('size', DOCX_FONT_SIZE) != base.get('size', DOCX_FONT_SIZE):
+            attrs.append(f'size="{props.get("size", DOCX_FONT_SIZE)}"')
+        if props.get('color') != base.get('color'):
+            attrs.append(f'color="{props.get("color") or "#000000"}"')
+        markup = f"<font {' '.join(attrs)}>{text}</font>" if attrs else text
+        if props.get('u'):
+            markup = f"<u>{markup}</u>"
+        if props.get('strike'):
+            markup = f"<strike>{markup}</strike>"
+        if props.get('vert') == 'superscript':
+            markup = f"<super>{markup}</super>"
+        elif props.get('vert') == 'subscript':
+            markup = f"<sub>{markup}</sub>"
+        if link and not link.startswith('#'):
+            markup = f'<a href="{html.escape(link)}" color="{DOCX_LINK_COLOR}">{markup}</a>'
+        return markup
+
+    def paragraph_flowables(self, element, width: float) -> list:
+        from reportlab.platypus import Paragraph, PageBreak
+        ppr = element.find(docx_tag('w:pPr'))
+        style_id = docx_attr(ppr.find(docx_tag('w:pStyle')) if ppr is not None else None, 'w:val')
+        props, base = self.styles.paragraph(style_id)
+        direct = parse_docx_paragraph_properties(ppr)
+        label = None
+        num = direct.get('num', props.get('num'))
+        if num:
+            label, level_props = self.numbering.label(*num)
+            props = {**props, **level_props}
+        props = {**props, **direct}
+        # Contextual spacing drops the space between paragraphs of the same style
+        previous = self._previous
+        if props.get('contextual') and previous and previous[0] == style_id and previous[1].get('contextual'):
+            previous[3].style = self.paragraph_style({**previous[1], 'after': 0}, previous[2])
+            props = {**props, 'before': 0}
+        style = self.paragraph_style(props, base)
+
+        flowables = [PageBreak()] if props.get('page_break_before') else []
+        parts = [html.escape(label) + '&nbsp;&nbsp;'] if label else []
+
+        def finish_text():
+            if parts:
+                flowables.append(Paragraph(''.join(parts), style))
+                parts.clear()
+
+        for run, link in self.paragraph_runs(element):
+            rpr = run.find(docx_tag('w:rPr'))
+            run_props = {**base, **self.styles.character(docx_attr(rpr.find(docx_tag('w:rStyle')) if rpr is not None else None, 'w:val')),
+                         **parse_docx_run_properties(rpr)}
+            if run_props.get('vanish'):
+                continue
+            text = []
+            for child in run:
+                tag = child.tag
+                if tag == docx_tag('w:t'):
+                    text.append(html.escape(child.text or ''))
+                elif tag == docx_tag('w:tab'):
+                    text.append('&nbsp;' * 4)
+                elif tag in (docx_tag('w:br'), docx_tag('w:cr')):
+                    if docx_attr(child, 'w:type') == 'page':
+                        if text:
+                            parts.append(self.run_markup(''.join(text), run_props, base, link))
+                            text = []
+                        finish_text()
+                        flowables.append(PageBreak())
+                    else:
+                        text.append('<br/>')
+                elif tag == docx_tag('w:noBreakHyphen'):
+                    text.append('-')
+                elif tag in (docx_tag('w:drawing'), docx_tag('w:pict')):
+                    image = self.image_flowable(child, width)
+                    if image is not None:
+                        if text:
+                            parts.append(self.run_markup(''.join(text), run_props, base, link))
+                            text = []
+                        finish_text()
+                        flowables.append(image)
+            if text:
+                parts.append(self.run_markup(''.join(text), run_props, base, link))
+
+        if not parts and not flowables:
+            # An empty paragraph still takes up a line, as in Word
+            parts.append('&nbsp;')
+        finish_text()
+        last = flowables[-1] if flowables and isinstance(flowables[-1], Paragraph) else None
+        self._previous = (style_id, props, base, last) if last is not None else None
+        for flowable in flowables:
+            if not isinstance(flowable, (Paragraph, PageBreak)):
+                flowable.hAlign = DOCX_IMAGE_ALIGNMENTS.get(props.get('align', 0), 'LEFT')
+        return flowables
+
+    def image_flowable(self, element, max_width: float):
+        """An Image for a w:drawing or w:pict, scaled to fit the frame; None if it can't be drawn"""
+        from reportlab.platypus import Image as ImageFlowable
+        blip = element.find(f".//{docx_tag('a:blip')}")
+        rel_id = docx_attr(blip, 'r:embed') if blip is not None else None
+        if rel_id is None:
+            rel_id = docx_attr(element.find(f".//{docx_tag('v:imagedata')}"), 'r:id')
+        target, external = self.relationships.get(rel_id, (None, False))
+        if not target or external or Path(target).suffix.lower() not in DOCX_IMAGE_TYPES:
+            return None
+        name = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('word', target))
+        try:
+            data = self.archive.read(name)
+            with Image.open(io.BytesIO(data)) as img:
+                natural = (img.width * 0.75, img.height * 0.75)
+        except Exception:
+            return None
+        extent = element.find(f".//{docx_tag('wp:extent')}")
+        try:
+            width = int(extent.get('cx')) / DOCX_EMU_PER_POINT
+            height = int(extent.get('cy')) / DOCX_EMU_PER_POINT
+        except (AttributeError, TypeError, ValueError):
+            width = height = 0
+        if not width or not height:
+            width, height = natural
+        scale = min(1.0, max_width / width, self.frame_height * 0.95 / height)
+        return ImageFlowable(io.BytesIO(data), width=width * scale, height=height * scale)
+
+    def table_flowable(self, element, width: float):
+        """A Table for a w:tbl, with merged cells, shading and (if the table has any) borders"""
+        from reportlab.platypus import Table, TableStyle
+        tblpr = element.find(docx_tag('w:tblPr'))
+        grid = [docx_points(col, 'w:w') or 0 for col in element.findall(f"{docx_tag('w:tblGrid')}/{docx_tag('w:gridCol')}")]
+        rows = element.findall(docx_tag('w:tr'))
+        if not rows:
+            return None
+        columns = max([len(grid)] + [sum(int(docx_attr(tc.find(f"{docx_tag('w:tcPr')}/{docx_tag('w:gridSpan')}"), 'w:val', '1'))
+                                         for tc in tr.findall(docx_tag('w:tc'))) for tr in rows])
+        grid += [0] * (columns - len(grid))
+        known = sum(grid)
+        if known <= 0:
+            col_widths = [width / columns] * columns
+        else:
+            missing = [i for i, w in enumerate(grid) if not w]
+            filler = (max(width - known, 0) / len(missing)) if missing else 0
+            col_widths = [w or filler or width / columns for w in grid]
+            scale = min(1.0, width / sum(col_widths))
+            col_widths = [w * scale for w in col_widths]
+
+        commands = [('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                    ('LEFTPADDING', (0, 0), (-1, -1), 4), ('RIGHTPADDING', (0, 0), (-1, -1), 4)]
+        borders = tblpr.find(docx_tag('w:tblBorders')) if tblpr is not None else None
+        style_id = docx_attr(tblpr.find(docx_tag('w:tblStyle')) if tblpr is not None else None, 'w:val')
+        if (docx_has_borders(borders) if borders is not None else self.styles.table_borders(style_id)):
+            commands.append(('GRID', (0, 0), (-1, -1), 0.5, '#000000'))
+
+        data = []
+        merges = {}
+        header_rows = 0
+        for row_index, tr in enumerate(rows):
+            trpr = tr.find(docx_tag('w:trPr'))
+            header = trpr.find(docx_tag('w:tblHeader')) if trpr is not None else None
+            if row_index == header_rows and header is not None and docx_flag(header):
+                header_rows += 1
+            row = [''] * columns
+            column = 0
+            for tc in tr.findall(docx_tag('w:tc')):
+                if column >= columns:
+                    break
+                tcpr = tc.find(docx_tag('w:tcPr'))
+                span = int(docx_attr(tcpr.find(docx_tag('w:gridSpan')) if tcpr is not None else None, 'w:val', '1'))
+                vmerge = tcpr.find(docx_tag('w:vMerge')) if tcpr is not None else None
+                if vmerge is not None and docx_attr(vmerge, 'w:val') != 'restart' and column in merges:
+                    merges[column][1] = row_index
+                    column += span
+                    continue
+                if column in merges:
+                    self.add_span(commands, column, merges.pop(column))
+                merges[column] = [row_index, row_index, span]
+                cell_width = sum(col_widths[column:column + span]) - 8
+                row[column] = [f for child in tc for f in self.block_flowables(child, cell_width)]
+                fill = docx_attr(tcpr.find(docx_tag('w:shd')) if tcpr is not None else None, 'w:fill')
+                if fill and fill != 'auto':
+                    commands.append(('BACKGROUND', (column, row_index), (column + span - 1, row_index), f"#{fill}"))
+                column += span
+            # Cells that are not continued in this row end their vertical merge
+            for start_column, merge in list(merges.items()):
+                if merge[1] < row_index:
+                    del merges[start_column]
+                    self.add_span(commands, start_column, merge)
+            data.append(row)
+        for start_column, merge in merges.items():
+            self.add_span(commands, start_column, merge)
+
+        return Table(data, colWidths=col_widths, repeatRows=header_rows, splitInRow=1, style=TableStyle(commands), hAlign='LEFT')
+
+    @staticmethod
+    def add_span(commands: list, column: int, merge: list):
+        start_row, end_row, span = merge
+        if end_row > start_row or span > 1:
+            commands.append(('SPAN', (column, start_row), (column + span - 1, end_row)))
+
+def docx_to_pdf_file(input_path: Path, output_path: Path, progress: Optional[ProgressFile] = None) -> dict:
+    """
+    Render a Word document to PDF, keeping its wrapping, lists, tables, images and
+    page setup. Returns the page count and rendering time.
+    """
+    from reportlab.platypus import PageTemplate, Frame
+    started = time.perf_counter()
+    try:
+        archive = zipfile.ZipFile(str(input_path))
+        if 'word/document.xml' not in archive.namelist():
+            raise zipfile.BadZipFile
+    except zipfile.BadZipFile:
+        raise InvalidInputError("Invalid Word document. Only .docx files are supported.")
+
+    with archive:
+        renderer = DocxRenderer(archive)
+        sections = renderer.sections()
+        pages = 0
+
+        def page_done(canvas, doc):
+            nonlocal pages
+            pages += 1
+            report_progress(progress, pages, None, "rendering pages")
+
+        templates = [
+            PageTemplate(
+                id=f"section{index}",
+                pagesize=(section['width'], section['height']),
+                frames=[Frame(section['left'], section['bottom'],
+                              section['width'] - section['left'] - section['right'],
+                              section['height'] - section['top'] - section['bottom'],
+                              leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)],
+                onPage=page_done,
+            )
+            for index, section in enumerate(sections)
+        ]
+        doc = streaming_doc_template_class()(str(output_path), pageTemplates=templates, pagesize=templates[0].pagesize)
+        doc.build(renderer.flowables(sections))
+
+    seconds = time.perf_counter() - started
+    return {"pages": pages, "seconds": round(seconds, 3), "pages_per_second": round(pages / seconds, 1) if seconds else None}
+
+# Spreadsheet rendering settings
+# Workbooks are opened read-only and each sheet is streamed row by row onto the
+# canvas as a grid, so no sheet is ever held in memory. Column widths are fitted to
+# the first XLSX_SAMPLE_ROWS rows; columns that don't fit across one page move to
+# another band of pages, printed down then over like Excel does. A canvas keeps its
+# pages uncompressed until saved, so every XLSX_PART_PAGES pages are saved as a
+# part file and the parts are merged at the end.
+XLSX_PART_PAGES = 500
+XLSX_FONT = "Helvetica"
+XLSX_BOLD_FONT = "Helvetica-Bold"
+XLSX_FONT_SIZE = 8
+XLSX_TITLE_SIZE = 10
+XLSX_ROW_HEIGHT = 12
+XLSX_MARGIN = 36
+XLSX_PADDING = 3
+XLSX_SAMPLE_ROWS = 200
+XLSX_MIN_COLUMN_WIDTH = 28
+XLSX_MAX_COLUMN_WIDTH = 220
+XLSX_MAX_CHAR_WIDTH = 1.02     # widest Helvetica glyph, in ems
+XLSX_ELLIPSIS = '…'
+XLSX_GRID_COLOR = HexColor('#bdbdbd')
+XLSX_HEADER_COLOR = HexColor('#eeeeee')
+XLSX_LABEL_COLOR = HexColor('#616161')
+XLSX_TEXT_COLOR = HexColor('#000000')
+XLSX_CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]+')
+
+def format_cell_value(value) -> str:
+    """Format a cached cell value the way a spreadsheet shows it by default"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    if isinstance(value, datetime):
+        if value.hour or value.minute or value.second:
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return XLSX_CONTROL_CHARS.sub(' ', str(value))
+
+@functools.lru_cache(maxsize=4096)
+def fit_cell_text(text: str, width: float):
+    """Return (text, text_width), cut short with an ellipsis to fit `width` points"""
+    if not text:
+        return text, 0
+    text_width = pdfmetrics.stringWidth(text, XLSX_FONT, XLSX_FONT_SIZE)
+    if text_width <= width:
+        return text, text_width
+    keep = int(len(text) * width / text_width)
+    while keep > 0:
+        clipped = text[:keep].rstrip() + XLSX_ELLIPSIS
+        text_width = pdfmetrics.stringWidth(clipped, XLSX_FONT, XLSX_FONT_SIZE)
+        if text_width <= width:
+            return clipped, text_width
+        keep -= 1
+    return '', 0
+
+def xlsx_column_bands(widths: list, available: float) -> list:
+    """Split columns into (start, end) ranges that each fit across one page"""
+    bands = []
+    start = 0
+    used = 0
+    for index, width in enumerate(widths):
+        if index > start and used + width > available:
+            bands.append((start, index))
+            start = index
+            used = 0
+        used += width
+    bands.append((start, len(widths)))
+    return bands
+
+class PartedCanvas:
+    """Hands out canvases that are saved to a new part file every XLSX_PART_PAGES pages"""
+
+    def __init__(self, parts_dir: Path, pagesize):
+        self.parts_dir = Path(parts_dir)
+        self.pagesize = pagesize
+        self.parts = []
+        self.pages = 0
+        self.pdf = None
+
+    def new_page(self):
+        """Return the canvas to draw the next page on"""
+        if self.pages % XLSX_PART_PAGES == 0:
+            self.save()
+            self.parts.append(self.parts_dir / f"part_{len(self.parts):05d}.pdf")
+            self.pdf = canvas.Canvas(str(self.parts[-1]), pagesize=self.pagesize)
+        self.pages += 1
+        return self.pdf
+
+    def save(self):
+        if self.pdf is not None:
+            self.pdf.save()
+            self.pdf = None
+
+class SheetRenderer:
+    """Draws one read-only worksheet as paginated grid tables"""
+
+    def __init__(self, output: PartedCanvas, sheet, pagesize):
+        self.output = output
+        self.sheet = sheet
+        self.page_width, self.page_height = pagesize
+        if sheet.max_row is None or sheet.max_column is None:
+            sheet.reset_dimensions()
+        self.columns = 0
+        self.widths = []
+        self.rows = sheet.max_row
+        self.fit_columns()
+        digits = len(str(self.rows)) if self.rows else 7
+        self.gutter_width = pdfmetrics.stringWidth('0' * digits, XLSX_FONT, XLSX_FONT_SIZE) + 2 * XLSX_PADDING
+        self.top = self.page_height - XLSX_MARGIN - XLSX_TITLE_SIZE - XLSX_ROW_HEIGHT / 2
+        self.rows_per_page = max(1, int((self.top - XLSX_MARGIN) // XLSX_ROW_HEIGHT) - 1)
+        self.bands = xlsx_column_bands(self.widths, self.page_width - 2 * XLSX_MARGIN - self.gutter_width)
+
+    def iter_rows(self):
+        """Yield (row_number, values) for every row, one at a time"""
+        return enumerate(self.sheet.iter_rows(values_only=True), 1)
+
+    def fit_columns(self):
+        """Size each column to the widest value among the first rows"""
+        widths = []
+        seen = 0
+        has_values = False
+        for seen, values in self.iter_rows():
+            for index, value in enumerate(values):
+                if index == len(widths):
+                    widths.append(0)
+                if value is not None:
+                    has_values = True
+                    text_width = pdfmetrics.stringWidth(format_cell_value(value), XLSX_FONT, XLSX_FONT_SIZE)
+                    widths[index] = max(widths[index], text_width)
+            if seen == XLSX_SAMPLE_ROWS:
+                break
+        if not has_values and (self.rows or 0) <= XLSX_SAMPLE_ROWS:
+            return
+        if self.sheet.max_column:
+            widths.extend([0] * (self.sheet.max_column - len(widths)))
+        self.columns = len(widths)
+        self.widths = [min(XLSX_MAX_COLUMN_WIDTH, max(XLSX_MIN_COLUMN_WIDTH, width + 2 * XLSX_PADDING + 1)) for width in widths]
+        if self.rows is None and seen < XLSX_SAMPLE_ROWS:
+            self.rows = seen
+
+    def render(self, progress: Optional[ProgressFile] = None):
+        """Draw every band of the sheet, reading its rows once per band"""
+        from openpyxl.utils import get_column_letter
+        for start, end in self.bands:
+            letters = [get_column_letter(index + 1) for index in range(start, end)]
+            edges = [XLSX_MARGIN, XLSX_MARGIN + self.gutter_width]
+            for width in self.widths[start:end]:
+                edges.append(edges[-1] + width)
+            title = self.sheet.title
+            if len(self.bands) > 1:
+                title = f"{title}  (columns {letters[0]}-{letters[-1]})"
+
+            page_rows = []
+            number = 0
+            for number, values in self.iter_rows():
+                page_rows.append((number, values[start:end]))
+                if len(page_rows) == self.rows_per_page:
+                    self.draw_page(title, letters, edges, page_rows)
+                    report_progress(progress, self.output.pages, None, "rendering pages")
+                    page_rows = []
+            if page_rows or not number:
+                self.draw_page(title, letters, edges, page_rows)
+            self.rows = number
+
+    def draw_page(self, title: str, letters: list, edges: list, page_rows: list):
+        """Draw the title, column header and one page of rows"""
+        pdf = self.output.new_page()
+        header_top = self.top
+        header_bottom = header_top - XLSX_ROW_HEIGHT
+        baseline_offset = (XLSX_ROW_HEIGHT - XLSX_FONT_SIZE) / 2 + 1.5
+        pdf.setFont(XLSX_BOLD_FONT, XLSX_TITLE_SIZE)
+        pdf.setFillColor(XLSX_TEXT_COLOR)
+        pdf.drawString(XLSX_MARGIN, self.page_height - XLSX_MARGIN - XLSX_TITLE_SIZE, title)
+
+        pdf.setFillColor(XLSX_HEADER_COLOR)
+        pdf.rect(edges[0], header_bottom, edges[-1] - edges[0], XLSX_ROW_HEIGHT, stroke=0, fill=1)
+        pdf.rect(edges[0], header_bottom - len(page_rows) * XLSX_ROW_HEIGHT, self.gutter_width, len(page_rows) * XLSX_ROW_HEIGHT, stroke=0, fill=1)
+        pdf.setFont(XLSX_BOLD_FONT, XLSX_FONT_SIZE)
+        pdf.setFillColor(XLSX_LABEL_COLOR)
+        for index, letter_label in enumerate(letters):
+            pdf.drawCentredString((edges[index + 1] + edges[index + 2]) / 2, header_bottom + baseline_offset, letter_label)
+
+        # Each column is one text object written line by line, which avoids
+        # positioning (and measuring) every cell separately
+        first_baseline = header_bottom - XLSX_ROW_HEIGHT + baseline_offset
+        labels = [str(number) for number, values in page_rows]
+        self.draw_column(pdf, edges[0], edges[1], first_baseline, labels, True, XLSX_LABEL_COLOR)
+        for index in range(len(letters)):
+            texts = []
+            numbers = []
+            for number, values in page_rows:
+                value = values[index] if index < len(values) else None
+                texts.append(format_cell_value(value))
+                numbers.append(isinstance(value, (int, float)) and not isinstance(value, bool))
+            self.draw_column(pdf, edges[index + 1], edges[index + 2], first_baseline, texts, numbers, XLSX_TEXT_COLOR)
+
+        pdf.setStrokeColor(XLSX_GRID_COLOR)
+        pdf.setLineWidth(0.5)
+        pdf.grid(edges, [header_top - row * XLSX_ROW_HEIGHT for row in range(len(page_rows) + 2)])
+        pdf.showPage()
+
+    @staticmethod
+    def draw_column(pdf, left: float, right: float, baseline: float, texts: list, numbers, color):
+        """Write one cell per row between `left` and `right`; numbers are right-aligned"""
+        space = right - left - 2 * XLSX_PADDING
+        max_char_width = XLSX_FONT_SIZE * XLSX_MAX_CHAR_WIDTH
+        column = pdf.beginText(left + XLSX_PADDING, baseline)
+        column.setFont(XLSX_FONT, XLSX_FONT_SIZE, XLSX_ROW_HEIGHT)
+        column.setFillColor(color)
+        shift = 0
+        for row, text in enumerate(texts):
+            offset = 0
+            if text and (numbers is True or numbers[row]):
+                text, text_width = fit_cell_text(text, space)
+                offset = space - text_width
+            elif len(text) * max_char_width > space:
+                # Short text can't overflow, so only long text is measured
+                text = fit_cell_text(text, space)[0]
+            if text and offset != shift:
+                column.moveCursor(offset - shift, 0)
+                shift = offset
+            column.textLine(text)
+        pdf.drawText(column)
+
+def excel_to_pdf_file(input_path: Path, output_path: Path, parts_dir: Path, progress: Optional[ProgressFile] = None) -> dict:
+    """
+    Render every visible sheet of a workbook as paginated grid tables, using parts_dir
+    for the part files. Returns the sheet, row and page counts and the rendering time.
+    """
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+    started = time.perf_counter()
+    try:
+        wb = openpyxl.load_workbook(str(input_path), read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError):
+        raise InvalidInputError("Invalid Excel workbook. Only .xlsx files are supported.")
+
+    pagesize = (letter[1], letter[0])
+    output = PartedCanvas(parts_dir, pagesize)
+    sheets = rows = 0
+    try:
+        for sheet in wb.worksheets:
+            if getattr(sheet, 'sheet_state', 'visible') != 'visible':
+                continue
+            renderer = SheetRenderer(output, sheet, pagesize)
+            if not renderer.columns:
+                continue
+            renderer.render(progress)
+            sheets += 1
+            rows += renderer.rows
+    finally:
+        wb.close()
+        output.save()
+    if not output.pages:
+        raise InvalidInputError("The workbook has no data to convert.")
+    if len(output.parts) == 1:
+        shutil.move(str(output.parts[0]), str(output_path))
+    else:
+        merge_pdf_files(output.parts, output_path)
+    for part in output.parts:
+        remove_path(part)
+
+    seconds = time.perf_counter() - started
+    return {"sheets": sheets, "rows": rows, "pages": output.pages, "seconds": round(seconds, 3)}
+
+# Table extraction settings
+# Words are grouped into rows by their vertical centres and split into cells at
+# wide gaps or where MuPDF starts a new line. Consecutive rows with several cells
+# become a table when their cells line up into at least two columns; everything
+# else is kept as lines of text. Gaps are measured in row heights.
+PDF_TABLE_CELL_GAP = 0.6       # horizontal gap that separates two cells
+PDF_TABLE_ROW_GAP = 2.0        # vertical gap that ends a table
+PDF_TABLE_ILLEGAL_CHARACTERS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')   # not allowed in worksheets
+PDF_TABLE_NUMBER = re.compile(r'^\(?[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?\)?$')
+
+def parse_table_value(text: str):
+    """Return text as an int or float when it is a plain number, else the text itself"""
+    if not PDF_TABLE_NUMBER.match(text) or not any(c.isdigit() for c in text):
+        return text
+    negative = text.startswith('(') and text.endswith(')')
+    if text.startswith('(') != text.endswith(')'):
+        return text
+    digits = text.strip('()').replace(',', '')
+    # Leading zeros and long digit runs are codes or IDs, not quantities
+    if len(digits.lstrip('+-').split('.')[0]) > 15 or (digits.lstrip('+-')[:1] == '0' and digits.lstrip('+-')[1:2].isdigit()):
+        return text
+    value = float(digits) if '.' in digits else int(digits)
+    return -value if negative else value
+
+def cluster_word_rows(words) -> list:
+    """Group fitz words into rows of cells; each cell is [x0, x1, text]"""
+    rows = []
+    for word in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        middle = (word[1] + word[3]) / 2
+        if rows and middle <= rows[-1]['bottom']:
+            row = rows[-1]
+            row['top'] = min(row['top'], word[1])
+            row['bottom'] = max(row['bottom'], word[3])
+            row['words'].append(word)
+        else:
+            rows.append({'top': word[1], 'bottom': word[3], 'words': [word]})
+
+    for row in rows:
+        height = row['bottom'] - row['top']
+        cells = []
+        previous = None
+        for word in sorted(row['words'], key=lambda w: w[0]):
+            text = PDF_TABLE_ILLEGAL_CHARACTERS.sub('', word[4])
+            gap = word[0] - previous[2] if previous else 0
+            new_line = previous is not None and word[5:7] != previous[5:7]
+            if cells and gap <= PDF_TABLE_CELL_GAP * height and not (new_line and gap > 0):
+                cells[-1][1] = word[2]
+                cells[-1][2] += ' ' + text
+            else:
+                cells.append([word[0], word[2], text])
+            previous = word
+        row['cells'] = cells
+        del row['words']
+    return rows
+
+def table_columns(rows: list) -> list:
+    """Column (x0, x1) intervals: the union of the cell spans of rows with several cells"""
+    spans = sorted((cell[0], cell[1]) for row in rows if len(row['cells']) > 1 for cell in row['cells'])
+    columns = []
+    for x0, x1 in spans:
+        if columns and x0 <= columns[-1][1]:
+            columns[-1][1] = max(columns[-1][1], x1)
+        else:
+            columns.append([x0, x1])
+    return columns
+
+def place_table_cells(rows: list, columns: list) -> list:
+    """Lay the cells of each row out on the table's columns"""
+    table = []
+    for row in rows:
+        values = [''] * len(columns)
+        for x0, x1, text in row['cells']:
+            middle = (x0 + x1) / 2
+            index = min(range(len(columns)), key=lambda i: 0 if columns[i][0] <= middle <= columns[i][1]
+                        else min(abs(middle - columns[i][0]), abs(middle - columns[i][1])))
+            values[index] = f"{values[index]} {text}" if values[index] else text
+        table.append([parse_table_value(value) if value else None for value in values])
+    return table
+
+def split_page_blocks(rows: list) -> list:
+    """Split a page's rows into table and text blocks, in reading order"""
+    blocks = []
+    index = 0
+    while index < len(rows):
+        end = index
+        if len(rows[index]['cells']) > 1:
+            # Extend over multi-cell rows, taking in single-cell rows that lie between them
+            last = index
+            scan = index + 1
+            while scan < len(rows):
+                height = rows[scan - 1]['bottom'] - rows[scan - 1]['top']
+                if rows[scan]['top'] - rows[scan - 1]['bottom'] > PDF_TABLE_ROW_GAP * height:
+                    break
+                if len(rows[scan]['cells']) > 1:
+                    last = scan
+                scan += 1
+            end = last
+            candidate = rows[index:end + 1]
+            columns = table_columns(candidate)
+            if end > index and len(columns) > 1:
+                blocks.append({'kind': 'table', 'rows': place_table_cells(candidate, columns)})
+                index = end + 1
+                continue
+            end = index
+        line = ' '.join(cell[2] for cell in rows[index]['cells'])
+        if blocks and blocks[-1]['kind'] == 'text':
+            blocks[-1]['rows'].append([line])
+        else:
+            blocks.append({'kind': 'text', 'rows': [[line]]})
+        index = end + 1
+    return blocks
+
+def extract_pdf_tables(input_path: Path, page_indexes: List[int], mode: str = "tables") -> List[dict]:
+    """
+    Read the words of the given pages and return, per page, its blocks: detected
+    tables (mode 'tables') or only lines of text (mode 'text').
+    """
+    import fitz
+    pages = []
+    with fitz.open(str(input_path)) as pdf_document:
+        for page_index in page_indexes:
+            rows = cluster_word_rows(pdf_document[page_index].get_text("words"))
+            if mode == "text":
+                lines = [[' '.join(cell[2] for cell in row['cells'])] for row in rows]
+                blocks = [{'kind': 'text', 'rows': lines}] if lines else []
+            else:
+                blocks = split_page_blocks(rows)
+            pages.append({'page': page_index, 'blocks': blocks})
+    return pages
+
+def page_content_hash(pdf_document, page) -> str:
+    """
+    Hash what a page looks like: its geometry, content stream and image data.
+    The media and crop boxes are included because the cached text layer is placed
+    in the page's user space, which they (with the rotation) define.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{page.rotation}:{tuple(page.mediabox)}:{tuple(page.cropbox)}".encode('ascii'))
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(pdf_document.xref_stream_raw(image[0]) or b'')
+    return digest.hexdigest()
+
+def scan_pdf_text_layers(input_path: Path, mode: str = "auto") -> List[dict]:
+    """
+    Read each page's text layer and decide whether it needs OCR.
+
+    In 'auto' mode a page is sent to OCR when it has images but fewer than
+    OCR_MIN_TEXT_CHARS characters of text; 'ocr' sends every page and 'text'
+    none. Pages that need OCR carry a content hash for the per-page cache.
+    """
+    import fitz
+    pages = []
+    with fitz.open(str(input_path)) as pdf_document:
+        for page in pdf_document:
+            text = page.get_text()
+            if mode == "ocr":
+                needs_ocr = True
+            elif mode == "text":
+                needs_ocr = False
+            else:
+                needs_ocr = len(text.strip()) < OCR_MIN_TEXT_CHARS and bool(page.get_images())
+            pages.append({
+                "page": page.number + 1,
+                "text": text,
+                "needs_ocr": needs_ocr,
+                "content_hash": page_content_hash(pdf_document, page) if needs_ocr else None,
+            })
+    return pages
+
+def render_ocr_image(pdf_document, page_index: int, dpi: int):
+    """Rasterize a page in grayscale for tesseract"""
+    import fitz
+    pix = pdf_document[page_index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+def run_tesseract(func_name: str, image, **kwargs):
+    """Call a pytesseract function by name, turning engine failures into picklable errors"""
+    import pytesseract
+    try:
+        return getattr(pytesseract, func_name)(image, **kwargs)
+    except pytesseract.TesseractNotFoundError:
+        raise RuntimeError("The tesseract OCR engine is not installed on the server")
+    except pytesseract.TesseractError as e:
+        raise InvalidInputError(f"OCR failed: {e.message}")
+
+def ocr_pdf_page(input_path: Path, page_index: int, dpi: int = 300, language: str = "eng") -> bytes:
+    """Rasterize one page and return the text tesseract recognizes on it, UTF-8 encoded"""
+    import fitz
+    with fitz.open(str(input_path)) as pdf_document:
+        image = render_ocr_image(pdf_document, page_index, dpi)
+    return run_tesseract("image_to_string", image, lang=language).encode('utf-8')
+
+def display_to_pdf_matrix(left: float, bottom: float, right: float, top: float, rotation: int) -> tuple:
+    """
+    (a, b, c, d, e, f) matrix from a page's displayed space (rotated, cropped, y down,
+    as rendered) to its PDF user space, for a crop box given in user space. Built by
+    hand because PyMuPDF's transformation_matrix drops the crop box offset on rotated
+    pages, and shared with pypdf callers.
+    """
+    width, height = right - left, top - bottom
+    a, b, c, d, e, f = {
+        0: (1, 0, 0, 1, 0, 0),
+        90: (0, -1, 1, 0, 0, height),
+        180: (-1, 0, 0, -1, width, height),
+        270: (0, 1, -1, 0, width, 0),
+    }[rotation % 360]
+    # Derotate, then flip y up from the crop box's top left corner
+    return (a, -b, c, -d, e + left, top - f)
+
+def ocr_pdf_page_text_layer(input_path: Path, page_index: int, dpi: int = 300, language: str = "eng") -> bytes:
+    """
+    OCR one page and return an invisible text layer for it as content stream operators.
+    
+    Every recognized word is drawn in text render mode 3 (invisible) with a text matrix
+    that maps it onto its box in the rendered image, stretched horizontally to the box
+    width so selections and search hits line up with the scanned word. The matrix goes
+    through the page's rotation and crop box, so it is valid in the page's own space.
+    """
+    import fitz
+    with fitz.open(str(input_path)) as pdf_document:
+        page = pdf_document[page_index]
+        image = render_ocr_image(pdf_document, page_index, dpi)
+        # page.cropbox is y-down from the top of the media box
+        cropbox, top = page.cropbox, page.mediabox.y1
+        to_pdf_space = fitz.Matrix(display_to_pdf_matrix(
+            cropbox.x0, top - cropbox.y1, cropbox.x1, top - cropbox.y0, page.rotation
+        ))
+    data = run_tesseract("image_to_data", image, lang=language, output_type="dict")
+    
+    scale = 72 / dpi
+    operators = []
+    for text, conf, left, top, width, height in zip(
+        data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"]
+    ):
+        text = text.strip()
+        if not text or float(conf) < 0 or width <= 0 or height <= 0:
+            continue
+        encoded = text.encode("cp1252", "replace")
+        font_size = height * scale
+        text_width = pdfmetrics.stringWidth(encoded.decode("cp1252"), OCR_TEXT_FONT, font_size)
+        horizontal_scale = width * scale / text_width if text_width else 1
+        baseline = (top + height) * scale - font_size * 0.2
+        glyph_matrix = fitz.Matrix(font_size * horizontal_scale, 0, 0, -font_size, left * scale, baseline)
+        a, b, c, d, e, f = glyph_matrix * to_pdf_space
+        operators.append(f"{a:.4f} {b:.4f} {c:.4f} {d:.4f} {e:.2f} {f:.2f} Tm <{encoded.hex()}> Tj")
+    if not operators:
+        return b""
+    return (f"BT 3 Tr {OCR_TEXT_FONT_RESOURCE} 1 Tf\n" + "\n".join(operators) + "\nET\n").encode("ascii")
+
+def add_text_layers_file(input_path: Path, output_path: Path, text_layers: dict):
+    """Append OCR text layers ({page_index: stream}) to their pages, leaving the page content untouched"""
+    pdf_writer = PdfWriter(clone_from=str(input_path))
+    font_ref = add_type1_font(pdf_writer, OCR_TEXT_FONT)
+    for page_index, text_layer in text_layers.items():
+        if text_layer:
+            add_text_stamp(pdf_writer, pdf_writer.pages[page_index], font_ref, text_layer, OCR_TEXT_FONT_RESOURCE)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+# Watermarks are drawn centered on the origin and kept per worker process, keyed by
+# what they look like; pages of any size or /Rotate share one Form XObject per
+# document and differ only in the matrix that places it.
+WATERMARK_CACHE_SIZE = int(os.environ.get('WATERMARK_CACHE_SIZE', 64))
+WATERMARK_RESOURCE = "/PDFMasterWatermark"
+WATERMARK_BBOX = [-14400, -14400, 14400, 14400]  # the largest page PDF allows, around the origin
+WATERMARK_POSITIONS = {
+    "center": (0.5, 0.5),
+    "top-left": (0.25, 0.75),
+    "top-right": (0.75, 0.75),
+    "bottom-left": (0.25, 0.25),
+    "bottom-right": (0.75, 0.25),
+}
+_watermark_cache = OrderedDict()
+_watermark_cache_lock = threading.Lock()
+
+def render_watermark_mark(
+    text: Optional[str] = None,
+    image_path: Optional[Path] = None,
+    opacity: float = 0.3,
+    rotation: int = 45,
+    size: int = 50
+) -> tuple:
+    """Draw a text or image watermark centered on the origin and return its (content, resources)"""
+    overlay = io.BytesIO()
+    c = canvas.Canvas(overlay, pagesize=letter)
+    c.saveState()
+    c.rotate(rotation)
+    
+    if image_path:
+        # Open and resize image
+        with Image.open(str(image_path)) as img:
+            img.load()
+        
+        # Calculate image dimensions based on size parameter
+        aspect_ratio = img.width / img.height
+        if aspect_ratio > 1:
+            img_width = size * 2
+            img_height = img_width / aspect_ratio
+        else:
+            img_height = size * 2
+            img_width = img_height * aspect_ratio
+        
+        # Set opacity
+        c.setFillAlpha(opacity)
+        
+        # Draw image (centered on the position)
+        c.drawImage(
+            ImageReader(img),
+            -img_width/2, -img_height/2,
+            width=img_width, height=img_height,
+            mask='auto',
+            preserveAspectRatio=True
+        )
+    elif text:
+        # Text watermark
+        c.setFont("Helvetica", size)
+        c.setFillColorRGB(0.5, 0.5, 0.5, alpha=opacity)
+        c.drawCentredString(0, 0, text)
+    else:
+        raise InvalidInputError("Either text or watermark_image must be provided")
+    
+    c.restoreState()
+    c.save()
+    page = PdfReader(overlay).pages[0]
+    return page.get_contents().get_data(), page["/Resources"].get_object()
+
+def get_watermark_mark(
+    text: Optional[str] = None,
+    image_path: Optional[Path] = None,
+    opacity: float = 0.3,
+    rotation: int = 45,
+    size: int = 50
+) -> tuple:
+    """Return render_watermark_mark's result from this process's cache, rendering it on a miss"""
+    image_digest = hashlib.sha256(Path(image_path).read_bytes()).hexdigest() if image_path else None
+    key = (None if image_path else text, image_digest, opacity, rotation, size)
+    with _watermark_cache_lock:
+        mark = _watermark_cache.get(key)
+        if mark is not None:
+            _watermark_cache.move_to_end(key)
+            return mark
+    mark = render_watermark_mark(text, image_path, opacity, rotation, size)
+    with _watermark_cache_lock:
+        _watermark_cache[key] = mark
+        while len(_watermark_cache) > WATERMARK_CACHE_SIZE:
+            _watermark_cache.popitem(last=False)
+    return mark
+
+def display_to_user_space(page) -> tuple:
+    """
+    display_to_pdf_matrix for a pypdf page, with the displayed space y up (origin at
+    the bottom left of the page as displayed), along with the displayed width and height.
+    """
+    box = page.cropbox
+    rotation = page.rotation % 360
+    width, height = float(box.width), float(box.height)
+    if rotation in (90, 270):
+        width, height = height, width
+    a, b, c, d, e, f = display_to_pdf_matrix(
+        float(box.left), float(box.bottom), float(box.right), float(box.top), rotation
+    )
+    # (x, y) -> (x, height - y) first
+    return (a, b, -c, -d, c * height + e, d * height + f), width, height
+
+def apply_watermark(
+    pdf_writer: PdfWriter,
+    text: Optional[str] = None,
+    image_path: Optional[Path] = None,
+    position: str = "center",
+    opacity: float = 0.3,
+    rotation: int = 45,
+    size: int = 50
+):
+    """
+    Stamp the watermark on every page of pdf_writer.
+    
+    The mark is added once as a Form XObject (its image embedded once) and each page
+    draws it through a matrix placing it at position on the page as displayed.
+    """
+    content, resources = get_watermark_mark(text, image_path, opacity, rotation, size)
+    form = DecodedStreamObject()
+    form.set_data(content)
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject(FloatObject(value) for value in WATERMARK_BBOX),
+        NameObject("/Resources"): resources.clone(pdf_writer),
+    })
+    form_ref = pdf_writer._add_object(form)
+    fx, fy = WATERMARK_POSITIONS.get(position, WATERMARK_POSITIONS["center"])
+    
+    for page in pdf_writer.pages:
+        (a, b, c, d, e, f), width, height = display_to_user_space(page)
+        x_pos, y_pos = width * fx, height * fy
+        matrix = (a, b, c, d, a * x_pos + c * y_pos + e, b * x_pos + d * y_pos + f)
+        stamp = ("q " + " ".join(f"{value:.4f}" for value in matrix) + f" cm {WATERMARK_RESOURCE} Do Q\n").encode("latin-1")
+        add_content_stamp(pdf_writer, page, stamp, "/XObject", WATERMARK_RESOURCE, form_ref)
+
+def watermark_pdf_file(
+    input_path: Path,
+    output_path: Path,
+    text: Optional[str] = None,
+    image_path: Optional[Path] = None,
+    position: str = "center",
+    opacity: float = 0.3,
+    rotation: int = 45,
+    size: int = 50
+):
+    """Stamp a text or image watermark on every page"""
+    pdf_writer = PdfWriter(clone_from=str(input_path))
+    apply_watermark(pdf_writer, text, image_path, position, opacity, rotation, size)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+def protect_pdf_file(input_path: Path, output_path: Path, password: str):
+    """Encrypt the PDF with password"""
+    pdf_writer = PdfWriter()
+    append_pdf_pages(pdf_writer, [input_path])
+    pdf_writer.encrypt(password)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+def unlock_pdf_file(input_path: Path, output_path: Path, password: str):
+    """Decrypt the PDF with password and write it without encryption"""
+    pdf_reader = PdfReader(str(input_path))
+    if pdf_reader.is_encrypted:
+        pdf_reader.decrypt(password)
+    pdf_writer = PdfWriter()
+    for page in pdf_reader.pages:
+        pdf_writer.add_page(page)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+def sign_pdf_file(input_path: Path, output_path: Path, signature_path: Path, signature_text: str):
+    """Stamp signature_text onto the last page"""
+    c = canvas.Canvas(str(signature_path), pagesize=letter)
+    c.setFont("Helvetica-Oblique", 24)
+    c.drawString(50, 50, signature_text)
+    c.save()
+    
+    pdf_reader = PdfReader(str(input_path))
+    signature_page = PdfReader(str(signature_path)).pages[0]
+    pdf_writer = PdfWriter()
+    
+    # Add signature to last page
+    for i, page in enumerate(pdf_reader.pages):
+        if i == len(pdf_reader.pages) - 1:
+            page.merge_page(signature_page)
+        pdf_writer.add_page(page)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+def to_roman(num: int) -> str:
+    """Convert a positive integer to upper-case roman numerals"""
+    val = [
+        1000, 900, 500, 400,
+        100, 90, 50, 40,
+        10, 9, 5, 4,
+        1
+    ]
+    syms = [
+        "M", "CM", "D", "CD",
+        "C", "XC", "L", "XL",
+        "X", "IX", "V", "IV",
+        "I"
+    ]
+    roman_num = ''
+    i = 0
+    while num > 0:
+        for _ in range(num // val[i]):
+            roman_num += syms[i]
+            num -= val[i]
+        i += 1
+    return roman_num
+
+PAGE_NUMBER_FONT = "Helvetica"
+PAGE_NUMBER_FONT_SIZE = 10
+PAGE_NUMBER_FONT_RESOURCE = "/PDFMasterPageNumber"
+PAGE_NUMBER_FORMATS = ("numeric", "numeric-page", "roman-lower", "roman-lower-page", "roman-upper", "roman-upper-page")
+PAGE_NUMBER_POSITIONS = ("bottom-left", "bottom-center", "bottom-right")
+
+def check_page_number_options(format: str, position: str):
+    """Raise a 400 for a page number format or position that is not supported"""
+    if format not in PAGE_NUMBER_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown page number format {format!r}. Use one of: {', '.join(PAGE_NUMBER_FORMATS)}")
+    if position not in PAGE_NUMBER_POSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown page number position {position!r}. Use one of: {', '.join(PAGE_NUMBER_POSITIONS)}")
+
+def format_page_number(page_number: int, format: str) -> str:
+    """Format a page number as numeric, 'Page n' or roman numerals"""
+    if format == "numeric":
+        return str(page_number)
+    elif format == "numeric-page":
+        return f"Page {page_number}"
+    elif format == "roman-lower":
+        return to_roman(page_number).lower()
+    elif format == "roman-lower-page":
+        return f"Page {to_roman(page_number).lower()}"
+    elif format == "roman-upper":
+        return to_roman(page_number)
+    elif format == "roman-upper-page":
+        return f"Page {to_roman(page_number)}"
+    return str(page_number)
+
+def add_type1_font(pdf_writer: PdfWriter, base_font: str):
+    """Add a standard 14 font object with WinAnsi encoding and return its reference"""
+    return pdf_writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(f"/{base_font}"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    }))
+
+def add_content_stamp(pdf_writer: PdfWriter, page, stamp: bytes, resource_type: str, resource_name: str, resource_ref):
+    """
+    Append a content stream to page, wrapping the existing content in q/Q so any
+    graphics state it leaves behind does not affect the stamp. The stamp refers to
+    resource_ref as resource_name in the page's resource_type (e.g. /Font) dictionary.
+    """
+    resources = page.setdefault(NameObject("/Resources"), DictionaryObject()).get_object()
+    named = resources.setdefault(NameObject(resource_type), DictionaryObject()).get_object()
+    named[NameObject(resource_name)] = resource_ref
+    
+    save_state = DecodedStreamObject()
+    save_state.set_data(b"q\n")
+    restore_and_stamp = DecodedStreamObject()
+    restore_and_stamp.set_data(b"Q\n" + stamp)
+    
+    contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if contents is None:
+        existing = []
+    elif isinstance(contents.get_object(), ArrayObject):
+        existing = list(contents.get_object())
+    else:
+        existing = [contents]
+    page[NameObject("/Contents")] = ArrayObject(
+        [pdf_writer._add_object(save_state), *existing, pdf_writer._add_object(restore_and_stamp)]
+    )
+
+def add_text_stamp(pdf_writer: PdfWriter, page, font_ref, stamp: bytes, font_name: str = PAGE_NUMBER_FONT_RESOURCE):
+    """Append a text content stream to page that refers to font_ref as font_name"""
+    add_content_stamp(pdf_writer, page, stamp, "/Font", font_name, font_ref)
+
+def stamp_page_numbers(pdf_writer: PdfWriter, format: str, position: str):
+    """
+    Stamp a page number on every page of pdf_writer.
+    
+    Each number is written as a small text content stream appended to its page, all
+    sharing one font object, so no overlay PDF is rendered or parsed per page.
+    """
+    font_ref = add_type1_font(pdf_writer, PAGE_NUMBER_FONT)
+    
+    for page_num, page in enumerate(pdf_writer.pages):
+        page_text = format_page_number(page_num + 1, format)
+        text_width = pdfmetrics.stringWidth(page_text, PAGE_NUMBER_FONT, PAGE_NUMBER_FONT_SIZE)
+        (a, b, c, d, e, f), page_width, _ = display_to_user_space(page)
+        
+        # Position the page number 20 points from the bottom of the page as displayed
+        if position == "bottom-left":
+            x_position = 40
+        elif position == "bottom-right":
+            x_position = page_width - text_width - 40
+        else:
+            x_position = (page_width - text_width) / 2
+        y_position = 20
+        matrix = (a, b, c, d, a * x_position + c * y_position + e, b * x_position + d * y_position + f)
+        
+        stamp = (
+            f"BT {PAGE_NUMBER_FONT_RESOURCE} {PAGE_NUMBER_FONT_SIZE} Tf "
+            + " ".join(f"{value:.2f}" for value in matrix) + f" Tm ({page_text}) Tj ET\n"
+        ).encode("latin-1")
+        add_text_stamp(pdf_writer, page, font_ref, stamp)
+
+def add_page_numbers_file(input_path: Path, output_path: Path, format: str, position: str):
+    """Stamp a page number on every page"""
+    pdf_writer = PdfWriter(clone_from=str(input_path))
+    stamp_page_numbers(pdf_writer, format, position)
+    with open(output_path, "wb") as f:
+        pdf_writer.write(f)
+
+def run_pdf_pipeline(input_paths: List[Path], output_path: Path, steps: List[dict], image_path: Optional[Path] = None) -> List[dict]:
+    """
+    Run validated pipeline steps over the PDFs at input_paths and save the result once.
+    
+    The document stays a PdfWriter object graph between steps. Compression is done by
+    fitz, so it happens at save time: the writer is serialized to memory, shrunk and
+    saved by fitz, which also applies the protect step's encryption. Without compress
+    the writer is encrypted and written directly. Returns the time spent per step.
+    """
+    timings = []
+    
+    def record(op: str, started: float):
+        timings.append({"op": op, "seconds": round(time.perf_counter() - started, 3)})
+    
+    started = time.perf_counter()
+    pdf_writer = PdfWriter()
+    append_pdf_pages(pdf_writer, input_paths)
+    record("merge" if steps[0]["op"] == "merge" else "load", started)
+    
+    compress = None
+    password = None
+    for step in steps:
+        started = time.perf_counter()
+        if step["op"] == "compress":
+            compress = step
+            continue
+        elif step["op"] == "protect":
+            password = step["password"]
+            continue
+        elif step["op"] == "add-page-numbers":
+            stamp_page_numbers(pdf_writer, step["format"], step["position"])
+        elif step["op"] == "watermark":
+            apply_watermark(
+                pdf_writer, step["text"], None if step["text"] else image_path,
+                step["position"], step["opacity"], step["rotation"], step["size"]
+            )
+        else:
+            continue
+        record(step["op"], started)
+    
+    started = time.perf_counter()
+    if compress:
+        import fitz
+        buffer = io.BytesIO()
+        pdf_writer.write(buffer)
+        with fitz.open(stream=buffer.getvalue(), filetype="pdf") as pdf_document:
+            shrink_pdf_document(pdf_document, compress["preset"], compress["grayscale"])
+            record("compress", started)
+            started = time.perf_counter()
+            encryption = dict(encryption=fitz.PDF_ENCRYPT_AES_256, user_pw=password, owner_pw=password) if password else {}
+            pdf_document.save(str(output_path), **COMPRESSION_SAVE_OPTIONS, **encryption)
+    else:
+        if password:
+            pdf_writer.encrypt(password, algorithm="AES-256")
+        with open(output_path, "wb") as f:
+            pdf_writer.write(f)
+    record("save", started)
+    return timings
+
+def reorder_pdf_file(input_path: Path, output_path: Path, page_order_list: List[int], cached: bool = False):
+    """Write the pages in the zero-based order given; every page must appear exactly once"""
+    with open_pdf_reader(input_path, cached) as pdf_reader:
+        total_pages = len(pdf_reader.pages)
+        
+        # Validate page order
+        if len(page_order_list) != total_pages:
+            raise InvalidInputError(
+                f"Page order must contain all {total_pages} pages. Received {len(page_order_list)} pages."
+            )
+        
+        # Check for duplicate pages
+        if len(set(page_order_list)) != len(page_order_list):
+            raise InvalidInputError("Page order contains duplicate page numbers")
+        
+        # Check for invalid page numbers
+        for page_num in page_order_list:
+            if page_num < 0 or page_num >= total_pages:
+                raise InvalidInputError(f"Invalid page number {page_num + 1}. Must be between 1 and {total_pages}")
+        
+        pdf_writer = PdfWriter()
+        for page_num in page_order_list:
+            pdf_writer.add_page(pdf_reader.pages[page_num])
+        with open(output_path, "wb") as f:
+            pdf_writer.write(f)
+
+def delete_pdf_pages_file(input_path: Path, output_path: Path, pages_to_delete_list: List[int], cached: bool = False):
+    """Write every page except the zero-based pages listed"""
+    with open_pdf_reader(input_path, cached) as pdf_reader:
+        pdf_writer = PdfWriter()
+        pages_to_delete = set(pages_to_delete_list)
+        for page_num in range(len(pdf_reader.pages)):
+            if page_num not in pages_to_delete:
+                pdf_writer.add_page(pdf_reader.pages[page_num])
+        
+        # Check if all pages were deleted
+        if len(pdf_writer.pages) == 0:
+            raise InvalidInputError("Cannot delete all pages. At least one page must remain.")
+        
+        with open(output_path, "wb") as f:
+            pdf_writer.write(f)
+
+# Notebook rendering settings
+# Styles and patterns are built once per process and cells become flowables lazily
+# (see StreamingDocTemplate). Code and output text is laid out as monospace lines in
+# chunks of NOTEBOOK_CHUNK_LINES, so a long output runs on across pages instead of
+# sitting in a single table cell that can't split.
+NOTEBOOK_FONT = "Courier"
+NOTEBOOK_FONT_SIZE = 8
+NOTEBOOK_LEADING = 11
+NOTEBOOK_MARGIN_X = 54
+NOTEBOOK_MARGIN_Y = 36
+NOTEBOOK_GUTTER = 50           # room for the In [n]: / Out[n]: labels
+NOTEBOOK_PADDING = 5
+NOTEBOOK_CELL_SPACING = 11
+NOTEBOOK_TAB_SIZE = 4
+NOTEBOOK_CHUNK_LINES = 50
+NOTEBOOK_IMAGE_MAX_PIXELS = 1000   # about 150 dpi across the page; larger images are downscaled
+NOTEBOOK_IMAGE_CACHE_SIZE = 16
+NOTEBOOK_IMAGE_TYPES = ('image/png', 'image/jpeg')
+NOTEBOOK_BORDER_COLOR = HexColor('#e0e0e0')
+NOTEBOOK_LINK_COLOR = '#0066cc'
+NOTEBOOK_HEADING_SIZES = (18, 15, 13, 11.5, 10.5, 10)
+NOTEBOOK_ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]|\x1b\][^\x07]*\x07')
+NOTEBOOK_HEADING = re.compile(r'^\s{0,3}(#{1,6})\s+(.*?)[\s#]*$')
+NOTEBOOK_FENCE = re.compile(r'^\s{0,3}(```|~~~)')
+NOTEBOOK_CODE_SPAN = re.compile(r'`([^`]+)`')
+NOTEBOOK_BOLD = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__')
+NOTEBOOK_ITALIC = re.compile(r'(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?!\w)|(?<![\w_])_(?=\S)(.+?)(?<=\S)_(?!\w)')
+NOTEBOOK_LINK = re.compile(r'(!?)\[([^\]]*)\]\(([^)\s]+)[^)]*\)')
+
+@dataclass(frozen=True)
+class NotebookBlockStyle:
+    background: object
+    text_color: object
+    label_color: object
+
+@functools.lru_cache(maxsize=2)
+def notebook_styles(color_mode: str) -> dict:
+    """Paragraph and block styles for a color mode, built once per process"""
+    from reportlab.lib.styles import ParagraphStyle
+    colorful = color_mode == "colorful"
+    black = HexColor('#000000')
+    label = HexColor('#0066cc') if colorful else black
+    styles = {
+        'markdown': ParagraphStyle('NotebookMarkdown', fontName='Helvetica', fontSize=10, leading=14,
+                                   leftIndent=NOTEBOOK_GUTTER, spaceAfter=4),
+        'input': NotebookBlockStyle(HexColor('#f7f7f7'), HexColor('#1565c0') if colorful else black, label),
+        'output': NotebookBlockStyle(HexColor('#ffffff'), black, label),
+        'stderr': NotebookBlockStyle(HexColor('#fff5f5'), black, label),
+        'error': NotebookBlockStyle(HexColor('#fff0f0'), HexColor('#d32f2f'), label),
+    }
+    for level, size in enumerate(NOTEBOOK_HEADING_SIZES, 1):
+        styles[f'h{level}'] = ParagraphStyle(f'NotebookHeading{level}', parent=styles['markdown'],
+                                             fontName='Helvetica-Bold', fontSize=size, leading=size * 1.25,
+                                             spaceBefore=6, spaceAfter=4)
+    return styles
+
+def notebook_text_lines(text: str, columns: int) -> List[str]:
+    """Split output text into display lines: ANSI codes removed, carriage returns applied, long lines wrapped"""
+    text = NOTEBOOK_ANSI_ESCAPE.sub('', text).replace('\r\n', '\n').expandtabs(NOTEBOOK_TAB_SIZE)
+    lines = []
+    for line in text.split('\n'):
+        # A bare \r rewinds the line, as progress bars use it
+        line = line.rsplit('\r', 1)[-1].rstrip()
+        while len(line) > columns:
+            lines.append(line[:columns])
+            line = line[columns:]
+        lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+def markdown_markup(text: str) -> str:
+    """Paragraph markup for a line of markdown: code spans, bold, italic and links"""
+    parts = NOTEBOOK_CODE_SPAN.split(text)
+    markup = []
+    for index, part in enumerate(parts):
+        part = html.escape(part, quote=False)
+        if index % 2:
+            markup.append(f'<font face="{NOTEBOOK_FONT}">{part}</font>')
+            continue
+        part = NOTEBOOK_BOLD.sub(lambda m: f"<b>{m.group(1) or m.group(2)}</b>", part)
+        part = NOTEBOOK_ITALIC.sub(lambda m: f"<i>{m.group(1) or m.group(2)}</i>", part)
+        part = NOTEBOOK_LINK.sub(
+            lambda m: m.group(2) if m.group(1)
+            else f'<a href="{m.group(3).replace(chr(34), "%22")}" color="{NOTEBOOK_LINK_COLOR}">{m.group(2)}</a>',
+            part,
+        )
+        markup.append(part)
+    return ''.join(markup)
+
+# Image readers for image outputs, kept per process by content hash so an image that
+# appears in several outputs (or notebooks) is decoded and downscaled only once.
+_notebook_images = OrderedDict()
+_notebook_images_lock = threading.Lock()
+
+def notebook_image(data: str) -> Optional[tuple]:
+    """
+    Decode a base64 image output into (ImageReader, width, height), with the size in
+    points at the image's natural size. Returns None if it isn't a readable image.
+    """
+    key = hashlib.sha1(data.encode('ascii', 'ignore')).hexdigest()
+    with _notebook_images_lock:
+        if key in _notebook_images:
+            _notebook_images.move_to_end(key)
+            return _notebook_images[key]
+    try:
+        raw = base64.b64decode(data)
+        with Image.open(io.BytesIO(raw)) as img:
+            size = (img.width * 0.75, img.height * 0.75)
+            if max(img.size) > NOTEBOOK_IMAGE_MAX_PIXELS:
+                image_format = 'JPEG' if img.format == 'JPEG' else 'PNG'
+                img.thumbnail((NOTEBOOK_IMAGE_MAX_PIXELS, NOTEBOOK_IMAGE_MAX_PIXELS), Image.LANCZOS)
+                buffer = io.BytesIO()
+                img.save(buffer, image_format)
+                raw = buffer.getvalue()
+        image = (ImageReader(io.BytesIO(raw)), *size)
+    except Exception:
+        image = None
+    with _notebook_images_lock:
+        _notebook_images[key] = image
+        while len(_notebook_images) > NOTEBOOK_IMAGE_CACHE_SIZE:
+            _notebook_images.popitem(last=False)
+    return image
+
+@functools.lru_cache(maxsize=None)
+def notebook_flowable_classes():
+    """The text band and image flowables, defined on first use so only notebook rendering imports platypus"""
+    from reportlab.platypus import Flowable
+
+    class NotebookTextBlock(Flowable):
+        """
+        Monospace lines on a shaded, outlined band with an optional label in the
+        gutter. It splits between lines, and the pieces join up into one band.
+        """
+
+        def __init__(self, lines, style, label=None, first=True, last=True):
+            super().__init__()
+            self.lines = lines
+            self.style = style
+            self.label = label
+            self.first = first
+            self.last = last
+
+        def padding(self):
+            return (NOTEBOOK_PADDING if self.first else 0), (NOTEBOOK_PADDING if self.last else 0)
+
+        def wrap(self, availWidth, availHeight):
+            top, bottom = self.padding()
+            self.width = availWidth
+            self.height = top + bottom + len(self.lines) * NOTEBOOK_LEADING
+            return self.width, self.height
+
+        def split(self, availWidth, availHeight):
+            top, _ = self.padding()
+            fits = int((availHeight - top) // NOTEBOOK_LEADING)
+            if fits < 1 or fits >= len(self.lines):
+                return []
+            return [NotebookTextBlock(self.lines[:fits], self.style, self.label, self.first, False),
+                    NotebookTextBlock(self.lines[fits:], self.style, None, False, self.last)]
+
+        def draw(self):
+            canv = self.canv
+            top, _ = self.padding()
+            left = NOTEBOOK_GUTTER
+            canv.saveState()
+            canv.setFillColor(self.style.background)
+            canv.setStrokeColor(NOTEBOOK_BORDER_COLOR)
+            canv.rect(left, 0, self.width - left, self.height, stroke=0, fill=1)
+            canv.line(left, 0, left, self.height)
+            canv.line(self.width, 0, self.width, self.height)
+            if self.first:
+                canv.line(left, self.height, self.width, self.height)
+            if self.last:
+                canv.line(left, 0, self.width, 0)
+            baseline = self.height - top - NOTEBOOK_FONT_SIZE
+            if self.label:
+                canv.setFont(NOTEBOOK_FONT, NOTEBOOK_FONT_SIZE)
+                canv.setFillColor(self.style.label_color)
+                canv.drawRightString(left - NOTEBOOK_PADDING, baseline, self.label)
+            text = canv.beginText(left + NOTEBOOK_PADDING, baseline)
+            text.setFont(NOTEBOOK_FONT, NOTEBOOK_FONT_SIZE, NOTEBOOK_LEADING)
+            text.setFillColor(self.style.text_color)
+            for line in self.lines:
+                text.textLine(line)
+            canv.drawText(text)
+            canv.restoreState()
+
+    class NotebookImage(Flowable):
+        """An image output drawn past the gutter from a shared ImageReader"""
+
+        def __init__(self, reader, width, height):
+            super().__init__()
+            self.reader = reader
+            self.image_width = width
+            self.image_height = height
+
+        def wrap(self, availWidth, availHeight):
+            return availWidth, self.image_height + 2 * NOTEBOOK_PADDING
+
+        def draw(self):
+            self.canv.drawImage(self.reader, NOTEBOOK_GUTTER + NOTEBOOK_PADDING, NOTEBOOK_PADDING,
+                                self.image_width, self.image_height, mask='auto')
+
+    return NotebookTextBlock, NotebookImage
+
+class NotebookRenderer:
+    """Turns notebook cells into platypus flowables"""
+
+    def __init__(self, styles: dict, frame_width: float, frame_height: float):
+        self.styles = styles
+        self.text_block, self.image = notebook_flowable_classes()
+        char_width = pdfmetrics.stringWidth(' ', NOTEBOOK_FONT, NOTEBOOK_FONT_SIZE)
+        self.columns = max(1, int((frame_width - NOTEBOOK_GUTTER - 2 * NOTEBOOK_PADDING) // char_width))
+        self.image_width = frame_width - NOTEBOOK_GUTTER - NOTEBOOK_PADDING
+        self.image_height = frame_height - 2 * NOTEBOOK_PADDING
+        self.images = 0
+
+    def flowables(self, cells, progress: Optional[ProgressFile] = None):
+        from reportlab.platypus import Spacer
+        for number, cell in enumerate(cells, 1):
+            report_progress(progress, number, len(cells), "laying out cells")
+            if cell.cell_type == 'markdown':
+                yield from self.markdown_flowables(cell.source)
+            elif cell.cell_type == 'code':
+                count = cell.get('execution_count')
+                yield from self.text_blocks(cell.source, self.styles['input'], f"In [{count or ' '}]:", keep_empty=True)
+                for output in cell.get('outputs', []):
+                    yield from self.output_flowables(output, count)
+            else:
+                yield from self.text_blocks(cell.source, self.styles['output'])
+            yield Spacer(1, NOTEBOOK_CELL_SPACING)
+
+    def text_blocks(self, text: str, style: NotebookBlockStyle, label: Optional[str] = None, keep_empty: bool = False):
+        """Bands of at most NOTEBOOK_CHUNK_LINES lines that together show the text"""
+        lines = notebook_text_lines(text, self.columns) or ([''] if keep_empty else [])
+        for start in range(0, len(lines), NOTEBOOK_CHUNK_LINES):
+            yield self.text_block(lines[start:start + NOTEBOOK_CHUNK_LINES], style, label if start == 0 else None,
+                                  first=start == 0, last=start + NOTEBOOK_CHUNK_LINES >= len(lines))
+
+    def output_flowables(self, output, execution_count: Optional[int]):
+        output_type = output.get('output_type')
+        if output_type == 'stream':
+            style = self.styles['stderr'] if output.get('name') == 'stderr' else self.styles['output']
+            yield from self.text_blocks(output.get('text', ''), style)
+        elif output_type in ('execute_result', 'display_data'):
+            data = output.get('data', {})
+            for mime_type in NOTEBOOK_IMAGE_TYPES:
+                image = self.image_flowable(data[mime_type]) if mime_type in data else None
+                if image:
+                    yield image
+                    return
+            label = f"Out[{execution_count}]:" if output_type == 'execute_result' and execution_count else None
+            yield from self.text_blocks(data.get('text/plain', ''), self.styles['output'], label)
+        elif output_type == 'error':
+            traceback = output.get('traceback') or [f"{output.get('ename', 'Error')}: {output.get('evalue', '')}"]
+            yield from self.text_blocks('\n'.join(traceback), self.styles['error'])
+
+    def image_flowable(self, data: str):
+        """An image output scaled to fit the frame; None if it isn't a readable image"""
+        image = notebook_image(data)
+        if image is None:
+            return None
+        reader, width, height = image
+        scale = min(1, self.image_width / width, self.image_height / height)
+        self.images += 1
+        return self.image(reader, width * scale, height * scale)
+
+    def markdown_flowables(self, source: str):
+        """Headings, paragraphs (keeping line breaks) and fenced code blocks"""
+        paragraph = []
+        fence = None
+        for line in source.split('\n'):
+            if fence is not None:
+                if NOTEBOOK_FENCE.match(line):
+                    yield from self.text_blocks('\n'.join(fence), self.styles['input'], keep_empty=True)
+                    fence = None
+                else:
+                    fence.append(line)
+                continue
+            heading = NOTEBOOK_HEADING.match(line)
+            if heading or not line.strip() or NOTEBOOK_FENCE.match(line):
+                if paragraph:
+                    yield self.paragraph(paragraph, self.styles['markdown'])
+                    paragraph = []
+                if heading:
+                    yield self.paragraph([heading.group(2)], self.styles[f"h{len(heading.group(1))}"])
+                elif line.strip():
+                    fence = []
+            else:
+                paragraph.append(line)
+        if paragraph:
+            yield self.paragraph(paragraph, self.styles['markdown'])
+        if fence:
+            yield from self.text_blocks('\n'.join(fence), self.styles['input'])
+
+    @staticmethod
+    def paragraph(lines: List[str], style):
+        from reportlab.platypus import Paragraph
+        try:
+            return Paragraph('<br/>'.join(markdown_markup(line) for line in lines), style)
+        except ValueError:
+            # Markup the paragraph parser rejects is shown as plain text
+            return Paragraph('<br/>'.join(html.escape(line, quote=False) for line in lines), style)
+
+def build_notebook_pdf(notebook_path: Path, output_path: Path, color_mode: str = "bw",
+                       progress: Optional[ProgressFile] = None) -> dict:
+    """
+    Render a Jupyter notebook to PDF, including its image outputs. color_mode: 'bw' or
+    'colorful'. Returns the cell, page and image counts and the rendering time.
+    """
+    import nbformat
+    from reportlab.platypus import PageTemplate, Frame
+    started = time.perf_counter()
+    try:
+        with open(notebook_path, 'r', encoding='utf-8') as f:
+            notebook = nbformat.read(f, as_version=4)
+    except nbformat.reader.NotJSONError:
+        raise InvalidInputError("Invalid Jupyter Notebook file. The file is not a valid JSON format. Please upload a valid .ipynb file.")
+    except Exception as e:
+        raise InvalidInputError(f"Could not read notebook file: {str(e)}")
+
+    pages = 0
+
+    # Build PDF, reporting each finished page
+    def page_done(canvas, doc):
+        nonlocal pages
+        pages += 1
+        report_progress(progress, doc.page, None, "rendering pages")
+
+    doc = streaming_doc_template_class()(str(output_path), pagesize=letter,
+                                         leftMargin=NOTEBOOK_MARGIN_X, rightMargin=NOTEBOOK_MARGIN_X,
+                                         topMargin=NOTEBOOK_MARGIN_Y, bottomMargin=NOTEBOOK_MARGIN_Y)
+    doc.addPageTemplates([PageTemplate(
+        id='normal', frames=[Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height)], onPage=page_done
+    )])
+    renderer = NotebookRenderer(notebook_styles(color_mode), doc.width, doc.height)
+    doc.build(renderer.flowables(notebook.cells, progress))
+
+    seconds = time.perf_counter() - started
+    return {"cells": len(notebook.cells), "pages": pages, "images": renderer.images, "seconds": round(seconds, 3)}
+
+@api_router.get("/")
+async def root():
+    return {"message": "PDF Master API"}
+
+@api_router.api_route("/health", methods=["GET", "HEAD"])
+async def health_check():
+    """Health check endpoint for monitoring services like UptimeRobot"""
+    return {"status": "ok", "timestamp": datetime.now(timezone.utc).isoformat(), "database": await mongo.health()}
+
+@api_router.get("/metrics/workers")
+async def worker_metrics():
+    """Worker pool sizes, queue depth and per-operation timings"""
+    return worker_pool.metrics()
+
+@api_router.get("/metrics/cache")
+async def cache_metrics():
+    """Result cache size and hit/miss counts"""
+    return result_cache.metrics()
+
+@api_router.get("/metrics/scratch")
+async def scratch_metrics():
+    """Scratch space usage, quota and sweep counts"""
+    return scratch.metrics()
+
+@api_router.get("/metrics/jobs")
+async def job_metrics():
+    """Background job counts by status and scheduler limits"""
+    return job_scheduler.metrics()
+
+@api_router.get("/metrics/operations")
+async def operation_metrics(limit: int = Query(50, ge=0, le=OPERATION_LOG_BUFFER_SIZE)):
+    """Operation record counts and the most recent records kept in memory"""
+    return operation_log.metrics(limit)
+
+@api_router.get("/metrics/startup")
+async def startup_metrics():
+    """Server import time, warm-up import time per module and which tool modules are loaded"""
+    loaded = sorted({module for modules in TOOL_MODULES.values() for module in modules if module in sys.modules})
+    return {**startup_report, "loaded_tool_modules": loaded}
+
+@api_router.post("/merge")
+async def merge_pdfs(files: List[UploadFile] = File(...)):
+    """Merge multiple PDF files into one"""
+    temp_files = []
+    output_file = None
+    
+    try:
+        # Save all uploaded files
+        for file in files:
+            if not file.filename.lower().endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+            temp_path = await save_upload_file(file)
+            temp_files.append(temp_path)
+        
+        # Merge PDFs
+        note_operation(files=len(temp_files))
+        output_file = scratch_file("_merged.pdf")
+        await worker_pool.run("merge", merge_pdf_files, temp_files, output_file)
+        
+        # Use first file's name as base for output
+        output_filename = get_output_filename(files[0].filename, 'pdf', '_merged')
+        
+        # Return file
+        return create_file_response(
+            output_file,
+            output_filename,
+            "application/pdf",
+            lambda: cleanup_files(*temp_files, output_file)
+        )
+    
+    except HTTPException:
+        cleanup_files(*temp_files, output_file)
+        raise
+    except InvalidInputError as e:
+        cleanup_files(*temp_files, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(*temp_files, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -267,26 +4617,11 @@ async def split_pdf(file: UploadFile = File(...), pages: str = Form(...)):
         temp_file = await save_upload_file(file)
         
         # Parse page ranges
-        page_list = []
-        for part in pages.split(','):
-            if '-' in part:
-                start, end = map(int, part.split('-'))
-                page_list.extend(range(start - 1, end))
-            else:
-                page_list.append(int(part) - 1)
+        page_list = parse_page_ranges(pages)
         
         # Split PDF
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        for page_num in page_list:
-            if 0 <= page_num < len(pdf_reader.pages):
-                pdf_writer.add_page(pdf_reader.pages[page_num])
-        
-        # Save split PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_split.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_split.pdf")
+        await worker_pool.run("split", split_pdf_file, temp_file, output_file, page_list)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_split')
         
@@ -302,37 +4637,52 @@ async def split_pdf(file: UploadFile = File(...), pages: str = Form(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/compress")
-async def compress_pdf(file: UploadFile = File(...)):
-    """Compress PDF file"""
+async def compress_pdf(
+    file: UploadFile = File(...),
+    preset: str = Form("ebook"),
+    grayscale: bool = Form(False)
+):
+    """
+    Compress PDF file with a preset: 'screen' (72 dpi), 'ebook' (150 dpi) or 'print' (300 dpi).
+    
+    The X-Compression-Report header holds the size per category before and after.
+    """
     temp_file = None
     output_file = None
     
     try:
-        temp_file = await save_upload_file(file)
+        if preset not in COMPRESSION_PRESETS:
+            raise HTTPException(status_code=400, detail=f"Unknown preset {preset}. Use one of: {', '.join(COMPRESSION_PRESETS)}")
         
-        # Read and rewrite PDF (basic compression)
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
-            # Compress after adding to writer
-            pdf_writer.pages[-1].compress_content_streams()
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        output_filename = get_output_filename(file.filename, 'pdf', '_compressed')
         
-        # Save compressed PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_compressed.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        cache_key = result_cache.key("compress", upload.sha256, preset=preset, grayscale=grayscale)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            report = result_cache.get_metadata(cache_key)
+            if report:
+                cached_response.headers["X-Compression-Report"] = json.dumps(report)
+            return cached_response
         
-        output_filename = get_output_filename(file.filename, 'pdf', '_compressed')
+        output_file = scratch_file("_compressed.pdf")
+        report = await worker_pool.run("compress", compress_pdf_file, temp_file, output_file, preset, grayscale)
+        await store_cached_result(cache_key, output_file, report)
+        logging.info(f"Compressed {file.filename}: {report['before']['total']} -> {report['after']['total']} bytes")
         
-        return create_file_response(
+        response = create_file_response(
             output_file,
             output_filename,
             "application/pdf",
             lambda: cleanup_files(temp_file, output_file)
         )
+        response.headers["X-Compression-Report"] = json.dumps(report)
+        return response
     
+    except HTTPException:
+        cleanup_files(temp_file, output_file)
+        raise
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -346,16 +4696,8 @@ async def rotate_pdf(file: UploadFile = File(...), angle: int = Form(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        for page in pdf_reader.pages:
-            page.rotate(angle)
-            pdf_writer.add_page(page)
-        
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_rotated.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_rotated.pdf")
+        await worker_pool.run("rotate", rotate_pdf_file, temp_file, output_file, angle)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_rotated')
         
@@ -370,73 +4712,147 @@ async def rotate_pdf(file: UploadFile = File(...), angle: int = Form(...)):
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/pdf-to-jpg")
-async def pdf_to_jpg(file: UploadFile = File(...)):
-    """Convert PDF to JPG images"""
+# Rasterization configuration
+RASTER_CHUNK_PAGES = int(os.environ.get('RASTER_CHUNK_PAGES', 4))
+RASTER_MAX_DPI = int(os.environ.get('RASTER_MAX_DPI', 600))
+RASTER_FORMATS = {"jpg": "image/jpeg", "png": "image/png"}
+
+async def rasterize_pdf_upload(
+    operation: str,
+    file: UploadFile,
+    image_format: str,
+    dpi: int,
+    pages: Optional[str],
+    colorspace: str,
+    quality: int
+):
+    """
+    Shared implementation of /pdf-to-jpg and /pdf-to-png.
+    
+    A single selected page is returned as an image. Several pages are rendered in
+    chunks across the worker pool and streamed back as a ZIP, in page order, as each
+    chunk finishes; only a bounded number of chunks is rendered ahead of the client.
+    If a chunk fails mid-stream the ZIP ends with an error.json entry describing it.
+    """
     temp_file = None
-    output_files = []
+    work_dir = None
+    media_type = RASTER_FORMATS[image_format]
+    
+    def cleanup():
+        cleanup_files(temp_file)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
     
     try:
-        temp_file = await save_upload_file(file)
+        if not 18 <= dpi <= RASTER_MAX_DPI:
+            raise HTTPException(status_code=400, detail=f"DPI must be between 18 and {RASTER_MAX_DPI}")
+        if colorspace not in ("rgb", "gray"):
+            raise HTTPException(status_code=400, detail="Colorspace must be 'rgb' or 'gray'")
+        if not 1 <= quality <= 100:
+            raise HTTPException(status_code=400, detail="Quality must be between 1 and 100")
         
-        # Convert PDF pages to images using PyMuPDF
-        import fitz
-        pdf_document = fitz.open(str(temp_file))
-        
-        # If single page, return single image
-        if len(pdf_document) == 1:
-            page = pdf_document[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            output_file = UPLOAD_DIR / f"{uuid.uuid4()}.jpg"
-            pix.save(str(output_file))
-            output_files.append(output_file)
-            
-            output_filename = get_output_filename(file.filename, 'jpg')
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        
+        total_pages = await worker_pool.run("page-count", count_pdf_pages, temp_file)
+        try:
+            page_indexes = parse_page_ranges(pages) if pages else list(range(total_pages))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid page range format. Use e.g. 1-3,5")
+        page_indexes = [i for i in page_indexes if 0 <= i < total_pages]
+        if not page_indexes:
+            raise HTTPException(status_code=400, detail="No pages selected")
+        note_operation(pages=len(page_indexes))
+        
+        work_dir = scratch_dir(f"_{image_format}")
+        render_options = dict(image_format=image_format, dpi=dpi, colorspace=colorspace, quality=quality)
+        
+        if len(page_indexes) == 1:
+            output_filename = get_output_filename(file.filename, image_format)
+            cache_key = result_cache.key(operation, upload.sha256, pages=page_indexes, **render_options)
+            cached_response = cached_result_response(cache_key, output_filename, media_type, temp_file)
+            if cached_response:
+                cleanup()
+                return cached_response
             
-            return create_file_response(output_file, output_filename, "image/jpeg", lambda: cleanup_files(temp_file, output_file))
-        else:
-            # Multiple pages - return first page for now
-            page = pdf_document[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            output_file = UPLOAD_DIR / f"{uuid.uuid4()}.jpg"
-            pix.save(str(output_file))
+            [output_file] = await worker_pool.run(operation, rasterize_pdf_pages, temp_file, work_dir, page_indexes, **render_options)
+            await store_cached_result(cache_key, output_file)
+            return create_file_response(output_file, output_filename, media_type, cleanup)
+        
+        stem = Path(file.filename).stem
+        digits = len(str(total_pages))
+        chunks = [page_indexes[i:i + RASTER_CHUNK_PAGES] for i in range(0, len(page_indexes), RASTER_CHUNK_PAGES)]
+        max_in_flight = worker_pool.process_workers * 2
+        
+        async def rendered_pages():
+            pending = deque()
+            remaining = iter(chunks)
             
-            output_filename = get_output_filename(file.filename, 'jpg')
+            def submit_next():
+                chunk = next(remaining, None)
+                if chunk is not None:
+                    pending.append(asyncio.ensure_future(
+                        worker_pool.run(operation, rasterize_pdf_pages, temp_file, work_dir, chunk, **render_options)
+                    ))
             
-            return create_file_response(output_file, output_filename, "image/jpeg", lambda: cleanup_files(temp_file, output_file))
+            rendered = 0
+            try:
+                for _ in range(max_in_flight):
+                    submit_next()
+                while pending:
+                    output_paths = await pending.popleft()
+                    submit_next()
+                    for output_path in output_paths:
+                        page_number = int(output_path.stem.split('_')[-1])
+                        rendered += 1
+                        yield f"{stem}_page_{page_number:0{digits}d}.{image_format}", output_path
+            except Exception as e:
+                # Headers are already sent, so close the ZIP with an error entry
+                # instead of ending it after the last page that rendered
+                logging.error(f"{operation} failed after {rendered} of {len(page_indexes)} pages: {e}")
+                yield "error.json", json.dumps({
+                    "error": str(e) or type(e).__name__,
+                    "pages_rendered": rendered,
+                    "pages_selected": len(page_indexes),
+                }, indent=2).encode('utf-8')
+            finally:
+                for task in pending:
+                    task.cancel()
+        
+        return create_streaming_response(
+            stream_zip(rendered_pages()),
+            get_output_filename(file.filename, 'zip', f'_{image_format}'),
+            "application/zip",
+            cleanup
+        )
     
+    except HTTPException:
+        cleanup()
+        raise
     except Exception as e:
-        cleanup_files(temp_file, *output_files)
+        cleanup()
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/pdf-to-jpg")
+async def pdf_to_jpg(
+    file: UploadFile = File(...),
+    dpi: int = Form(144),
+    pages: Optional[str] = Form(None),
+    colorspace: str = Form("rgb"),
+    quality: int = Form(95)
+):
+    """Convert PDF pages to JPG images (a ZIP when more than one page is selected)"""
+    return await rasterize_pdf_upload("pdf-to-jpg", file, "jpg", dpi, pages, colorspace, quality)
+
 @api_router.post("/pdf-to-png")
-async def pdf_to_png(file: UploadFile = File(...)):
-    """Convert PDF to PNG images"""
-    temp_file = None
-    output_file = None
-    
-    try:
-        temp_file = await save_upload_file(file)
-        
-        import fitz
-        pdf_document = fitz.open(str(temp_file))
-        page = pdf_document[0]
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.png"
-        pix.save(str(output_file))
-        
-        output_filename = get_output_filename(file.filename, 'png')
-        
-        return create_file_response(
-            output_file,
-            output_filename,
-            "image/png",
-            lambda: cleanup_files(temp_file, output_file)
-        )
-    
-    except Exception as e:
-        cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=500, detail=str(e))
+async def pdf_to_png(
+    file: UploadFile = File(...),
+    dpi: int = Form(144),
+    pages: Optional[str] = Form(None),
+    colorspace: str = Form("rgb")
+):
+    """Convert PDF pages to PNG images (a ZIP when more than one page is selected)"""
+    return await rasterize_pdf_upload("pdf-to-png", file, "png", dpi, pages, colorspace, 95)
 
 @api_router.post("/jpg-to-pdf")
 async def jpg_to_pdf(file: UploadFile = File(...)):
@@ -447,9 +4863,8 @@ async def jpg_to_pdf(file: UploadFile = File(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        with open(output_file, "wb") as f:
-            f.write(img2pdf.convert(str(temp_file)))
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("image-to-pdf", image_to_pdf_file, temp_file, output_file)
         
         output_filename = get_output_filename(file.filename, 'pdf')
         
@@ -473,9 +4888,8 @@ async def png_to_pdf(file: UploadFile = File(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        with open(output_file, "wb") as f:
-            f.write(img2pdf.convert(str(temp_file)))
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("image-to-pdf", image_to_pdf_file, temp_file, output_file)
         
         output_filename = get_output_filename(file.filename, 'pdf')
         
@@ -490,24 +4904,79 @@ async def png_to_pdf(file: UploadFile = File(...)):
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
 
+# PDF to Word configuration
+# Longer documents are split into chunks of at least PDF_TO_WORD_CHUNK_PAGES pages
+# that are converted in parallel worker processes and stitched back together.
+PDF_TO_WORD_CHUNK_PAGES = int(os.environ.get('PDF_TO_WORD_CHUNK_PAGES', 10))
+
+async def select_pdf_pages(input_path: Path, pages: Optional[str]) -> List[int]:
+    """Zero-based indexes of the pages chosen by a range like '1-3,5' (all pages when empty)"""
+    total_pages = await worker_pool.run("page-count", count_pdf_pages, input_path)
+    try:
+        page_indexes = parse_page_ranges(pages) if pages else list(range(total_pages))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid page range format. Use e.g. 1-3,5")
+    page_indexes = [i for i in page_indexes if 0 <= i < total_pages]
+    if not page_indexes:
+        raise HTTPException(status_code=400, detail="No pages selected")
+    return page_indexes
+
+async def convert_pdf_to_docx(input_path: Path, output_path: Path, page_indexes: List[int],
+                              progress: Optional[ProgressFile] = None):
+    """Convert the given pages to DOCX, in parallel chunks when there are enough of them"""
+    chunk_pages = max(PDF_TO_WORD_CHUNK_PAGES, -(-len(page_indexes) // (worker_pool.process_workers * 2)))
+    chunks = [page_indexes[i:i + chunk_pages] for i in range(0, len(page_indexes), chunk_pages)]
+    if len(chunks) == 1:
+        await worker_pool.run("pdf-to-word", pdf_to_docx_file, input_path, output_path, progress, pages=page_indexes)
+        return
+    
+    # Held, not just workspace-owned, since jobs run outside any request workspace;
+    # the sweeper must not take a finished chunk before it is stitched
+    chunk_paths = [scratch_file(f"_part{i}.docx") for i in range(len(chunks))]
+    scratch.hold(*chunk_paths)
+    
+    async def convert_chunk(index):
+        await worker_pool.run("pdf-to-word", pdf_to_docx_file, input_path, chunk_paths[index], pages=chunks[index])
+        return index
+    
+    try:
+        done = 0
+        async for index in map_in_order(convert_chunk, range(len(chunks)), worker_pool.process_workers):
+            done += len(chunks[index])
+            report_progress(progress, done, len(page_indexes), "converting pages")
+        report_progress(progress, len(page_indexes), len(page_indexes), "joining chunks")
+        await worker_pool.run("pdf-to-word", stitch_docx_files, chunk_paths, output_path)
+    finally:
+        cleanup_files(*chunk_paths)
+
 @api_router.post("/pdf-to-word")
-async def pdf_to_word(file: UploadFile = File(...)):
-    """Convert PDF to Word"""
+async def pdf_to_word(file: UploadFile = File(...), pages: Optional[str] = Form(None)):
+    """Convert PDF (or the pages in a range like '1-3,5') to Word"""
     temp_file = None
     output_file = None
     
     try:
-        temp_file = await save_upload_file(file)
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.docx"
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        output_filename = get_output_filename(file.filename, 'docx')
+        media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         
-        cv = Converter(str(temp_file))
-        cv.convert(str(output_file))
-        cv.close()
+        page_indexes = await select_pdf_pages(temp_file, pages)
+        note_operation(pages=len(page_indexes))
+        cache_key = result_cache.key("pdf-to-word", upload.sha256, pages=page_indexes if pages else None)
+        cached_response = cached_result_response(cache_key, output_filename, media_type, temp_file)
+        if cached_response:
+            return cached_response
         
-        output_filename = get_output_filename(file.filename, 'docx')
+        output_file = scratch_file(".docx")
+        await convert_pdf_to_docx(temp_file, output_file, page_indexes)
+        await store_cached_result(cache_key, output_file)
         
-        return create_file_response(output_file, output_filename, "application/vnd.openxmlformats-officedocument.wordprocessingml.document", lambda: cleanup_files(temp_file, output_file))
+        return create_file_response(output_file, output_filename, media_type, lambda: cleanup_files(temp_file, output_file))
     
+    except HTTPException:
+        cleanup_files(temp_file, output_file)
+        raise
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -520,30 +4989,19 @@ async def word_to_pdf(file: UploadFile = File(...)):
     
     try:
         temp_file = await save_upload_file(file)
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        
-        # Read Word document
-        doc = Document(str(temp_file))
-        
-        # Create PDF
-        c = canvas.Canvas(str(output_file), pagesize=letter)
-        width, height = letter
-        y_position = height - 50
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                c.drawString(50, y_position, paragraph.text[:100])
-                y_position -= 20
-                if y_position < 50:
-                    c.showPage()
-                    y_position = height - 50
+        output_file = scratch_file(".pdf")
         
-        c.save()
+        stats = await worker_pool.run("word-to-pdf", docx_to_pdf_file, temp_file, output_file)
+        note_operation(**stats)
+        logging.info(f"Rendered {file.filename}: {stats['pages']} pages in {stats['seconds']:.2f}s ({stats['pages_per_second']} pages/s)")
         
         output_filename = get_output_filename(file.filename, 'pdf')
         
         return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, output_file))
     
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -553,74 +5011,149 @@ async def excel_to_pdf(file: UploadFile = File(...)):
     """Convert Excel to PDF"""
     temp_file = None
     output_file = None
+    parts_dir = None
     
     try:
         temp_file = await save_upload_file(file)
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        
-        # Read Excel
-        wb = openpyxl.load_workbook(str(temp_file))
-        sheet = wb.active
-        
-        # Create PDF
-        c = canvas.Canvas(str(output_file), pagesize=letter)
-        width, height = letter
-        y_position = height - 50
-        
-        for row in sheet.iter_rows(values_only=True):
-            row_text = ' | '.join([str(cell) if cell else '' for cell in row])
-            if row_text.strip():
-                c.drawString(50, y_position, row_text[:100])
-                y_position -= 20
-                if y_position < 50:
-                    c.showPage()
-                    y_position = height - 50
+        output_file = scratch_file(".pdf")
+        parts_dir = scratch_dir("_parts")
         
-        c.save()
+        stats = await worker_pool.run("excel-to-pdf", excel_to_pdf_file, temp_file, output_file, parts_dir)
+        note_operation(**stats)
+        logging.info(f"Rendered {file.filename}: {stats['sheets']} sheets, {stats['rows']} rows, {stats['pages']} pages in {stats['seconds']:.2f}s")
         
         output_filename = get_output_filename(file.filename, 'pdf')
         
         return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, output_file))
     
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if parts_dir:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+# PDF to Excel configuration
+# Pages are read in chunks of PDF_TO_EXCEL_CHUNK_PAGES by parallel worker processes
+# and written in page order to a write-only workbook, one sheet per page or per
+# table, so only the chunks in flight are held in memory.
+PDF_TO_EXCEL_CHUNK_PAGES = int(os.environ.get('PDF_TO_EXCEL_CHUNK_PAGES', 20))
+PDF_TO_EXCEL_MODES = ("tables", "text")
+PDF_TO_EXCEL_LAYOUTS = ("page", "table")
+PDF_TO_EXCEL_MAX_COLUMN_WIDTH = 60
+
+class TableWorkbookWriter:
+    """Streams extracted pages into a write-only workbook"""
+
+    def __init__(self, mode: str, layout: str):
+        import openpyxl
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.mode = mode
+        self.layout = layout
+        self.text_sheet = None
+        self.sheets = 0
+        self.tables = 0
+
+    def add_sheet(self, title: str, rows: list):
+        """Write a whole sheet, sizing its columns to their longest value, and close it"""
+        from openpyxl.utils import get_column_letter
+        sheet = self.workbook.create_sheet(title)
+        widths = {}
+        for row in rows:
+            for index, value in enumerate(row):
+                if value is not None:
+                    widths[index] = max(widths.get(index, 0), len(str(value)))
+        for index, width in widths.items():
+            sheet.column_dimensions[get_column_letter(index + 1)].width = min(PDF_TO_EXCEL_MAX_COLUMN_WIDTH, width + 2)
+        for row in rows:
+            sheet.append(row)
+        # Closing writes the sheet out, so its temporary file isn't kept open
+        sheet.close()
+        self.sheets += 1
+
+    def write_pages(self, pages: List[dict]):
+        for page in pages:
+            number = page['page'] + 1
+            if self.mode == "text":
+                if self.text_sheet is None:
+                    self.text_sheet = self.workbook.create_sheet("PDF Content")
+                    self.sheets += 1
+                self.text_sheet.append([f"Page {number}"])
+                for block in page['blocks']:
+                    for row in block['rows']:
+                        self.text_sheet.append(row)
+                self.text_sheet.append([])
+                continue
+
+            tables = [block['rows'] for block in page['blocks'] if block['kind'] == 'table']
+            self.tables += len(tables)
+            if self.layout == "table":
+                for index, table in enumerate(tables, 1):
+                    self.add_sheet(f"Page {number} Table {index}", table)
+                continue
+            rows = []
+            for block in page['blocks']:
+                if rows:
+                    rows.append([])
+                rows.extend(block['rows'])
+            self.add_sheet(f"Page {number}", rows)
+
+    def save(self, output_path: Path):
+        if not self.sheets:
+            raise InvalidInputError("No tables were found in the selected pages")
+        self.workbook.save(str(output_path))
+
+async def convert_pdf_to_xlsx(input_path: Path, output_path: Path, page_indexes: List[int],
+                              mode: str = "tables", layout: str = "page") -> dict:
+    """Extract the given pages in parallel chunks and write them to a workbook in page order"""
+    chunks = [page_indexes[i:i + PDF_TO_EXCEL_CHUNK_PAGES] for i in range(0, len(page_indexes), PDF_TO_EXCEL_CHUNK_PAGES)]
+    writer = await asyncio.to_thread(TableWorkbookWriter, mode, layout)
+    
+    async def extract_chunk(chunk):
+        return await worker_pool.run("pdf-to-excel", extract_pdf_tables, input_path, chunk, mode)
+    
+    async for pages in map_in_order(extract_chunk, chunks, worker_pool.process_workers * 2):
+        await asyncio.to_thread(writer.write_pages, pages)
+    await asyncio.to_thread(writer.save, output_path)
+    return {"sheets": writer.sheets, "tables": writer.tables}
 
 @api_router.post("/pdf-to-excel")
-async def pdf_to_excel(file: UploadFile = File(...)):
-    """Convert PDF to Excel - extracts text to Excel"""
+async def pdf_to_excel(file: UploadFile = File(...), mode: str = Form("tables"), layout: str = Form("page"),
+                       pages: Optional[str] = Form(None)):
+    """
+    Convert PDF to Excel. mode 'tables' detects tables from word positions, 'text'
+    writes each line of text; layout 'page' makes a sheet per page, 'table' per table.
+    """
     temp_file = None
     output_file = None
     
     try:
-        temp_file = await save_upload_file(file)
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.xlsx"
-        
-        # Extract text from PDF
-        pdf_reader = PdfReader(str(temp_file))
-        
-        # Create Excel workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "PDF Content"
+        if mode not in PDF_TO_EXCEL_MODES:
+            raise HTTPException(status_code=400, detail="Mode must be 'tables' or 'text'")
+        if layout not in PDF_TO_EXCEL_LAYOUTS:
+            raise HTTPException(status_code=400, detail="Layout must be 'page' or 'table'")
         
-        row_num = 1
-        for page_num, page in enumerate(pdf_reader.pages):
-            text = page.extract_text()
-            ws.cell(row=row_num, column=1, value=f"Page {page_num + 1}")
-            row_num += 1
-            for line in text.split('\n'):
-                if line.strip():
-                    ws.cell(row=row_num, column=1, value=line)
-                    row_num += 1
-            row_num += 1
+        temp_file = await save_upload_file(file)
+        output_file = scratch_file(".xlsx")
         
-        wb.save(str(output_file))
+        page_indexes = await select_pdf_pages(temp_file, pages)
+        note_operation(pages=len(page_indexes))
+        stats = await convert_pdf_to_xlsx(temp_file, output_file, page_indexes, mode, layout)
+        note_operation(**stats)
         
         output_filename = get_output_filename(file.filename, 'xlsx')
         
         return create_file_response(output_file, output_filename, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", lambda: cleanup_files(temp_file, output_file))
     
+    except HTTPException:
+        cleanup_files(temp_file, output_file)
+        raise
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -631,19 +5164,23 @@ async def cpp_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"))
     temp_file = None
     output_file = None
     try:
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("cpp-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "cpp")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -653,19 +5190,23 @@ async def c_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw")):
     temp_file = None
     output_file = None
     try:
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("c-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "c")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -676,19 +5217,23 @@ async def js_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw")):
     temp_file = None
     output_file = None
     try:
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("js-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "javascript")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -699,19 +5244,23 @@ async def php_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"))
     temp_file = None
     output_file = None
     try:
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("php-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "php")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -722,49 +5271,224 @@ async def ts_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw")):
     temp_file = None
     output_file = None
     try:
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("ts-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "typescript")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
 
+# OCR configuration
+# Pages with a usable text layer skip OCR; the rest are rasterized and recognized
+# across the process pool, and their text is cached by page content hash.
+OCR_LANGUAGE = os.environ.get('OCR_LANGUAGE', 'eng')
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_MAX_DPI = int(os.environ.get('OCR_MAX_DPI', 600))
+OCR_MIN_TEXT_CHARS = int(os.environ.get('OCR_MIN_TEXT_CHARS', 20))
+OCR_MODES = ("auto", "ocr", "text")
+OCR_LANGUAGE_PATTERN = re.compile(r'[A-Za-z0-9_]+(\+[A-Za-z0-9_]+)*')
+OCR_TEXT_FONT = "Helvetica"
+OCR_TEXT_FONT_RESOURCE = "/PDFMasterOCRText"
+
+def validate_ocr_options(language: str, dpi: int):
+    """Raise a 400 for a malformed tesseract language list or an out-of-range DPI"""
+    if not OCR_LANGUAGE_PATTERN.fullmatch(language):
+        raise HTTPException(status_code=400, detail="Language must look like 'eng' or 'eng+deu'")
+    if not 72 <= dpi <= OCR_MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"DPI must be between 72 and {OCR_MAX_DPI}")
+
+async def map_in_order(func, items, max_in_flight: int):
+    """Yield await func(item) for each item in order, running at most max_in_flight at once"""
+    pending = deque()
+    remaining = iter(items)
+    
+    def submit_next():
+        item = next(remaining, None)
+        if item is not None:
+            pending.append(asyncio.ensure_future(func(item)))
+    
+    try:
+        for _ in range(max_in_flight):
+            submit_next()
+        while pending:
+            result = await pending.popleft()
+            submit_next()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def run_cached_ocr(cache_key: str, func, *args) -> tuple:
+    """Return (bytes, cached) for an OCR result, running func on the OCR pool on a cache miss"""
+    cached_file = result_cache.get(cache_key)
+    if cached_file is not None:
+        return await asyncio.to_thread(cached_file.read_bytes), True
+    data = await worker_pool.run("ocr", func, *args)
+    if result_cache.enabled:
+        await asyncio.to_thread(result_cache.put_bytes, cache_key, data)
+    return data, False
+
+async def recognize_pdf_pages(input_path: Path, pages: List[dict], language: str, dpi: int):
+    """
+    Yield {"page", "method", "cached", "text"} for every page, in page order.
+    
+    Text-layer pages are returned as they are. The other pages are looked up in the
+    result cache by content hash and otherwise OCR'd on the worker pool, with a bounded
+    number of pages in flight ahead of the consumer.
+    """
+    async def recognize(page):
+        if not page["needs_ocr"]:
+            return {"page": page["page"], "method": "text", "cached": False, "text": page["text"]}
+        cache_key = result_cache.key("ocr-page", page["content_hash"], language=language, dpi=dpi)
+        data, cached = await run_cached_ocr(
+            cache_key, ocr_pdf_page, input_path, page["page"] - 1, dpi, language
+        )
+        return {"page": page["page"], "method": "ocr", "cached": cached, "text": data.decode('utf-8')}
+    
+    async for result in map_in_order(recognize, pages, worker_pool.process_workers * 2):
+        yield result
+
 @api_router.post("/ocr")
-async def ocr_pdf(file: UploadFile = File(...)):
-    """Extract text from PDF using OCR"""
+async def ocr_pdf(
+    file: UploadFile = File(...),
+    mode: str = Form("auto"),
+    language: str = Form(OCR_LANGUAGE),
+    dpi: int = Form(OCR_DPI),
+    stream: bool = Form(False)
+):
+    """
+    Extract text from PDF, using OCR for pages that have no text layer.
+    
+    mode: 'auto' (OCR only image pages without text), 'ocr' (every page) or 'text'
+    (text layer only). With stream=true, results are sent as NDJSON, one line per
+    page as soon as it (and every page before it) is done.
+    """
     temp_file = None
     
     try:
-        temp_file = await save_upload_file(file)
-        
-        # First try regular text extraction
-        pdf_reader = PdfReader(str(temp_file))
-        text_content = ""
-        
-        for page in pdf_reader.pages:
-            text_content += page.extract_text() + "\n\n"
+        if mode not in OCR_MODES:
+            raise HTTPException(status_code=400, detail="Mode must be 'auto', 'ocr' or 'text'")
+        validate_ocr_options(language, dpi)
+        
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        
+        pages = await worker_pool.run("ocr-scan", scan_pdf_text_layers, temp_file, mode)
+        note_operation(pages=len(pages), ocr_pages=sum(1 for page in pages if page["needs_ocr"]))
+        results = recognize_pdf_pages(temp_file, pages, language, dpi)
+        
+        if stream:
+            async def page_lines():
+                try:
+                    async for result in results:
+                        yield json.dumps(result) + "\n"
+                    yield json.dumps({"done": True, "pages": len(pages)}) + "\n"
+                except Exception as e:
+                    # Headers are already sent, so report the failure in-band
+                    yield json.dumps({"done": False, "error": str(e)}) + "\n"
+                finally:
+                    await results.aclose()
+                    cleanup_files(temp_file)
+            
+            return StreamingResponse(page_lines(), media_type="application/x-ndjson")
         
-        cleanup_files(temp_file)
+        try:
+            page_results = [result async for result in results]
+        finally:
+            cleanup_files(temp_file)
         
         return JSONResponse({
-            "text": text_content,
-            "pages": len(pdf_reader.pages)
+            "text": "".join(result["text"] + "\n\n" for result in page_results),
+            "pages": len(pages),
+            "ocr_pages": sum(1 for result in page_results if result["method"] == "ocr"),
+            "page_results": page_results,
         })
     
+    except HTTPException:
+        cleanup_files(temp_file)
+        raise
+    except InvalidInputError as e:
+        cleanup_files(temp_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file)
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/searchable-pdf")
+async def searchable_pdf(
+    file: UploadFile = File(...),
+    mode: str = Form("auto"),
+    language: str = Form(OCR_LANGUAGE),
+    dpi: int = Form(OCR_DPI)
+):
+    """
+    Make a scanned PDF searchable by adding an invisible OCR text layer to its pages.
+    
+    mode: 'auto' (only image pages without a text layer) or 'ocr' (every page). The
+    page images and content are left as they are; each page only gains a text stream.
+    """
+    temp_file = None
+    output_file = None
+    
+    try:
+        if mode not in ("auto", "ocr"):
+            raise HTTPException(status_code=400, detail="Mode must be 'auto' or 'ocr'")
+        validate_ocr_options(language, dpi)
+        
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        output_filename = get_output_filename(file.filename, 'pdf', '_searchable')
+        cache_key = result_cache.key("searchable-pdf", upload.sha256, mode=mode, language=language, dpi=dpi)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        
+        pages = await worker_pool.run("ocr-scan", scan_pdf_text_layers, temp_file, mode)
+        note_operation(pages=len(pages), ocr_pages=sum(1 for page in pages if page["needs_ocr"]))
+        
+        async def text_layer(page):
+            cache_key = result_cache.key("ocr-text-layer", page["content_hash"], language=language, dpi=dpi)
+            data, _ = await run_cached_ocr(
+                cache_key, ocr_pdf_page_text_layer, temp_file, page["page"] - 1, dpi, language
+            )
+            return page["page"] - 1, data
+        
+        # Only the small text streams are kept; page images live in the workers one at a time
+        ocr_pages = [page for page in pages if page["needs_ocr"]]
+        text_layers = dict([
+            layer async for layer in map_in_order(text_layer, ocr_pages, worker_pool.process_workers * 2)
+        ])
+        
+        output_file = scratch_file("_searchable.pdf")
+        await worker_pool.run("searchable-pdf", add_text_layers_file, temp_file, output_file, text_layers)
+        await store_cached_result(cache_key, output_file)
+        
+        return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, output_file))
+    
+    except HTTPException:
+        cleanup_files(temp_file, output_file)
+        raise
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/watermark")
 async def watermark_pdf(
     file: UploadFile = File(...), 
@@ -778,96 +5502,32 @@ async def watermark_pdf(
     """Add text or image watermark to PDF"""
     temp_file = None
     output_file = None
-    watermark_file = None
     watermark_image_file = None
     
     try:
         temp_file = await save_upload_file(file)
         
-        # Create watermark PDF
-        watermark_file = UPLOAD_DIR / f"{uuid.uuid4()}_watermark.pdf"
-        c = canvas.Canvas(str(watermark_file), pagesize=letter)
-        width, height = letter
-        
-        c.saveState()
-        
-        # Calculate position
-        if position == "center":
-            x_pos, y_pos = width/2, height/2
-        elif position == "top-left":
-            x_pos, y_pos = width*0.25, height*0.75
-        elif position == "top-right":
-            x_pos, y_pos = width*0.75, height*0.75
-        elif position == "bottom-left":
-            x_pos, y_pos = width*0.25, height*0.25
-        elif position == "bottom-right":
-            x_pos, y_pos = width*0.75, height*0.25
-        else:
-            x_pos, y_pos = width/2, height/2
-        
-        c.translate(x_pos, y_pos)
-        c.rotate(rotation)
-        
         # Check if image watermark is provided
         if watermark_image and watermark_image.filename:
-            # Save watermark image
             watermark_image_file = await save_upload_file(watermark_image)
-            
-            # Open and resize image
-            img = Image.open(str(watermark_image_file))
-            
-            # Calculate image dimensions based on size parameter
-            aspect_ratio = img.width / img.height
-            if aspect_ratio > 1:
-                img_width = size * 2
-                img_height = img_width / aspect_ratio
-            else:
-                img_height = size * 2
-                img_width = img_height * aspect_ratio
-            
-            # Set opacity
-            c.setFillAlpha(opacity)
-            
-            # Draw image (centered on the position)
-            c.drawImage(
-                ImageReader(img),
-                -img_width/2, -img_height/2,
-                width=img_width, height=img_height,
-                mask='auto',
-                preserveAspectRatio=True
-            )
-        elif text:
-            # Text watermark
-            c.setFont("Helvetica", size)
-            c.setFillColorRGB(0.5, 0.5, 0.5, alpha=opacity)
-            c.drawCentredString(0, 0, text)
-        else:
+        elif not text:
             raise HTTPException(status_code=400, detail="Either text or watermark_image must be provided")
         
-        c.restoreState()
-        c.save()
-        
-        # Apply watermark
-        pdf_reader = PdfReader(str(temp_file))
-        watermark_reader = PdfReader(str(watermark_file))
-        pdf_writer = PdfWriter()
-        
-        watermark_page = watermark_reader.pages[0]
-        
-        for page in pdf_reader.pages:
-            page.merge_page(watermark_page)
-            pdf_writer.add_page(page)
-        
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_watermarked.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        # Render the watermark and apply it to every page
+        output_file = scratch_file("_watermarked.pdf")
+        await worker_pool.run(
+            "watermark", watermark_pdf_file,
+            temp_file, output_file,
+            text=text, image_path=watermark_image_file,
+            position=position, opacity=opacity, rotation=rotation, size=size
+        )
         
         output_filename = get_output_filename(file.filename, 'pdf', '_watermarked')
         
-        return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, watermark_file, watermark_image_file, output_file))
+        return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, watermark_image_file, output_file))
     
     except Exception as e:
-        cleanup_files(temp_file, watermark_file, watermark_image_file, output_file)
+        cleanup_files(temp_file, watermark_image_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/protect")
@@ -879,17 +5539,8 @@ async def protect_pdf(file: UploadFile = File(...), password: str = Form(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
-        
-        pdf_writer.encrypt(password)
-        
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_protected.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_protected.pdf")
+        await worker_pool.run("protect", protect_pdf_file, temp_file, output_file, password)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_protected')
         
@@ -908,18 +5559,8 @@ async def unlock_pdf(file: UploadFile = File(...), password: str = Form(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        pdf_reader = PdfReader(str(temp_file))
-        
-        if pdf_reader.is_encrypted:
-            pdf_reader.decrypt(password)
-        
-        pdf_writer = PdfWriter()
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
-        
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_unlocked.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_unlocked.pdf")
+        await worker_pool.run("unlock", unlock_pdf_file, temp_file, output_file, password)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_unlocked')
         
@@ -939,31 +5580,10 @@ async def sign_pdf(file: UploadFile = File(...), signature_text: str = Form(...)
     try:
         temp_file = await save_upload_file(file)
         
-        # Create signature overlay
-        signature_file = UPLOAD_DIR / f"{uuid.uuid4()}_signature.pdf"
-        c = canvas.Canvas(str(signature_file), pagesize=letter)
-        width, height = letter
-        
-        c.setFont("Helvetica-Oblique", 24)
-        c.drawString(50, 50, signature_text)
-        c.save()
-        
-        # Apply signature
-        pdf_reader = PdfReader(str(temp_file))
-        signature_reader = PdfReader(str(signature_file))
-        pdf_writer = PdfWriter()
-        
-        signature_page = signature_reader.pages[0]
-        
-        # Add signature to last page
-        for i, page in enumerate(pdf_reader.pages):
-            if i == len(pdf_reader.pages) - 1:
-                page.merge_page(signature_page)
-            pdf_writer.add_page(page)
-        
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_signed.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        # Create signature overlay and apply it to the last page
+        signature_file = scratch_file("_signature.pdf")
+        output_file = scratch_file("_signed.pdf")
+        await worker_pool.run("sign", sign_pdf_file, temp_file, output_file, signature_file, signature_text)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_signed')
         
@@ -985,220 +5605,12 @@ async def ipynb_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"
             raise HTTPException(status_code=400, detail="File must be a .ipynb file")
         
         temp_file = await save_upload_file(file)
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_notebook.pdf"
-        
-        # Read and validate the notebook
-        try:
-            with open(temp_file, 'r', encoding='utf-8') as f:
-                notebook = nbformat.read(f, as_version=4)
-        except nbformat.reader.NotJSONError as e:
-            raise HTTPException(status_code=400, detail=f"Invalid Jupyter Notebook file. The file is not a valid JSON format. Please upload a valid .ipynb file.")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Could not read notebook file: {str(e)}")
-        
-        # Use ReportLab to create PDF directly from notebook content
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Preformatted, PageBreak, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.lib.units import inch
-        from reportlab.lib.enums import TA_LEFT
-        from reportlab.lib import colors
-        
-        doc = SimpleDocTemplate(str(output_file), pagesize=letter,
-                                leftMargin=0.75*inch, rightMargin=0.75*inch,
-                                topMargin=0.5*inch, bottomMargin=0.5*inch)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Custom styles for input cells
-        input_style = ParagraphStyle(
-            'Input',
-            parent=styles['Normal'],
-            fontSize=8,
-            leading=10,
-            textColor=colors.HexColor('#0066cc')  if color_mode == "colorful" else colors.black,
-            fontName='Courier',
-        )
-        
-        # Custom style for code content
-        code_style = ParagraphStyle(
-            'Code',
-            parent=styles['Code'],
-            fontSize=10,
-            leading=14,
-            fontName='Courier',
-            leftIndent=10,
-            rightIndent=10,
-            spaceBefore=2,
-            spaceAfter=2,
-            wordWrap='CJK',
-        )
+        output_file = scratch_file("_notebook.pdf")
         
-        # Custom style for output
-        output_style = ParagraphStyle(
-            'Output',
-            parent=styles['Code'],
-            fontSize=10,
-            leading=14,
-            fontName='Courier',
-            leftIndent=10,
-            rightIndent=10,
-            spaceBefore=2,
-            spaceAfter=2,
-            wordWrap='CJK',
-        )
-        
-        # Process each cell
-        cell_num = 0
-        for cell in notebook.cells:
-            cell_num += 1
-            
-            if cell.cell_type == 'markdown':
-                # Markdown cell styling
-                markdown_data = [[Paragraph(cell.source.replace('\n', '<br/>'), styles['Normal'])]]
-                markdown_table = Table(markdown_data, colWidths=[6.5*inch])
-                markdown_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                    ('TOPPADDING', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                    ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-                ]))
-                story.append(markdown_table)
-                story.append(Spacer(1, 0.1*inch))
-                
-            elif cell.cell_type == 'code':
-                # Input cell with label
-                input_label = f"In [{cell_num}]:"
-                code_text = cell.source
-                
-                # Truncate long lines instead of wrapping
-                max_line_length = 75
-                code_lines = code_text.split('\n')
-                truncated_lines = []
-                for line in code_lines:
-                    if len(line) > max_line_length:
-                        # Truncate and add ellipsis
-                        truncated_lines.append(line[:max_line_length] + '...')
-                    else:
-                        truncated_lines.append(line)
-                code_text = '\n'.join(truncated_lines)
-                
-                # Use smaller font for code to fit better
-                small_code_style = ParagraphStyle(
-                    'SmallCode',
-                    parent=styles['Code'],
-                    fontSize=8,
-                    leading=11,
-                    fontName='Courier',
-                    leftIndent=5,
-                    rightIndent=5,
-                    spaceBefore=2,
-                    spaceAfter=2,
-                    wordWrap='CJK',
-                    textColor=colors.HexColor('#1565c0') if color_mode == "colorful" else colors.black,
-                )
-                
-                input_data = [[Paragraph(input_label, input_style), Preformatted(code_text, small_code_style)]]
-                input_table = Table(input_data, colWidths=[0.7*inch, 5.8*inch])
-                input_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f7f7f7')),
-                    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                    ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-                    ('ALIGN', (1, 0), (-1, -1), 'LEFT'),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 5),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                    ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-                ]))
-                story.append(input_table)
-                
-                # Add outputs if any
-                if 'outputs' in cell and cell.outputs:
-                    for output in cell.outputs:
-                        output_text = ""
-                        output_bg_color = colors.white
-                        output_text_color = colors.black
-                        
-                        if output.output_type == 'stream':
-                            output_text = output.text
-                        elif output.output_type == 'execute_result' or output.output_type == 'display_data':
-                            if 'text/plain' in output.data:
-                                output_text = output.data['text/plain']
-                        elif output.output_type == 'error':
-                            # Handle error output with red background
-                            output_bg_color = colors.HexColor('#fff0f0')
-                            output_text_color = colors.HexColor('#d32f2f')
-                            # Combine error name, value, and traceback
-                            error_parts = []
-                            if hasattr(output, 'ename'):
-                                error_parts.append(output.ename)
-                            if hasattr(output, 'evalue'):
-                                error_parts.append(output.evalue)
-                            if hasattr(output, 'traceback'):
-                                # Remove ANSI color codes from traceback
-                                import re
-                                clean_traceback = []
-                                for line in output.traceback:
-                                    # Remove ANSI escape sequences
-                                    clean_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
-                                    clean_traceback.append(clean_line)
-                                error_parts.extend(clean_traceback)
-                            output_text = '\n'.join(error_parts)
-                        
-                        if output_text:
-                            # Truncate long lines in output - don't wrap
-                            max_line_length = 75
-                            output_lines = output_text.split('\n')
-                            truncated_output = []
-                            for line in output_lines:
-                                if len(line) > max_line_length:
-                                    # Truncate and add ellipsis
-                                    truncated_output.append(line[:max_line_length] + '...')
-                                else:
-                                    truncated_output.append(line)
-                            output_text = '\n'.join(truncated_output)
-                            
-                            # Create custom style for this output - smaller font
-                            custom_output_style = ParagraphStyle(
-                                'CustomOutput',
-                                parent=styles['Code'],
-                                fontSize=8,
-                                leading=11,
-                                fontName='Courier',
-                                leftIndent=5,
-                                rightIndent=5,
-                                spaceBefore=2,
-                                spaceAfter=2,
-                                textColor=output_text_color,
-                                wordWrap='CJK',
-                            )
-                            
-                            output_data = [[Paragraph("", custom_output_style), Preformatted(output_text, custom_output_style)]]
-                            output_table = Table(output_data, colWidths=[0.7*inch, 5.8*inch])
-                            output_table.setStyle(TableStyle([
-                                ('BACKGROUND', (0, 0), (-1, -1), output_bg_color),
-                                ('TEXTCOLOR', (0, 0), (-1, -1), output_text_color),
-                                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                                ('LEFTPADDING', (0, 0), (-1, -1), 5),
-                                ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-                                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                                ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-                            ]))
-                            story.append(output_table)
-                
-                story.append(Spacer(1, 0.15*inch))
-        
-        # Build PDF
-        doc.build(story)
+        # The worker reads and validates the notebook
+        stats = await worker_pool.run("ipynb-to-pdf", build_notebook_pdf, temp_file, output_file, color_mode)
+        note_operation(**stats)
+        logging.info(f"Rendered {file.filename}: {stats['cells']} cells, {stats['images']} images, {stats['pages']} pages in {stats['seconds']:.2f}s")
         
         output_filename = get_output_filename(file.filename, 'pdf')
         
@@ -1207,6 +5619,9 @@ async def ipynb_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"
     except HTTPException:
         cleanup_files(temp_file, output_file)
         raise
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         logging.error(f"Error converting notebook to PDF: {str(e)}")
@@ -1220,19 +5635,23 @@ async def java_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw")
     try:
         if not file.filename.lower().endswith('.java'):
             raise HTTPException(status_code=400, detail="File must be a .java file")
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("java-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "java")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1244,109 +5663,22 @@ async def add_page_numbers(
     position: str = Form(...)
 ):
     """Add page numbers to PDF pages"""
-    temp_file = None
-    output_file = None
-    
-    try:
-        temp_file = await save_upload_file(file)
-        
-        # Read the original PDF
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        total_pages = len(pdf_reader.pages)
-        
-        # Helper function to convert number to roman numerals
-        def to_roman(num):
-            val = [
-                1000, 900, 500, 400,
-                100, 90, 50, 40,
-                10, 9, 5, 4,
-                1
-            ]
-            syms = [
-                "M", "CM", "D", "CD",
-                "C", "XC", "L", "XL",
-                "X", "IX", "V", "IV",
-                "I"
-            ]
-            roman_num = ''
-            i = 0
-            while num > 0:
-                for _ in range(num // val[i]):
-                    roman_num += syms[i]
-                    num -= val[i]
-                i += 1
-            return roman_num
-        
-        # Process each page
-        for page_num in range(total_pages):
-            # Get the page from original PDF
-            page = pdf_reader.pages[page_num]
-            page_width = float(page.mediabox.width)
-            page_height = float(page.mediabox.height)
-            
-            # Create a new PDF with the page number
-            packet = io.BytesIO()
-            can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-            
-            # Determine page number text based on format
-            page_number = page_num + 1
-            if format == "numeric":
-                page_text = str(page_number)
-            elif format == "numeric-page":
-                page_text = f"Page {page_number}"
-            elif format == "roman-lower":
-                page_text = to_roman(page_number).lower()
-            elif format == "roman-lower-page":
-                page_text = f"Page {to_roman(page_number).lower()}"
-            elif format == "roman-upper":
-                page_text = to_roman(page_number)
-            elif format == "roman-upper-page":
-                page_text = f"Page {to_roman(page_number)}"
-            else:
-                page_text = str(page_number)
-            
-            # Set font and determine position
-            can.setFont("Helvetica", 10)
-            text_width = can.stringWidth(page_text, "Helvetica", 10)
-            
-            # Position the page number (bottom)
-            y_position = 20  # 20 points from bottom
-            
-            if position == "bottom-left":
-                x_position = 40  # 40 points from left
-            elif position == "bottom-center":
-                x_position = (page_width - text_width) / 2
-            elif position == "bottom-right":
-                x_position = page_width - text_width - 40  # 40 points from right
-            else:
-                x_position = (page_width - text_width) / 2  # default to center
-            
-            # Draw the page number
-            can.drawString(x_position, y_position, page_text)
-            can.save()
-            
-            # Move to the beginning of the BytesIO buffer
-            packet.seek(0)
-            
-            # Read the page number overlay
-            overlay_pdf = PdfReader(packet)
-            overlay_page = overlay_pdf.pages[0]
-            
-            # Merge the overlay with the original page
-            page.merge_page(overlay_page)
-            pdf_writer.add_page(page)
+    temp_file = None
+    output_file = None
+    
+    try:
+        check_page_number_options(format, position)
+        temp_file = await save_upload_file(file)
         
-        # Save the output PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_numbered.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_numbered.pdf")
+        await worker_pool.run("add-page-numbers", add_page_numbers_file, temp_file, output_file, format, position)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_numbered')
         
         return create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(temp_file, output_file))
     
+    except HTTPException:
+        raise
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1359,19 +5691,23 @@ async def python_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw
     try:
         if not file.filename.lower().endswith('.py'):
             raise HTTPException(status_code=400, detail="File must be a .py file")
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("python-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "python")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1384,26 +5720,23 @@ async def xml_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"))
     try:
         if not file.filename.lower().endswith('.xml'):
             raise HTTPException(status_code=400, detail="File must be an .xml file")
-        temp_file = await save_upload_file(file)
-        try:
-            tree = ET.parse(str(temp_file))
-            root = tree.getroot()
-            xml_string = ET.tostring(root, encoding='unicode')
-            dom = minidom.parseString(xml_string)
-            code = dom.toprettyxml(indent="  ")
-        except ET.ParseError as e:
-            cleanup_files(temp_file)
-            raise HTTPException(status_code=400, detail=f"Invalid XML file: {str(e)}")
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("xml-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "xml", True)
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1416,19 +5749,23 @@ async def html_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw")
     try:
         if not file.filename.lower().endswith(('.html', '.htm')):
             raise HTTPException(status_code=400, detail="File must be an .html or .htm file")
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("html-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "html")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1441,19 +5778,23 @@ async def css_to_pdf(file: UploadFile = File(...), color_mode: str = Form("bw"))
     try:
         if not file.filename.lower().endswith('.css'):
             raise HTTPException(status_code=400, detail="File must be a .css file")
-        temp_file = await save_upload_file(file)
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            code = f.read()
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}.pdf"
-        build_code_pdf(code, output_file, color_mode)
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
         output_filename = get_output_filename(file.filename, 'pdf')
+        cache_key = result_cache.key("css-to-pdf", upload.sha256, color_mode=color_mode)
+        cached_response = cached_result_response(cache_key, output_filename, "application/pdf", temp_file)
+        if cached_response:
+            return cached_response
+        output_file = scratch_file(".pdf")
+        await worker_pool.run("code-to-pdf", code_file_to_pdf, temp_file, output_file, color_mode, "css")
+        await store_cached_result(cache_key, output_file)
         return create_file_response(output_file, output_filename, "application/pdf",
                                     lambda: cleanup_files(temp_file, output_file))
     except HTTPException:
         raise
-    except UnicodeDecodeError:
+    except InvalidInputError as e:
         cleanup_files(temp_file, output_file)
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded.")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1467,30 +5808,12 @@ async def preview_pdf_pages(file: UploadFile = File(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        # Open PDF with PyMuPDF
-        import fitz
-        pdf_document = fitz.open(str(temp_file))
-        
         # Generate previews for all pages
-        previews = []
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            # Render page to image with 150 DPI for better quality
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-            
-            # Convert to base64 for JSON response
-            import base64
-            img_bytes = pix.tobytes("png")
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-            
-            previews.append({
-                "pageNumber": page_num + 1,
-                "imageData": f"data:image/png;base64,{img_base64}",
-                "width": pix.width,
-                "height": pix.height
-            })
+        previews = await worker_pool.run("preview-pages", render_page_previews, temp_file)
+        note_operation(pages=len(previews))
+        for preview in previews:
+            preview["pageNumber"] = preview.pop("page_number")
         
-        pdf_document.close()
         cleanup_files(temp_file)
         
         return JSONResponse(content={
@@ -1510,37 +5833,14 @@ async def get_pdf_pages_info(file: UploadFile = File(...)):
     try:
         temp_file = await save_upload_file(file)
         
-        # Open PDF with PyMuPDF to generate previews
-        import fitz
-        import base64
-        
-        pdf_document = fitz.open(str(temp_file))
-        total_pages = len(pdf_document)
-        
         # Generate previews for all pages
-        pages = []
-        for page_num in range(total_pages):
-            page = pdf_document[page_num]
-            # Render page to image with 1.5x scaling for better quality
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-            
-            # Convert to base64 for JSON response
-            img_bytes = pix.tobytes("png")
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-            
-            pages.append({
-                "page_number": page_num + 1,
-                "imageData": f"data:image/png;base64,{img_base64}",
-                "width": pix.width,
-                "height": pix.height
-            })
-        
-        pdf_document.close()
+        pages = await worker_pool.run("preview-pages", render_page_previews, temp_file)
+        note_operation(pages=len(pages))
         cleanup_files(temp_file)
         
         # Return page information
         pages_info = {
-            "total_pages": total_pages,
+            "total_pages": len(pages),
             "pages": pages
         }
         
@@ -1563,38 +5863,9 @@ async def reorder_pdf_pages(file: UploadFile = File(...), page_order: str = Form
         # The page_order should contain all page numbers in the new order
         page_order_list = [int(p.strip()) - 1 for p in page_order.split(',') if p.strip()]
         
-        # Read PDF
-        pdf_reader = PdfReader(str(temp_file))
-        total_pages = len(pdf_reader.pages)
-        
-        # Validate page order
-        if len(page_order_list) != total_pages:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Page order must contain all {total_pages} pages. Received {len(page_order_list)} pages."
-            )
-        
-        # Check for duplicate pages
-        if len(set(page_order_list)) != len(page_order_list):
-            raise HTTPException(status_code=400, detail="Page order contains duplicate page numbers")
-        
-        # Check for invalid page numbers
-        for page_num in page_order_list:
-            if page_num < 0 or page_num >= total_pages:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Invalid page number {page_num + 1}. Must be between 1 and {total_pages}"
-                )
-        
         # Create new PDF with reordered pages
-        pdf_writer = PdfWriter()
-        for page_num in page_order_list:
-            pdf_writer.add_page(pdf_reader.pages[page_num])
-        
-        # Save reordered PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_reordered.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_reordered.pdf")
+        await worker_pool.run("reorder", reorder_pdf_file, temp_file, output_file, page_order_list)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_reordered')
         
@@ -1608,6 +5879,9 @@ async def reorder_pdf_pages(file: UploadFile = File(...), page_order: str = Form
     except ValueError as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=400, detail="Invalid page order format. Use comma-separated numbers (e.g., 3,1,2,4)")
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         cleanup_files(temp_file, output_file)
         raise
@@ -1627,24 +5901,9 @@ async def delete_pdf_pages(file: UploadFile = File(...), pages_to_delete: str =
         # Parse pages to delete (comma-separated list, e.g., "1,3,5")
         pages_to_delete_list = [int(p.strip()) - 1 for p in pages_to_delete.split(',') if p.strip()]
         
-        # Read PDF
-        pdf_reader = PdfReader(str(temp_file))
-        pdf_writer = PdfWriter()
-        
-        # Add all pages except the ones to delete
-        total_pages = len(pdf_reader.pages)
-        for page_num in range(total_pages):
-            if page_num not in pages_to_delete_list:
-                pdf_writer.add_page(pdf_reader.pages[page_num])
-        
-        # Check if all pages were deleted
-        if len(pdf_writer.pages) == 0:
-            raise HTTPException(status_code=400, detail="Cannot delete all pages. At least one page must remain.")
-        
         # Save modified PDF
-        output_file = UPLOAD_DIR / f"{uuid.uuid4()}_deleted.pdf"
-        with open(output_file, "wb") as f:
-            pdf_writer.write(f)
+        output_file = scratch_file("_deleted.pdf")
+        await worker_pool.run("delete-pages", delete_pdf_pages_file, temp_file, output_file, pages_to_delete_list)
         
         output_filename = get_output_filename(file.filename, 'pdf', '_modified')
         
@@ -1653,26 +5912,665 @@ async def delete_pdf_pages(file: UploadFile = File(...), pages_to_delete: str =
     except ValueError as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=400, detail="Invalid page numbers format. Use comma-separated numbers (e.g., 1,3,5)")
+    except InvalidInputError as e:
+        cleanup_files(temp_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         cleanup_files(temp_file, output_file)
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/documents")
+async def create_document(file: UploadFile = File(...)):
+    """Upload a PDF once and open a document session for the page tools"""
+    upload = None
+    
+    try:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+        upload = await ingest_upload_file(file)
+        pages = await worker_pool.run("document-open", describe_pdf_file, upload.path, cached=True)
+        session = document_sessions.create(upload, file.filename, pages)
+        return JSONResponse(content=session.info())
+    
+    except HTTPException:
+        cleanup_files(upload and upload.path)
+        raise
+    except Exception as e:
+        cleanup_files(upload and upload.path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/documents/{document_id}")
+async def get_document(document_id: str):
+    """Get the page count and page sizes of a document session"""
+    return JSONResponse(content=document_sessions.get(document_id).info())
+
+@api_router.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Close a document session and delete its file"""
+    document_sessions.get(document_id)
+    document_sessions.delete(document_id)
+    return {"document_id": document_id, "deleted": True}
+
+@api_router.get("/documents/{document_id}/download")
+async def download_document(document_id: str):
+    """Download the current revision of a document session"""
+    session = document_sessions.get(document_id)
+    path = document_sessions.acquire(session)
+    
+    async def release():
+        document_sessions.release(path)
+    
+    return create_file_response(path, get_output_filename(session.filename, 'pdf'), "application/pdf", release)
+
+@api_router.get("/documents/{document_id}/pages/{page_number}/thumbnail")
+async def get_page_thumbnail(
+    request: Request,
+    document_id: str,
+    page_number: int,
+    scale: float = Query(0.5, gt=0, le=4),
+    format: str = Query("webp"),
+    quality: int = Query(80, ge=1, le=100),
+    revision: Optional[int] = Query(None)
+):
+    """
+    Render a single page of a document session on demand.
+    
+    Responses carry an ETag for the document revision and render options. When the
+    request names the current revision the image is cacheable for a day, otherwise
+    the client has to revalidate.
+    """
+    session = document_sessions.get(document_id)
+    if format not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {format}. Use one of: {', '.join(THUMBNAIL_FORMATS)}")
+    if not 1 <= page_number <= len(session.pages):
+        raise HTTPException(status_code=404, detail=f"Page {page_number} does not exist. The document has {len(session.pages)} pages.")
+    
+    cache_key = (session.document_id, session.revision, page_number, round(scale, 3), format, quality)
+    etag = '"' + hashlib.sha1(repr(cache_key).encode('utf-8')).hexdigest() + '"'
+    if revision == session.revision:
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable"}
+    else:
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    image = thumbnail_cache.get(cache_key)
+    if image is None:
+        try:
+            with document_sessions.reading(session) as path:
+                image = await worker_pool.run(
+                    "thumbnail", render_page_thumbnail, path, page_number - 1, scale, format, quality
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        thumbnail_cache.put(cache_key, image)
+    
+    return Response(content=image, media_type=THUMBNAIL_FORMATS[format][1], headers=headers)
+
+async def run_document_operation(document_id: str, operation: str, func, suffix: str, save: bool, *args):
+    """
+    Run a page operation on a document session and return the resulting PDF.
+    
+    With save=True the result also becomes the session's current revision, so the
+    next operation builds on it.
+    """
+    session = document_sessions.get(document_id)
+    output_file = scratch_file(f"{suffix}.pdf")
+    
+    try:
+        with document_sessions.reading(session) as path:
+            await worker_pool.run(operation, func, path, output_file, *args, cached=True)
+        output_filename = get_output_filename(session.filename, 'pdf', suffix)
+        
+        if save:
+            pages = await worker_pool.run("document-open", describe_pdf_file, output_file, cached=True)
+            document_sessions.replace(session, output_file, pages)
+            response = create_file_response(output_file, output_filename, "application/pdf")
+        else:
+            response = create_file_response(output_file, output_filename, "application/pdf", lambda: cleanup_files(output_file))
+        response.headers["X-Document-Revision"] = str(session.revision)
+        return response
+    
+    except InvalidInputError as e:
+        cleanup_files(output_file)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        cleanup_files(output_file)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/documents/{document_id}/rotate")
+async def rotate_document(document_id: str, angle: int = Form(...), save: bool = Form(False)):
+    """Rotate every page of a document session"""
+    return await run_document_operation(document_id, "document-rotate", rotate_pdf_file, "_rotated", save, angle)
+
+@api_router.post("/documents/{document_id}/reorder")
+async def reorder_document(document_id: str, page_order: str = Form(...), save: bool = Form(False)):
+    """Reorder the pages of a document session (e.g. '3,1,2,4')"""
+    try:
+        page_order_list = [int(p.strip()) - 1 for p in page_order.split(',') if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid page order format. Use comma-separated numbers (e.g., 3,1,2,4)")
+    return await run_document_operation(document_id, "document-reorder", reorder_pdf_file, "_reordered", save, page_order_list)
+
+@api_router.post("/documents/{document_id}/delete-pages")
+async def delete_document_pages(document_id: str, pages_to_delete: str = Form(...), save: bool = Form(False)):
+    """Delete pages from a document session (e.g. '1,3,5')"""
+    try:
+        pages_to_delete_list = [int(p.strip()) - 1 for p in pages_to_delete.split(',') if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid page numbers format. Use comma-separated numbers (e.g., 1,3,5)")
+    return await run_document_operation(document_id, "document-delete-pages", delete_pdf_pages_file, "_modified", save, pages_to_delete_list)
+
+# Pipeline configuration
+# A pipeline runs several of merge, compress, add-page-numbers, watermark and protect
+# on one document in a single worker call, keeping it in memory between steps.
+PIPELINE_MAX_STEPS = int(os.environ.get('PIPELINE_MAX_STEPS', 10))
+PIPELINE_OPERATIONS = ("merge", "compress", "add-page-numbers", "watermark", "protect")
+
+def parse_pipeline_steps(steps: str, file_count: int, has_image: bool) -> List[dict]:
+    """
+    Parse the JSON step list of /pipeline and fill in each step's defaults.
+    
+    Raises a 400 for unknown operations, bad parameters or an order the pipeline
+    cannot honor: merge must come first (and is required for several files), protect
+    must come last, and compress may appear once.
+    """
+    try:
+        parsed = json.loads(steps)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Steps must be a JSON list, e.g. [{\"op\": \"compress\"}]")
+    if not isinstance(parsed, list) or not parsed or not all(isinstance(step, dict) for step in parsed):
+        raise HTTPException(status_code=400, detail="Steps must be a non-empty JSON list of objects")
+    if len(parsed) > PIPELINE_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"A pipeline can have at most {PIPELINE_MAX_STEPS} steps")
+    
+    validated = []
+    for index, step in enumerate(parsed):
+        op = step.get("op")
+        if op not in PIPELINE_OPERATIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown pipeline step {op!r}. Use one of: {', '.join(PIPELINE_OPERATIONS)}")
+        if op == "merge" and index > 0:
+            raise HTTPException(status_code=400, detail="merge must be the first step")
+        if op == "protect" and index < len(parsed) - 1:
+            raise HTTPException(status_code=400, detail="protect must be the last step")
+        
+        if op == "compress":
+            if any(previous["op"] == "compress" for previous in validated):
+                raise HTTPException(status_code=400, detail="compress can only appear once")
+            step = {"op": op, "preset": step.get("preset", "ebook"), "grayscale": bool(step.get("grayscale", False))}
+            if step["preset"] not in COMPRESSION_PRESETS:
+                raise HTTPException(status_code=400, detail=f"Unknown preset {step['preset']}. Use one of: {', '.join(COMPRESSION_PRESETS)}")
+        elif op == "protect":
+            if not step.get("password"):
+                raise HTTPException(status_code=400, detail="protect needs a password")
+            step = {"op": op, "password": str(step["password"])}
+        elif op == "add-page-numbers":
+            step = {"op": op, "format": step.get("format", "numeric"), "position": step.get("position", "bottom-center")}
+            check_page_number_options(step["format"], step["position"])
+        elif op == "watermark":
+            if not step.get("text") and not has_image:
+                raise HTTPException(status_code=400, detail="watermark needs text or an uploaded watermark_image")
+            try:
+                step = {
+                    "op": op,
+                    "text": step.get("text"),
+                    "position": step.get("position", "center"),
+                    "opacity": float(step.get("opacity", 0.3)),
+                    "rotation": int(step.get("rotation", 45)),
+                    "size": int(step.get("size", 50)),
+                }
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="watermark opacity, rotation and size must be numbers")
+        else:
+            step = {"op": op}
+        validated.append(step)
+    
+    if file_count > 1 and validated[0]["op"] != "merge":
+        raise HTTPException(status_code=400, detail="Several files need merge as the first step")
+    return validated
+
+@api_router.post("/pipeline")
+async def run_pipeline(
+    files: List[UploadFile] = File(...),
+    steps: str = Form(...),
+    watermark_image: Optional[UploadFile] = File(None)
+):
+    """
+    Apply an ordered list of steps to the uploaded PDF(s) and return one PDF.
+    
+    steps is a JSON list such as [{"op": "merge"}, {"op": "compress", "preset": "ebook"},
+    {"op": "add-page-numbers"}, {"op": "watermark", "text": "DRAFT"},
+    {"op": "protect", "password": "secret"}]; each step takes the same parameters as
+    its endpoint. The X-Pipeline-Report header holds the time spent per step.
+    """
+    temp_files = []
+    watermark_image_file = None
+    output_file = None
+    
+    try:
+        has_image = bool(watermark_image and watermark_image.filename)
+        validated_steps = parse_pipeline_steps(steps, len(files), has_image)
+        note_operation(files=len(files), steps=[step["op"] for step in validated_steps])
+        
+        for file in files:
+            temp_files.append(await save_upload_file(file))
+        if has_image:
+            watermark_image_file = await save_upload_file(watermark_image)
+        
+        output_file = scratch_file("_pipeline.pdf")
+        timings = await worker_pool.run(
+            "pipeline", run_pdf_pipeline, temp_files, output_file, validated_steps, watermark_image_file
+        )
+        
+        suffix = "_merged" if validated_steps[0]["op"] == "merge" and len(files) > 1 else "_processed"
+        output_filename = get_output_filename(files[0].filename, 'pdf', suffix)
+        response = create_file_response(
+            output_file,
+            output_filename,
+            "application/pdf",
+            lambda: cleanup_files(*temp_files, watermark_image_file, output_file)
+        )
+        response.headers["X-Pipeline-Report"] = json.dumps(timings)
+        return response
+    
+    except HTTPException:
+        cleanup_files(*temp_files, watermark_image_file, output_file)
+        raise
+    except InvalidInputError as e:
+        cleanup_files(*temp_files, watermark_image_file, output_file)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        cleanup_files(*temp_files, watermark_image_file, output_file)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch configuration
+# One tool is applied to many PDFs, uploaded directly or inside ZIP archives, in a
+# single request. Files are spread across the worker pool and the results are
+# streamed back as a ZIP, in upload order, followed by a manifest.json.
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 1000))
+BATCH_MAX_EXTRACTED_MB = int(os.environ.get('BATCH_MAX_EXTRACTED_MB', 4096))
+BATCH_TOOLS = {
+    'compress': (compress_pdf_file, '_compressed'),
+    'protect': (protect_pdf_file, '_protected'),
+    'watermark': (watermark_pdf_file, '_watermarked'),
+    'add-page-numbers': (add_page_numbers_file, '_numbered'),
+}
+
+def extract_batch_zip(zip_path: Path, work_dir: Path, max_bytes: int, max_files: int, zip_name: str) -> List[tuple]:
+    """
+    Extract the PDFs in zip_path into work_dir and return their (name, path, size) entries.
+    Limits are checked against the archive directory before anything is written.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise InvalidInputError(f"{zip_name} is not a valid ZIP archive")
+    entries = []
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith('.pdf')
+            and not info.filename.startswith('__MACOSX/')
+        ]
+        if len(members) > max_files:
+            raise InvalidInputError(f"A batch can hold at most {BATCH_MAX_FILES} files")
+        # ZipExtFile never reads past the declared size, so this bounds what is written
+        if sum(info.file_size for info in members) > max_bytes:
+            raise InvalidInputError(f"ZIP contents exceed the {BATCH_MAX_EXTRACTED_MB} MB batch limit")
+        for info in members:
+            path = work_dir / f"{uuid.uuid4()}.pdf"
+            with archive.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+            entries.append((info.filename, path, info.file_size))
+    return entries
+
+def unique_name(name: str, used: set) -> str:
+    """Return name, or name with a _2, _3... suffix if it is already in used"""
+    path = Path(name)
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{path.stem}_{counter}{path.suffix}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+@api_router.post("/batch/{tool}")
+async def batch_process(
+    tool: str,
+    files: List[UploadFile] = File(...),
+    preset: str = Form("ebook"),
+    grayscale: bool = Form(False),
+    password: Optional[str] = Form(None),
+    text: Optional[str] = Form(None),
+    watermark_image: Optional[UploadFile] = File(None),
+    position: str = Form("center"),
+    opacity: float = Form(0.3),
+    rotation: int = Form(45),
+    size: int = Form(50),
+    format: str = Form("numeric")
+):
+    """
+    Apply compress, protect, watermark or add-page-numbers to every PDF in files
+    (ZIP uploads are expanded) with one set of parameters.
+    
+    Returns a ZIP of the results; manifest.json at its end lists every input with its
+    output name, status, processing time and error, if any. A file that fails does not
+    stop the rest of the batch.
+    """
+    uploaded = []
+    work_dir = None
+    watermark_image_file = None
+    
+    def cleanup():
+        cleanup_files(*uploaded, watermark_image_file)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    try:
+        if tool not in BATCH_TOOLS:
+            raise HTTPException(status_code=404, detail=f"Unknown batch tool {tool}. Use one of: {', '.join(BATCH_TOOLS)}")
+        func, suffix = BATCH_TOOLS[tool]
+        
+        # Parameters shared by every file
+        args = ()
+        kwargs = {}
+        if tool == 'compress':
+            if preset not in COMPRESSION_PRESETS:
+                raise HTTPException(status_code=400, detail=f"Unknown preset {preset}. Use one of: {', '.join(COMPRESSION_PRESETS)}")
+            args = (preset, grayscale)
+        elif tool == 'protect':
+            if not password:
+                raise HTTPException(status_code=400, detail="Password is required")
+            args = (password,)
+        elif tool == 'watermark':
+            if watermark_image and watermark_image.filename:
+                watermark_image_file = await save_upload_file(watermark_image)
+            elif not text:
+                raise HTTPException(status_code=400, detail="Either text or watermark_image must be provided")
+            kwargs = dict(
+                text=text, image_path=watermark_image_file,
+                position=position, opacity=opacity, rotation=rotation, size=size
+            )
+        else:
+            args = (format, position)
+        
+        work_dir = scratch_dir("_batch")
+        
+        # Collect (name, path, size) for every input; unsupported uploads get a None path
+        # so they show up in the manifest as errors
+        inputs = []
+        extract_budget = BATCH_MAX_EXTRACTED_MB * 1024 * 1024
+        for file in files:
+            upload = await ingest_upload_file(file)
+            uploaded.append(upload.path)
+            extension = Path(file.filename).suffix.lower()
+            if extension == '.zip':
+                extracted = await asyncio.to_thread(
+                    extract_batch_zip, upload.path, work_dir, extract_budget,
+                    BATCH_MAX_FILES - len(inputs), file.filename
+                )
+                extract_budget -= sum(entry[2] for entry in extracted)
+                inputs.extend(extracted)
+                cleanup_files(upload.path)
+            elif extension == '.pdf':
+                inputs.append((file.filename, upload.path, upload.size))
+            else:
+                inputs.append((file.filename, None, upload.size))
+                cleanup_files(upload.path)
+            if len(inputs) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=400, detail=f"A batch can hold at most {BATCH_MAX_FILES} files")
+        if not any(path for _, path, _ in inputs):
+            raise HTTPException(status_code=400, detail="No PDF files found in the upload")
+        note_operation(files=len(inputs))
+        
+        used_names = set()
+        entries = [
+            (index, name, path, input_size, unique_name(get_output_filename(Path(name).name, 'pdf', suffix), used_names))
+            for index, (name, path, input_size) in enumerate(inputs)
+        ]
+        
+        async def process(entry):
+            index, name, input_path, input_size, output_name = entry
+            record = {"input": name, "output": None, "status": "failed", "input_bytes": input_size}
+            if input_path is None:
+                record.update(seconds=0.0, error="Unsupported file type; upload PDF or ZIP files")
+                return record, None
+            
+            output_path = work_dir / f"{index}_output.pdf"
+            started = time.perf_counter()
+            try:
+                report = await worker_pool.run(tool, func, input_path, output_path, *args, **kwargs)
+                record.update(status="succeeded", output=output_name, output_bytes=output_path.stat().st_size)
+                if report:
+                    record["report"] = report
+            except Exception as e:
+                cleanup_files(output_path)
+                output_path = None
+                record["error"] = str(e) or type(e).__name__
+            finally:
+                record["seconds"] = round(time.perf_counter() - started, 3)
+                cleanup_files(input_path)
+            return record, output_path
+        
+        async def batch_results():
+            started = time.perf_counter()
+            manifest = []
+            async for record, output_path in map_in_order(process, entries, worker_pool.process_workers * 2):
+                manifest.append(record)
+                if output_path:
+                    yield record["output"], output_path
+            succeeded = sum(1 for record in manifest if record["status"] == "succeeded")
+            logging.info(f"Batch {tool}: {succeeded}/{len(manifest)} files succeeded")
+            yield "manifest.json", json.dumps({
+                "tool": tool,
+                "files": len(manifest),
+                "succeeded": succeeded,
+                "failed": len(manifest) - succeeded,
+                "seconds": round(time.perf_counter() - started, 3),
+                "results": manifest,
+            }, indent=2).encode('utf-8')
+        
+        return create_streaming_response(
+            stream_zip(batch_results()),
+            f"batch_{tool}.zip",
+            "application/zip",
+            cleanup
+        )
+    
+    except HTTPException:
+        cleanup()
+        raise
+    except InvalidInputError as e:
+        cleanup()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        cleanup()
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Background jobs
+def job_client_id(request: Request) -> str:
+    """Identify the submitting client for per-client job limits"""
+    return request.headers.get('x-client-id') or (request.client.host if request.client else 'anonymous')
+
+def job_response(job: Job) -> JSONResponse:
+    job_url = f"{api_router.prefix}/jobs/{job.job_id}"
+    return JSONResponse(status_code=202, content={
+        **job.info(),
+        "status_url": job_url,
+        "events_url": f"{job_url}/events",
+        "result_url": f"{job_url}/result",
+    })
+
+@api_router.post("/jobs/pdf-to-word")
+async def submit_pdf_to_word_job(
+    request: Request,
+    file: UploadFile = File(...),
+    pages: Optional[str] = Form(None),
+    priority: int = Form(0)
+):
+    """Queue a PDF to Word conversion; progress is reported per page (per chunk on long documents)"""
+    temp_file = None
+    try:
+        upload = await ingest_upload_file(file)
+        temp_file = upload.path
+        page_indexes = await select_pdf_pages(temp_file, pages)
+        cache_key = result_cache.key("pdf-to-word", upload.sha256, pages=page_indexes if pages else None)
+        
+        async def run(job: Job):
+            cached_file = result_cache.get(cache_key)
+            if cached_file is not None:
+                await asyncio.to_thread(shutil.copyfile, cached_file, job.output_file)
+                return
+            await convert_pdf_to_docx(temp_file, job.output_file, page_indexes, job.progress_file)
+            await store_cached_result(cache_key, job.output_file)
+        
+        job = await job_scheduler.submit(
+            "pdf-to-word", job_client_id(request), priority, run, [temp_file], ".docx",
+            get_output_filename(file.filename, 'docx'),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+        return job_response(job)
+    
+    except HTTPException:
+        cleanup_files(temp_file)
+        raise
+    except Exception as e:
+        cleanup_files(temp_file)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/jobs/ipynb-to-pdf")
+async def submit_ipynb_to_pdf_job(
+    request: Request,
+    file: UploadFile = File(...),
+    color_mode: str = Form("bw"),
+    priority: int = Form(0)
+):
+    """Queue a Jupyter Notebook to PDF conversion; progress is reported per cell and page"""
+    temp_file = None
+    try:
+        if not file.filename.lower().endswith('.ipynb'):
+            raise HTTPException(status_code=400, detail="File must be a .ipynb file")
+        temp_file = await save_upload_file(file)
+        
+        async def run(job: Job):
+            await worker_pool.run("ipynb-to-pdf", build_notebook_pdf, temp_file, job.output_file, color_mode, job.progress_file)
+        
+        job = await job_scheduler.submit(
+            "ipynb-to-pdf", job_client_id(request), priority, run, [temp_file], ".pdf",
+            get_output_filename(file.filename, 'pdf'), "application/pdf",
+        )
+        return job_response(job)
+    
+    except HTTPException:
+        cleanup_files(temp_file)
+        raise
+    except Exception as e:
+        cleanup_files(temp_file)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/jobs/merge")
+async def submit_merge_job(request: Request, files: List[UploadFile] = File(...), priority: int = Form(0)):
+    """Queue a merge of several PDFs; progress is reported per page"""
+    temp_files = []
+    try:
+        for file in files:
+            if not file.filename.lower().endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+            temp_files.append(await save_upload_file(file))
+        
+        async def run(job: Job):
+            await worker_pool.run("merge", merge_pdf_files, temp_files, job.output_file, job.progress_file)
+        
+        job = await job_scheduler.submit(
+            "merge", job_client_id(request), priority, run, temp_files, ".pdf",
+            get_output_filename(files[0].filename, 'pdf', '_merged'), "application/pdf",
+        )
+        return job_response(job)
+    
+    except HTTPException:
+        cleanup_files(*temp_files)
+        raise
+    except Exception as e:
+        cleanup_files(*temp_files)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return a job's status and progress"""
+    return await job_scheduler.info(job_id)
+
+@api_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Stream a job's status and progress as server-sent events until it finishes"""
+    info = await job_scheduler.info(job_id)
+    
+    async def events():
+        last = None
+        current = info
+        while True:
+            if current != last:
+                yield f"event: {current['status']}\ndata: {json.dumps(current)}\n\n"
+                last = current
+            if current["status"] in JOB_FINISHED_STATES:
+                return
+            await job_scheduler.wait_for_change(timeout=15)
+            try:
+                current = await job_scheduler.info(job_id)
+            except HTTPException:
+                return
+            if current == last:
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Download the output of a finished job"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        await job_scheduler.info(job_id)
+        raise HTTPException(status_code=404, detail="The job's result is held by another server process.")
+    if job.status != 'succeeded':
+        detail = job.error if job.status == 'failed' else f"Job is {job.status}"
+        raise HTTPException(status_code=409, detail=detail)
+    return create_file_response(job.output_file, job.filename, job.media_type)
+
+@api_router.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a queued or running job, or discard a finished job and its result"""
+    status = await job_scheduler.cancel(job_id)
+    return {"job_id": job_id, "status": status}
+
 # Health check endpoint at root level
 @app.api_route("/health", methods=["GET", "HEAD"])
 async def root_health_check():
     """Root level health check endpoint for UptimeRobot monitoring"""
-    return {"status": "ok", "service": "PDF Master API", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return {
+        "status": "ok",
+        "service": "PDF Master API",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "database": await mongo.health(),
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(UploadLimitMiddleware, default_limit_mb=MAX_UPLOAD_MB, limits_mb=UPLOAD_LIMITS_MB)
+
+app.add_middleware(ScratchWorkspaceMiddleware, space=scratch)
+
+app.add_middleware(OperationLogMiddleware, operation_log=operation_log)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["content-disposition"],
+    expose_headers=["content-disposition", "x-compression-report", "x-document-revision", "x-pipeline-report"],
 )
 
 # Configure logging
@@ -1682,10 +6580,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def connect_mongo():
+    """Connect to MongoDB (if configured) and start the operation metadata writer"""
+    await mongo.connect()
+    operation_log.start()
+
+@app.on_event("shutdown")
+async def shutdown_worker_pool():
+    worker_pool.shutdown()
+
+@app.on_event("startup")
+async def configure_job_store():
+    """Keep job records in MongoDB when it is reachable, otherwise in memory"""
+    if JOB_STORE == 'memory' or not mongo.available:
+        return
+    try:
+        store = MongoJobStore(mongo.db.jobs, JOB_RESULT_TTL_SECONDS)
+        await store.ensure_indexes()
+        job_scheduler.store = store
+        logger.info("Storing job records in MongoDB")
+    except Exception as e:
+        logger.warning(f"MongoDB unavailable for job records ({e}); keeping them in memory")
+
+@app.on_event("startup")
+async def warm_up_tools():
+    """Import the WARMUP_TOOLS modules before serving and log the startup import costs"""
+    startup_report["warmup_imports"] = await worker_pool.warm_up() if WARMUP_MODULES else {}
+    warmed = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_report["warmup_imports"].items())
+    logger.info(f"Server module imported in {startup_report['server_import_seconds']:.2f}s" + (f"; warmed up {warmed}" if warmed else ""))
+
+@app.on_event("startup")
+async def open_result_cache():
+    """Index the result cache; done here rather than at import so worker processes skip it"""
+    await asyncio.to_thread(result_cache.open)
+
+@app.on_event("startup")
+async def start_scratch_sweeper():
+    """Sweep the scratch space now (clearing leftovers of earlier runs) and periodically"""
+    scratch.start(SCRATCH_SWEEP_SECONDS, document_sessions.evict_oldest)
+
+@app.on_event("shutdown")
+async def close_document_sessions():
+    document_sessions.close()
+
+@app.on_event("shutdown")
+async def stop_scratch_sweeper():
+    await scratch.close()
+
+@app.on_event("shutdown")
+async def close_job_scheduler():
+    await job_scheduler.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    if client:
-        client.close()
+    await operation_log.close()
+    mongo.close()
+
+startup_report["server_import_seconds"] = round(time.perf_counter() - SERVER_IMPORT_STARTED, 3)
 
 if __name__ == "__main__":
     import uvicorn
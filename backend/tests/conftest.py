@@ -0,0 +1,72 @@
+"""
+Shared fixtures for the backend tests.
+
+The server module reads its configuration from the environment at import time, so
+the test settings are applied here, before any test module imports it: no MongoDB,
+no result cache unless a test builds its own, and upload/cache directories under a
+temporary root instead of the working ones.
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+TEST_ROOT = Path(tempfile.mkdtemp(prefix="pdf-master-tests-"))
+
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ['MONGO_URL'] = ''
+os.environ['RESULT_CACHE_ENABLED'] = '0'
+os.environ['UPLOAD_DIR'] = str(TEST_ROOT / 'uploads')
+os.environ['RESULT_CACHE_DIR'] = str(TEST_ROOT / 'result_cache')
+os.environ['WORKER_PROCESSES'] = '1'
+os.environ['UPLOAD_LIMITS_MB'] = 'css-to-pdf=1'
+
+import server  # noqa: E402
+
+server.scratch.create_directories()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """A TestClient with the app's startup and shutdown hooks run once for the session"""
+    from fastapi.testclient import TestClient
+    with TestClient(server.app, raise_server_exceptions=False) as test_client:
+        yield test_client
+
+
+def build_pdf(pages: int = 3, text: str = "Page", pagesize=(612, 792)) -> bytes:
+    """A small text PDF whose page i reads '<text> <i>'"""
+    from reportlab.pdfgen import canvas
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=pagesize)
+    for page in range(pages):
+        pdf.drawString(72, pagesize[1] - 100, f"{text} {page + 1}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def pdf_page_texts(data: bytes) -> list:
+    """The text of each page of a PDF, read back with PyMuPDF"""
+    import fitz
+    with fitz.open(stream=data, filetype="pdf") as pdf_document:
+        return [page.get_text() for page in pdf_document]
+
+
+@pytest.fixture
+def make_pdf():
+    return build_pdf
+
+
+@pytest.fixture
+def page_texts():
+    return pdf_page_texts
@@ -0,0 +1,280 @@
+import io
+import json
+import shutil
+import zipfile
+
+import pytest
+
+PDF_TYPE = 'application/pdf'
+
+
+def post(client, endpoint, data=None, files=None, pdf=None):
+    files = files if files is not None else {'file': ('input.pdf', pdf, PDF_TYPE)}
+    response = client.post(f'/api/{endpoint}', files=files, data=data)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def read_pdf(data: bytes):
+    from pypdf import PdfReader
+    return PdfReader(io.BytesIO(data))
+
+
+def test_merge_keeps_every_page_in_order(client, make_pdf, page_texts):
+    response = post(client, 'merge', files=[
+        ('files', ('a.pdf', make_pdf(2, "First"), PDF_TYPE)),
+        ('files', ('b.pdf', make_pdf(2, "Second"), PDF_TYPE)),
+    ])
+    texts = page_texts(response.content)
+    assert ["First 1" in texts[0], "First 2" in texts[1], "Second 1" in texts[2], "Second 2" in texts[3]] == [True] * 4
+
+
+def test_split_returns_the_selected_pages(client, make_pdf, page_texts):
+    texts = page_texts(post(client, 'split', {'pages': '2-3'}, pdf=make_pdf(4)).content)
+    assert len(texts) == 2 and "Page 2" in texts[0] and "Page 3" in texts[1]
+
+
+def test_compress_keeps_the_pages(client, make_pdf, page_texts):
+    response = post(client, 'compress', {'preset': 'screen'}, pdf=make_pdf(3))
+    texts = page_texts(response.content)
+    assert len(texts) == 3 and "Page 3" in texts[2]
+
+
+def test_rotate_sets_the_page_rotation(client, make_pdf):
+    reader = read_pdf(post(client, 'rotate', {'angle': 90}, pdf=make_pdf(2)).content)
+    assert [page.rotation for page in reader.pages] == [90, 90]
+
+
+@pytest.mark.parametrize("endpoint, image_format", [("pdf-to-jpg", "JPEG"), ("pdf-to-png", "PNG")])
+def test_rasterize_returns_one_image_per_page(client, make_pdf, endpoint, image_format):
+    from PIL import Image
+    response = post(client, endpoint, {'dpi': 72}, pdf=make_pdf(3))
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = archive.namelist()
+        images = [Image.open(io.BytesIO(archive.read(name))) for name in names]
+    assert len(names) == 3
+    assert {image.format for image in images} == {image_format}
+    assert images[0].size == (612, 792)
+
+
+def test_rasterize_failure_mid_stream_ends_the_zip_with_an_error(client, make_pdf, monkeypatch):
+    import server
+    render = server.rasterize_pdf_pages
+
+    def fail_after_first_chunk(input_path, output_dir, page_indexes, **options):
+        if page_indexes[0] >= server.RASTER_CHUNK_PAGES:
+            raise RuntimeError("renderer crashed")
+        return render(input_path, output_dir, page_indexes, **options)
+
+    monkeypatch.setitem(server.worker_pool.routes, 'pdf-to-png', 'thread')
+    monkeypatch.setattr(server, 'rasterize_pdf_pages', fail_after_first_chunk)
+    response = post(client, 'pdf-to-png', {'dpi': 36}, pdf=make_pdf(server.RASTER_CHUNK_PAGES * 3))
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = archive.namelist()
+        error = json.loads(archive.read('error.json'))
+    assert len(names) == server.RASTER_CHUNK_PAGES + 1 and names[-1] == 'error.json'
+    assert error['error'] == "renderer crashed"
+    assert (error['pages_rendered'], error['pages_selected']) == (server.RASTER_CHUNK_PAGES, server.RASTER_CHUNK_PAGES * 3)
+
+
+def test_pdf_to_word_keeps_the_text(client, make_pdf):
+    import docx
+    response = post(client, 'pdf-to-word', pdf=make_pdf(2, "Converted"))
+    text = "\n".join(paragraph.text for paragraph in docx.Document(io.BytesIO(response.content)).paragraphs)
+    assert "Converted 1" in text and "Converted 2" in text
+
+
+def test_word_to_pdf_renders_paragraphs(client, page_texts):
+    import docx
+    document = docx.Document()
+    document.add_heading("Quarterly report", level=1)
+    document.add_paragraph("Revenue grew in every region.")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    response = post(client, 'word-to-pdf', files={'file': ('report.docx', buffer.getvalue())})
+    text = "".join(page_texts(response.content))
+    assert "Quarterly report" in text and "Revenue grew in every region." in text
+
+
+def test_excel_to_pdf_renders_cells(client, page_texts):
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Sales"
+    workbook.active.append(["Region", "Total"])
+    workbook.active.append(["North", 1250])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    response = post(client, 'excel-to-pdf', files={'file': ('sales.xlsx', buffer.getvalue())})
+    text = "".join(page_texts(response.content))
+    assert "Region" in text and "North" in text and "1250" in text
+
+
+def test_pdf_to_excel_writes_the_text(client, make_pdf):
+    import openpyxl
+    response = post(client, 'pdf-to-excel', {'mode': 'text'}, pdf=make_pdf(2, "Row"))
+    workbook = openpyxl.load_workbook(io.BytesIO(response.content))
+    values = [cell for sheet in workbook for row in sheet.iter_rows(values_only=True) for cell in row if cell]
+    assert any("Row 1" in str(value) for value in values)
+
+
+CODE_SAMPLES = [
+    ("cpp-to-pdf", "main.cpp", "int main() { return 42; }"),
+    ("c-to-pdf", "main.c", "int main(void) { return 42; }"),
+    ("js-to-pdf", "app.js", "const answer = 42;"),
+    ("php-to-pdf", "index.php", "<?php echo 42; ?>"),
+    ("ts-to-pdf", "app.ts", "let answer: number = 42;"),
+    ("java-to-pdf", "Main.java", "class Main { int answer = 42; }"),
+    ("python-to-pdf", "main.py", "answer = 42"),
+    ("html-to-pdf", "index.html", "<p>answer 42</p>"),
+    ("css-to-pdf", "site.css", "p { margin: 42px; }"),
+]
+
+
+@pytest.mark.parametrize("endpoint, filename, source", CODE_SAMPLES)
+@pytest.mark.parametrize("color_mode", ["bw", "colorful"])
+def test_code_to_pdf_renders_the_source(client, page_texts, endpoint, filename, source, color_mode):
+    response = post(client, endpoint, {'color_mode': color_mode}, files={'file': (filename, source.encode(), 'text/plain')})
+    lines = page_texts(response.content)[0].splitlines()
+    assert lines == ["1", source]
+
+
+def test_code_endpoints_highlight_their_language_whatever_the_file_name(client):
+    import fitz
+    response = post(client, 'cpp-to-pdf', {'color_mode': 'colorful'},
+                    files={'file': ('snippet.txt', b'return 42;', 'text/plain')})
+    with fitz.open(stream=response.content, filetype="pdf") as pdf_document:
+        colors = {
+            span["text"].strip(): span["color"]
+            for block in pdf_document[0].get_text("dict")["blocks"]
+            for line in block["lines"]
+            for span in line["spans"]
+        }
+    assert colors["return"] == 0x1565c0
+
+
+def test_code_to_pdf_rejects_files_that_are_not_utf8(client):
+    response = client.post('/api/cpp-to-pdf', files={'file': ('main.cpp', b'\xff\xfe\x00int', 'text/plain')})
+    assert response.status_code == 400
+
+
+def test_xml_to_pdf_indents_the_document(client, page_texts):
+    response = post(client, 'xml-to-pdf', files={'file': ('data.xml', b'<root><answer>42</answer></root>', 'text/xml')})
+    text = page_texts(response.content)[0]
+    assert "<root>" in text and "  <answer>42</answer>" in text
+
+
+def test_xml_to_pdf_rejects_invalid_xml(client):
+    response = client.post('/api/xml-to-pdf', files={'file': ('data.xml', b'<root><open></root>', 'text/xml')})
+    assert response.status_code == 400
+
+
+def test_ipynb_to_pdf_renders_cells_and_outputs(client, page_texts):
+    import nbformat
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [
+        nbformat.v4.new_markdown_cell("# Analysis"),
+        nbformat.v4.new_code_cell("print('hello')", outputs=[nbformat.v4.new_output('stream', text='hello\n')]),
+    ]
+    response = post(client, 'ipynb-to-pdf', files={'file': ('notebook.ipynb', nbformat.writes(notebook).encode())})
+    text = "".join(page_texts(response.content))
+    assert "Analysis" in text and "print" in text and "hello" in text
+
+
+def test_watermark_adds_the_text_to_every_page(client, make_pdf, page_texts):
+    texts = page_texts(post(client, 'watermark', {'text': 'CONFIDENTIAL'}, pdf=make_pdf(2)).content)
+    assert all("CONFIDENTIAL" in text for text in texts)
+
+
+def test_protect_then_unlock(client, make_pdf):
+    protected = post(client, 'protect', {'password': 'secret'}, pdf=make_pdf(2)).content
+    reader = read_pdf(protected)
+    assert reader.is_encrypted
+    assert client.post('/api/unlock', files={'file': ('p.pdf', protected, PDF_TYPE)}, data={'password': 'wrong'}).status_code != 200
+    unlocked = read_pdf(post(client, 'unlock', {'password': 'secret'}, pdf=protected).content)
+    assert not unlocked.is_encrypted and len(unlocked.pages) == 2
+
+
+def test_sign_adds_the_signature(client, make_pdf, page_texts):
+    texts = page_texts(post(client, 'sign', {'signature_text': 'Jordan Example'}, pdf=make_pdf(2)).content)
+    assert "Jordan Example" in texts[-1]
+
+
+def test_add_page_numbers(client, make_pdf, page_texts):
+    texts = page_texts(post(client, 'add-page-numbers', {'format': 'numeric-page', 'position': 'bottom-center'},
+                            pdf=make_pdf(3, "Body")).content)
+    assert len(texts) == 3 and "Page 3" in texts[2]
+
+
+def test_reorder_and_delete_pages(client, make_pdf, page_texts):
+    texts = page_texts(post(client, 'reorder', {'page_order': '3,1,2'}, pdf=make_pdf(3)).content)
+    assert ["Page 3" in texts[0], "Page 1" in texts[1], "Page 2" in texts[2]] == [True] * 3
+    texts = page_texts(post(client, 'delete-pages', {'pages_to_delete': '2'}, pdf=make_pdf(3)).content)
+    assert len(texts) == 2 and "Page 3" in texts[1]
+
+
+def test_page_previews_and_info(client, make_pdf):
+    assert len(post(client, 'preview-pages', pdf=make_pdf(2)).json()['pages']) == 2
+    assert post(client, 'pdf-pages-info', pdf=make_pdf(3)).json()['total_pages'] == 3
+
+
+def test_pipeline_merges_then_numbers_then_protects(client, make_pdf):
+    steps = [{"op": "merge"}, {"op": "add-page-numbers"}, {"op": "protect", "password": "secret"}]
+    response = post(client, 'pipeline', {'steps': json.dumps(steps)}, files=[
+        ('files', ('a.pdf', make_pdf(1), PDF_TYPE)),
+        ('files', ('b.pdf', make_pdf(2), PDF_TYPE)),
+    ])
+    reader = read_pdf(response.content)
+    assert reader.is_encrypted and reader.decrypt("secret") and len(reader.pages) == 3
+
+
+@pytest.mark.parametrize("steps", [
+    [{"op": "protect", "password": "secret"}],
+    [{"op": "compress"}, {"op": "protect", "password": "secret"}],
+])
+def test_pipeline_protects_with_aes_256(client, make_pdf, steps):
+    response = post(client, 'pipeline', {'steps': json.dumps(steps)}, files=[('files', ('a.pdf', make_pdf(2), PDF_TYPE))])
+    reader = read_pdf(response.content)
+    encrypt = reader.trailer['/Encrypt']
+    assert (encrypt['/V'], encrypt['/R']) == (5, 6)
+    assert reader.decrypt("secret") and "Page 2" in reader.pages[1].extract_text()
+
+
+@pytest.mark.parametrize("options", [{"format": "hex"}, {"position": "top-left"}])
+def test_page_number_options_are_validated(client, make_pdf, options):
+    steps = [{"op": "add-page-numbers", **options}]
+    response = client.post('/api/pipeline', data={'steps': json.dumps(steps)},
+                           files=[('files', ('a.pdf', make_pdf(1), PDF_TYPE))])
+    assert response.status_code == 400
+    form = {'format': 'numeric', 'position': 'bottom-center', **options}
+    response = client.post('/api/add-page-numbers', data=form, files={'file': ('a.pdf', make_pdf(1), PDF_TYPE)})
+    assert response.status_code == 400
+
+
+def test_batch_returns_each_result_and_a_manifest(client, make_pdf):
+    response = post(client, 'batch/compress', files=[
+        ('files', ('a.pdf', make_pdf(1), PDF_TYPE)),
+        ('files', ('b.pdf', b'not a pdf', PDF_TYPE)),
+    ])
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+    statuses = {record['input']: record['status'] for record in manifest['results']}
+    assert statuses == {'a.pdf': 'succeeded', 'b.pdf': 'failed'}
+    assert (manifest['files'], manifest['succeeded']) == (2, 1)
+
+
+def test_document_session_edits(client, make_pdf, page_texts):
+    document = client.post('/api/documents', files={'file': ('doc.pdf', make_pdf(3), PDF_TYPE)}).json()
+    document_url = f"/api/documents/{document['document_id']}"
+    assert client.post(f'{document_url}/reorder', data={'page_order': '2,3,1', 'save': 'true'}).status_code == 200
+    assert client.post(f'{document_url}/delete-pages', data={'pages_to_delete': '1', 'save': 'true'}).status_code == 200
+    texts = page_texts(client.get(f'{document_url}/download').content)
+    assert len(texts) == 2 and "Page 3" in texts[0] and "Page 1" in texts[1]
+    thumbnail = client.get(f'{document_url}/pages/1/thumbnail')
+    assert thumbnail.status_code == 200 and thumbnail.headers['content-type'].startswith('image/')
+    assert client.delete(document_url).status_code == 200
+
+
+@pytest.mark.skipif(shutil.which("tesseract") is None, reason="needs the tesseract binary")
+def test_searchable_pdf_adds_a_text_layer(client, make_pdf, page_texts):
+    response = post(client, 'searchable-pdf', pdf=make_pdf(1, "Scanned"))
+    assert len(page_texts(response.content)) == 1
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+
+def test_cached_reader_is_safe_to_share_between_threads(tmp_path, make_pdf, page_texts):
+    source = tmp_path / "source.pdf"
+    source.write_bytes(make_pdf(200))
+    order = list(range(199, -1, -1))
+
+    def reorder(index):
+        output = tmp_path / f"reordered_{index}.pdf"
+        server.reorder_pdf_file(source, output, order, cached=True)
+        return output.read_bytes()
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outputs = list(executor.map(reorder, range(16)))
+    finally:
+        server.forget_pdf_reader(source)
+
+    for output in outputs:
+        texts = page_texts(output)
+        assert len(texts) == 200
+        assert "Page 200" in texts[0] and "Page 1" in texts[199]
+
+
+def test_replaced_revision_stays_until_its_readers_finish(tmp_path, make_pdf):
+    store = server.DocumentSessionStore(idle_seconds=3600, max_sessions=10)
+    first = tmp_path / "first.pdf"
+    second = tmp_path / "second.pdf"
+    first.write_bytes(make_pdf(1))
+    second.write_bytes(make_pdf(2))
+    session = store.create(server.StoredUpload(first, first.stat().st_size, "sha"), "doc.pdf", [])
+
+    with store.reading(session) as path:
+        store.replace(session, second, [])
+        assert path == first and first.exists()
+        assert session.path == second
+    assert not first.exists()
+
+    path = store.acquire(session)
+    store.delete(session.document_id)
+    assert second.exists()
+    store.release(path)
+    assert not second.exists()
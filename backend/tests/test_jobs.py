@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def make_scheduler(**limits):
+    settings = dict(max_running=1, max_running_per_client=1, max_queued=10, max_queued_per_client=10, result_ttl=3600)
+    settings.update(limits)
+    return server.JobScheduler(**settings)
+
+
+def writer(order, name, gate=None, content=b"done"):
+    """A job body that waits for gate (if any), records its name and writes its output"""
+    async def run(job):
+        if gate is not None:
+            await gate.wait()
+        order.append(name)
+        job.output_file.write_bytes(content)
+    return run
+
+
+async def submit(scheduler, name, run, client_id="client", priority=0):
+    return await scheduler.submit(name, client_id, priority, run, [], ".bin", f"{name}.bin", "application/octet-stream")
+
+
+async def finish(scheduler, *jobs):
+    while any(job.status not in server.JOB_FINISHED_STATES for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+def test_queued_jobs_run_by_priority_then_age():
+    async def scenario():
+        scheduler = make_scheduler()
+        order, gate = [], asyncio.Event()
+        blocker = await submit(scheduler, "blocker", writer(order, "blocker", gate))
+        low = await submit(scheduler, "low", writer(order, "low"))
+        high = await submit(scheduler, "high", writer(order, "high"), priority=5)
+        later_high = await submit(scheduler, "later-high", writer(order, "later-high"), priority=5)
+        assert (blocker.status, low.status, high.status) == ('running', 'queued', 'queued')
+        gate.set()
+        await finish(scheduler, blocker, low, high, later_high)
+        await scheduler.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["blocker", "high", "later-high", "low"]
+
+
+def test_one_client_cannot_take_every_running_slot():
+    async def scenario():
+        scheduler = make_scheduler(max_running=2, max_running_per_client=1)
+        order, gate = [], asyncio.Event()
+        first = await submit(scheduler, "a1", writer(order, "a1", gate), client_id="a")
+        second = await submit(scheduler, "a2", writer(order, "a2"), client_id="a")
+        other = await submit(scheduler, "b1", writer(order, "b1"), client_id="b")
+        statuses = (first.status, second.status, other.status)
+        gate.set()
+        await finish(scheduler, first, second, other)
+        await scheduler.close()
+        return statuses
+
+    assert asyncio.run(scenario()) == ('running', 'queued', 'running')
+
+
+def test_queue_limits_reject_new_jobs():
+    async def scenario():
+        scheduler = make_scheduler(max_queued=2, max_queued_per_client=1)
+        gate = asyncio.Event()
+        running = await submit(scheduler, "running", writer([], "running", gate), client_id="a")
+        queued = await submit(scheduler, "queued", writer([], "queued"), client_id="a")
+        with pytest.raises(HTTPException) as per_client:
+            await submit(scheduler, "again", writer([], "again"), client_id="a")
+        await submit(scheduler, "other", writer([], "other"), client_id="b")
+        with pytest.raises(HTTPException) as full:
+            await submit(scheduler, "full", writer([], "full"), client_id="c")
+        gate.set()
+        await finish(scheduler, running, queued)
+        await scheduler.close()
+        return per_client.value.status_code, full.value.status_code
+
+    assert asyncio.run(scenario()) == (429, 503)
+
+
+def test_cancelling_a_queued_job_frees_its_queue_slot():
+    async def scenario():
+        scheduler = make_scheduler(max_queued=1)
+        order, gate = [], asyncio.Event()
+        running = await submit(scheduler, "running", writer(order, "running", gate))
+        queued = await submit(scheduler, "queued", writer(order, "queued"))
+        assert await scheduler.cancel(queued.job_id) == 'cancelled'
+        replacement = await submit(scheduler, "replacement", writer(order, "replacement"))
+        gate.set()
+        await finish(scheduler, running, replacement)
+        await scheduler.close()
+        return order, queued.status
+
+    order, status = asyncio.run(scenario())
+    assert order == ["running", "replacement"]
+    assert status == 'cancelled'
+
+
+def test_cancelling_a_running_job_discards_its_output():
+    async def scenario():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+        job = await submit(scheduler, "slow", writer([], "slow", gate))
+        assert await scheduler.cancel(job.job_id) == 'cancelling'
+        gate.set()
+        await finish(scheduler, job)
+        output_exists = job.output_file.exists()
+        await scheduler.close()
+        return job.status, output_exists
+
+    assert asyncio.run(scenario()) == ('cancelled', False)
+
+
+def test_failed_and_finished_jobs():
+    async def scenario():
+        scheduler = make_scheduler()
+
+        async def broken(job):
+            raise ValueError("no pages")
+
+        failed = await submit(scheduler, "broken", broken)
+        done = await submit(scheduler, "done", writer([], "done"))
+        await finish(scheduler, failed, done)
+        result = done.output_file.read_bytes()
+        assert await scheduler.cancel(done.job_id) == 'deleted'
+        output_exists = done.output_file.exists()
+        with pytest.raises(HTTPException):
+            await scheduler.info(done.job_id)
+        await scheduler.close()
+        return failed.status, failed.error, result, output_exists
+
+    assert asyncio.run(scenario()) == ('failed', "no pages", b"done", False)
+
+
+def test_merge_job_endpoint(client, make_pdf, page_texts):
+    response = client.post('/api/jobs/merge', files=[
+        ('files', ('a.pdf', make_pdf(2, "First"), 'application/pdf')),
+        ('files', ('b.pdf', make_pdf(3, "Second"), 'application/pdf')),
+    ])
+    assert response.status_code == 202
+    job_url = response.json()['status_url']
+
+    deadline = time.time() + 60
+    while client.get(job_url).json()['status'] in ('queued', 'running'):
+        assert time.time() < deadline
+        time.sleep(0.05)
+    info = client.get(job_url).json()
+    assert info['status'] == 'succeeded', info
+
+    result = client.get(response.json()['result_url'])
+    texts = page_texts(result.content)
+    assert len(texts) == 5
+    assert "First 1" in texts[0] and "Second 3" in texts[4]
+    assert client.delete(job_url).json()['status'] == 'deleted'
+    assert client.get(job_url).status_code == 404
+
+
+def test_unknown_job_is_404(client):
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/result').status_code == 404
+    assert client.delete('/api/jobs/missing').status_code == 404
+
+
+def test_jobs_start_outside_the_submitting_request_context():
+    async def scenario():
+        scheduler = make_scheduler()
+        seen = []
+
+        async def run(job):
+            seen.append(server.current_workspace.get())
+            job.output_file.write_bytes(b"done")
+
+        server.current_workspace.set("request workspace")
+        job = await submit(scheduler, "job", run)
+        await finish(scheduler, job)
+        await scheduler.close()
+        return seen, job.output_file.parent
+
+    seen, output_directory = asyncio.run(scenario())
+    assert seen == [None]
+    assert output_directory == server.scratch.directory
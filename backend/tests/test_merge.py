@@ -0,0 +1,119 @@
+import io
+from pathlib import Path
+
+import pytest
+from pypdf import PdfReader
+
+import server
+
+FONT_FILE = Path(__import__("reportlab").__file__).parent / "fonts" / "Vera.ttf"
+
+
+def logo_png() -> bytes:
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (120, 80), "white")
+    ImageDraw.Draw(image).ellipse((10, 10, 110, 70), fill="navy")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def rich_pdf(path: Path, title: str, logo: bytes):
+    """Two pages sharing an embedded font and an image, with a link, a note and an outline"""
+    import fitz
+    with fitz.open() as pdf_document:
+        for number in (1, 2):
+            page = pdf_document.new_page()
+            page.insert_font(fontname="vera", fontfile=str(FONT_FILE))
+            page.insert_text((72, 72), f"{title} page {number}", fontname="vera", fontsize=14)
+            page.insert_image(fitz.Rect(72, 100, 192, 180), stream=logo)
+            page.insert_link({"kind": fitz.LINK_URI, "from": fitz.Rect(72, 200, 200, 220), "uri": f"https://example.com/{title}/{number}"})
+            page.add_text_annot((300, 300), f"{title} note {number}")
+        pdf_document.set_toc([[1, f"{title} intro", 1], [2, f"{title} details", 2]])
+        pdf_document.save(str(path))
+
+
+def indirect_length_pdf(path: Path, text: str):
+    """A hand-written PDF whose content stream gives its /Length as an indirect object"""
+    content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 6 0 R >> >> >>",
+        b"<< /Length 5 0 R >>\nstream\n" + content + b"\nendstream",
+        str(len(content)).encode("ascii"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    output += b"".join(f"{offset:010d} 00000 n \n".encode("ascii") for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii")
+    path.write_bytes(bytes(output))
+
+
+@pytest.fixture
+def merge_inputs(tmp_path):
+    logo = logo_png()
+    paths = []
+    for title in ("alpha", "beta", "gamma"):
+        paths.append(tmp_path / f"{title}.pdf")
+        rich_pdf(paths[-1], title, logo)
+    paths.insert(1, tmp_path / "plain.pdf")
+    indirect_length_pdf(paths[1], "Indirect length stream")
+    return paths
+
+
+@pytest.mark.parametrize("flush_mb", [0, 256], ids=["flush-after-each-file", "in-memory"])
+def test_merge_keeps_pages_annotations_and_outlines(tmp_path, merge_inputs, monkeypatch, flush_mb):
+    monkeypatch.setattr(server, "MERGE_FLUSH_MB", flush_mb)
+    output = tmp_path / "merged.pdf"
+    server.merge_pdf_files(merge_inputs, output)
+
+    reader = PdfReader(str(output), strict=True)
+    texts = [page.extract_text() for page in reader.pages]
+    assert len(texts) == 7
+    assert "alpha page 1" in texts[0] and "alpha page 2" in texts[1]
+    assert "Indirect length stream" in texts[2]
+    assert "beta page 1" in texts[3] and "gamma page 2" in texts[6]
+
+    rich_pages = [0, 1, 3, 4, 5, 6]
+    for index, (title, number) in zip(rich_pages, [(t, n) for t in ("alpha", "beta", "gamma") for n in (1, 2)]):
+        page = reader.pages[index]
+        annotations = [annotation.get_object() for annotation in page["/Annots"]]
+        uris = [annotation["/A"]["/URI"] for annotation in annotations if annotation["/Subtype"] == "/Link"]
+        notes = [annotation["/Contents"] for annotation in annotations if annotation["/Subtype"] == "/Text"]
+        assert uris == [f"https://example.com/{title}/{number}"]
+        assert notes == [f"{title} note {number}"]
+        for annotation in annotations:
+            if "/P" in annotation:
+                assert annotation["/P"].get_object() == page.get_object()
+        [image] = page.images
+        assert image.image.size == (120, 80)
+
+    outline = [(item.title, reader.get_destination_page_number(item)) for item in reader.outline if not isinstance(item, list)]
+    nested = [(item.title, reader.get_destination_page_number(item)) for group in reader.outline if isinstance(group, list) for item in group]
+    assert outline == [("alpha intro", 0), ("beta intro", 3), ("gamma intro", 5)]
+    assert nested == [("alpha details", 1), ("beta details", 4), ("gamma details", 6)]
+
+
+def test_merge_stores_shared_fonts_and_images_once(tmp_path, merge_inputs):
+    import fitz
+    output = tmp_path / "merged.pdf"
+    server.merge_pdf_files(merge_inputs, output)
+
+    with fitz.open(str(output)) as merged:
+        assert not merged.is_repaired
+        image_xrefs = {image[0] for page in merged for image in page.get_images(full=True)}
+        font_xrefs = {font[0] for page in merged for font in page.get_fonts(full=True) if "Vera" in font[3]}
+        embedded = [len(merged.extract_font(xref)[3]) for xref in font_xrefs]
+    assert len(image_xrefs) == 1
+    assert len(font_xrefs) == 1 and embedded[0] > 0
+    single = tmp_path / "single.pdf"
+    server.merge_pdf_files(merge_inputs[:1], single)
+    assert output.stat().st_size < 2 * single.stat().st_size
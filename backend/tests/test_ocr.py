@@ -0,0 +1,36 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import RectangleObject
+
+import server
+
+
+def page_hashes(pdf_bytes: bytes) -> list:
+    import fitz
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return [server.page_content_hash(pdf_document, page) for page in pdf_document]
+
+
+def with_boxes(pdf_bytes: bytes, mediabox=None, cropbox=None) -> bytes:
+    pdf_writer = PdfWriter(clone_from=PdfReader(io.BytesIO(pdf_bytes)))
+    for page in pdf_writer.pages:
+        if mediabox:
+            page.mediabox = RectangleObject(mediabox)
+        if cropbox:
+            page.cropbox = RectangleObject(cropbox)
+    buffer = io.BytesIO()
+    pdf_writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_page_hash_changes_with_the_page_boxes(make_pdf):
+    original = make_pdf(1)
+    # Same visible size, different placement in user space
+    shifted_crop = with_boxes(original, cropbox=(0, 0, 500, 600))
+    moved_crop = with_boxes(original, cropbox=(100, 100, 600, 700))
+    moved_media = with_boxes(original, mediabox=(10, 10, 622, 802), cropbox=(10, 10, 622, 802))
+
+    hashes = [page_hashes(data)[0] for data in (original, shifted_crop, moved_crop, moved_media)]
+    assert len(set(hashes)) == 4
+    assert page_hashes(with_boxes(original, cropbox=(100, 100, 600, 700)))[0] == hashes[2]
@@ -0,0 +1,124 @@
+"""
+StreamingDocTemplate drives reportlab's BaseDocTemplate layout hooks (_startBuild,
+handle_flowable, clean_hanging, _endBuild) directly, so these tests pin down the
+output of both renderers built on it against the reportlab version in requirements.
+"""
+import base64
+import io
+
+import pytest
+
+import server
+
+
+def png_bytes(width=200, height=120) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "teal").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def rendered_pages(path) -> list:
+    import fitz
+    with fitz.open(str(path)) as pdf_document:
+        return [(page.get_text(), len(page.get_images())) for page in pdf_document]
+
+
+def test_streaming_template_lays_out_like_the_stock_build(tmp_path):
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import BaseDocTemplate, Frame, PageBreak, PageTemplate, Paragraph, Spacer, Table
+
+    styles = getSampleStyleSheet()
+
+    def flowables():
+        for section in range(3):
+            heading = Paragraph(f"Section {section}", styles["Heading1"])
+            heading.keepWithNext = True
+            yield heading
+            yield Spacer(1, 600 - section * 40)
+            yield Paragraph(f"Body of section {section}", styles["BodyText"])
+            yield Table([[f"r{row}c{column}" for column in range(3)] for row in range(40)], repeatRows=1)
+            yield PageBreak()
+
+    def render(template_class, path, source):
+        doc = template_class(str(path), pagesize=(612, 792))
+        doc.addPageTemplates([PageTemplate(id="page", frames=[Frame(72, 72, 468, 648)])])
+        doc.build(source)
+
+    stock, streamed = tmp_path / "stock.pdf", tmp_path / "streamed.pdf"
+    render(BaseDocTemplate, stock, list(flowables()))
+    render(server.streaming_doc_template_class(), streamed, flowables())
+    assert rendered_pages(streamed) == rendered_pages(stock)
+
+
+def test_docx_to_pdf_renders_tables_images_and_page_breaks(tmp_path):
+    import docx
+    from docx.shared import Inches
+
+    document = docx.Document()
+    document.add_heading("Annual report", level=1)
+    table = document.add_table(rows=3, cols=3)
+    for row in range(3):
+        for column in range(3):
+            table.cell(row, column).text = f"cell {row}-{column}"
+    document.add_picture(io.BytesIO(png_bytes()), width=Inches(2))
+    document.add_page_break()
+    document.add_heading("Appendix", level=1)
+    document.add_paragraph("Appendix body.")
+    document.add_page_break()
+    for number in range(120):
+        document.add_paragraph(f"Closing paragraph {number} with enough words to wrap around the line at least once or twice.")
+    source, output = tmp_path / "report.docx", tmp_path / "report.pdf"
+    document.save(str(source))
+
+    report = server.docx_to_pdf_file(source, output)
+    pages = rendered_pages(output)
+
+    assert report["pages"] == len(pages) >= 5
+    first_text, first_images = pages[0]
+    assert "Annual report" in first_text and "cell 0-0" in first_text and "cell 2-2" in first_text
+    assert first_images == 1
+    assert pages[1][0].split() == ["Appendix", "Appendix", "body."]
+    assert "Closing paragraph 0 " in pages[2][0]
+    assert "Closing paragraph 119 " in pages[-1][0]
+    all_text = "".join(text for text, _ in pages)
+    assert all(f"Closing paragraph {number} " in all_text for number in range(120))
+
+
+def test_notebook_renderer_runs_long_outputs_across_pages(tmp_path):
+    import nbformat
+
+    notebook = nbformat.v4.new_notebook()
+    long_output = "".join(f"output line {number}\n" for number in range(200))
+    notebook.cells = [
+        nbformat.v4.new_markdown_cell("# Experiment log"),
+        nbformat.v4.new_code_cell("for i in range(200):\n    print(f'output line {i}')",
+                                  outputs=[nbformat.v4.new_output("stream", text=long_output)]),
+        nbformat.v4.new_code_cell("plot()", outputs=[nbformat.v4.new_output(
+            "display_data", data={"image/png": base64.b64encode(png_bytes()).decode("ascii")})]),
+        nbformat.v4.new_markdown_cell("Conclusion"),
+    ]
+    source, output = tmp_path / "log.ipynb", tmp_path / "log.pdf"
+    source.write_text(nbformat.writes(notebook), encoding="utf-8")
+
+    report = server.build_notebook_pdf(source, output, "colorful")
+    pages = rendered_pages(output)
+
+    assert report["pages"] == len(pages) >= 4
+    assert report["images"] == sum(images for _, images in pages) == 1
+    assert "Experiment log" in pages[0][0]
+    all_text = "".join(text for text, _ in pages)
+    assert all(f"output line {number}\n" in all_text for number in range(200))
+    assert all_text.index("output line 199") < all_text.index("Conclusion")
+    assert "Conclusion" in pages[-1][0]
+
+
+@pytest.mark.parametrize("renderer", ["docx", "notebook"])
+def test_renderers_reject_broken_input(tmp_path, renderer):
+    source = tmp_path / "broken"
+    source.write_bytes(b"not a document")
+    with pytest.raises(server.InvalidInputError):
+        if renderer == "docx":
+            server.docx_to_pdf_file(source, tmp_path / "out.pdf")
+        else:
+            server.build_notebook_pdf(source, tmp_path / "out.pdf")
@@ -0,0 +1,85 @@
+import os
+import time
+
+import server
+
+
+def make_cache(directory, max_bytes=1024, ttl_seconds=3600, enabled=True):
+    cache = server.ResultCache(directory, max_bytes, ttl_seconds, {'pypdf': '1.0'}, enabled=enabled)
+    cache.open()
+    return cache
+
+
+def test_key_depends_on_endpoint_inputs_params_and_versions(tmp_path):
+    cache = make_cache(tmp_path)
+    key = cache.key("compress", "abc", preset="ebook", grayscale=False)
+
+    assert key == cache.key("compress", "abc", grayscale=False, preset="ebook")
+    assert key != cache.key("rotate", "abc", preset="ebook", grayscale=False)
+    assert key != cache.key("compress", "abd", preset="ebook", grayscale=False)
+    assert key != cache.key("compress", "abc", preset="screen", grayscale=False)
+    assert cache.key("split", "abc", pages=None) == cache.key("split", "abc")
+
+    other_versions = server.ResultCache(tmp_path, 1024, 3600, {'pypdf': '2.0'})
+    assert key != other_versions.key("compress", "abc", preset="ebook", grayscale=False)
+
+
+def test_put_and_get_round_trip_with_metadata(tmp_path):
+    cache = make_cache(tmp_path / "cache")
+    source = tmp_path / "output.pdf"
+    source.write_bytes(b"result")
+
+    key = cache.key("compress", "abc")
+    assert cache.get(key) is None
+    cache.put(key, source, {'pages': 3})
+
+    assert cache.get(key).read_bytes() == b"result"
+    assert cache.get_metadata(key) == {'pages': 3}
+    assert source.exists()
+    assert cache.metrics()['hits'] == 1 and cache.metrics()['misses'] == 1
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = make_cache(tmp_path / "cache", enabled=False)
+    key = cache.key("compress", "abc")
+    assert cache.put_bytes(key, b"result") is None
+    assert cache.get(key) is None
+    assert not (tmp_path / "cache").exists()
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    first, second, third = (cache.key("compress", name) for name in "abc")
+    cache.put_bytes(first, b"1111")
+    cache.put_bytes(second, b"2222")
+    assert cache.get(first) is not None
+    cache.put_bytes(third, b"3333")
+
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+    assert cache.metrics()['bytes'] == 8
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = make_cache(tmp_path, ttl_seconds=-1)
+    key = cache.key("compress", "abc")
+    path = cache.put_bytes(key, b"result")
+    assert cache.get(key) is None
+    assert not path.exists()
+
+
+def test_open_indexes_entries_from_a_previous_run_oldest_first(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=12)
+    keys = [cache.key("compress", name) for name in "abc"]
+    now = time.time()
+    for age, key in zip((30, 20, 10), keys):
+        path = cache.put_bytes(key, b"1234")
+        os.utime(path, (now - age, now - age))
+
+    reopened = make_cache(tmp_path, max_bytes=12)
+    assert reopened.metrics()['entries'] == 3
+    reopened.put_bytes(reopened.key("compress", "d"), b"1234")
+
+    assert reopened.get(keys[0]) is None
+    assert all(reopened.get(key) is not None for key in keys[1:])
@@ -0,0 +1,60 @@
+import server
+
+
+def make_space(tmp_path):
+    space = server.ScratchSpace(
+        tmp_path / "disk", 10 * 1024 * 1024, 3600,
+        ram_directory=tmp_path / "ram", ram_max_bytes=1000, ram_file_max_bytes=400,
+    )
+    space.create_directories()
+    return space
+
+
+def test_small_files_of_known_size_go_to_ram_while_it_has_room(tmp_path):
+    space = make_space(tmp_path)
+    first = space.new_path(".pdf", 400)
+    second = space.new_path(".pdf", 400)
+    third = space.new_path(".pdf", 400)
+    assert first.parent == second.parent == space.ram_directory
+    assert third.parent == space.directory
+    assert space.new_path(".pdf", 500).parent == space.directory
+    assert space.new_path(".pdf").parent == space.directory
+    assert space.ram_usage_bytes == 800
+
+
+def test_releasing_a_path_outside_a_workspace_returns_its_ram(tmp_path):
+    space = make_space(tmp_path)
+    path = space.new_path(".pdf", 300)
+    space.hold(path)
+    space.release(path)
+    assert space.ram_usage_bytes == 0
+
+
+def test_held_workspace_files_keep_their_ram_until_released(tmp_path):
+    space = make_space(tmp_path)
+    workspace = space.workspace()
+    kept = workspace.file(".pdf", 300)
+    dropped = workspace.file(".pdf", 200)
+    for path in (kept, dropped):
+        path.write_bytes(b"x")
+    space.hold(kept)
+    workspace.close()
+    assert kept.exists() and not dropped.exists()
+    assert space.ram_usage_bytes == 300
+    space.release(kept)
+    assert space.ram_usage_bytes == 0
+
+
+def test_sweep_frees_reservations_of_vanished_files_and_counts_strays(tmp_path, monkeypatch):
+    space = make_space(tmp_path)
+    path = space.new_path(".pdf", 300)
+    path.write_bytes(b"x" * 300)
+    path.unlink()
+    (space.ram_directory / "left-over.pdf").write_bytes(b"x" * 50)
+
+    space.sweep()
+    assert space.ram_usage_bytes == 300 + 50
+
+    monkeypatch.setattr(server, "SCRATCH_MIN_AGE_SECONDS", -1)
+    space.sweep()
+    assert space.ram_usage_bytes == 50
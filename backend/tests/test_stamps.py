@@ -0,0 +1,49 @@
+import io
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import RectangleObject
+
+import server
+
+
+def cropped_rotated_writer(pdf_bytes: bytes, rotation: int) -> PdfWriter:
+    pdf_writer = PdfWriter(clone_from=PdfReader(io.BytesIO(pdf_bytes)))
+    for page in pdf_writer.pages:
+        page.cropbox = RectangleObject((50, 60, 550, 700))
+        page.rotation = rotation
+    return pdf_writer
+
+
+def displayed_spans(pdf_writer: PdfWriter):
+    import fitz
+    buffer = io.BytesIO()
+    pdf_writer.write(buffer)
+    with fitz.open(stream=buffer.getvalue(), filetype="pdf") as pdf_document:
+        page = pdf_document[0]
+        # get_text reports unrotated coordinates; map boxes and directions to the display
+        matrix = page.rotation_matrix
+        spans = [
+            (span["text"], fitz.Rect(span["bbox"]) * matrix, tuple(fitz.Point(line["dir"]) * matrix - fitz.Point(0, 0) * matrix))
+            for block in page.get_text("dict")["blocks"]
+            for line in block.get("lines", [])
+            for span in line["spans"]
+        ]
+        return spans, page.rect
+
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+@pytest.mark.parametrize("position", ["bottom-left", "bottom-center", "bottom-right"])
+def test_page_numbers_sit_upright_at_the_bottom_of_the_displayed_page(make_pdf, rotation, position):
+    pdf_writer = cropped_rotated_writer(make_pdf(1), rotation)
+    server.stamp_page_numbers(pdf_writer, "numeric", position)
+    spans, page_rect = displayed_spans(pdf_writer)
+    [(text, box, direction)] = [span for span in spans if span[0] == "1"]
+
+    displayed_width, displayed_height = (640, 500) if rotation in (90, 270) else (500, 640)
+    assert (page_rect.width, page_rect.height) == (displayed_width, displayed_height)
+    assert direction == pytest.approx((1.0, 0.0))
+    assert displayed_height - 32 < box.y1 <= displayed_height - 15
+    center = (box.x0 + box.x1) / 2
+    expected = {"bottom-left": 40, "bottom-center": displayed_width / 2, "bottom-right": displayed_width - 40}[position]
+    assert abs(center - expected) < 10
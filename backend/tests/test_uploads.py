@@ -0,0 +1,54 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import server
+
+
+def limited_app(limit_mb=1, limits_mb=None):
+    app = FastAPI()
+
+    @app.post("/api/{endpoint:path}")
+    async def echo(request: Request):
+        return {"received": len(await request.body())}
+
+    app.add_middleware(server.UploadLimitMiddleware, default_limit_mb=limit_mb, limits_mb=limits_mb or {})
+    return app
+
+
+def test_parse_upload_limits_ignores_bad_items():
+    assert server.parse_upload_limits("merge=1000, ocr = 50,split=big,nonsense") == {'merge': 1000, 'ocr': 50}
+
+
+def test_limit_for_uses_the_endpoint_then_its_first_segment():
+    middleware = server.UploadLimitMiddleware(None, 10, {'merge': 100, 'batch': 500})
+    megabyte = 1024 * 1024
+    assert middleware.limit_for('/api/merge') == 100 * megabyte
+    assert middleware.limit_for('/api/merge/') == 100 * megabyte
+    assert middleware.limit_for('/api/batch/compress') == 500 * megabyte
+    assert middleware.limit_for('/api/split') == 10 * megabyte
+
+
+def test_bodies_over_the_limit_are_rejected():
+    with TestClient(limited_app(1, {'big': 3})) as test_client:
+        body = b"x" * (2 * 1024 * 1024)
+        assert test_client.post('/api/small', content=body).status_code == 413
+        assert test_client.post('/api/big', content=body).json() == {"received": len(body)}
+        assert test_client.post('/api/small', content=b"x" * 1000).status_code == 200
+
+
+def test_streamed_bodies_are_stopped_once_they_cross_the_limit():
+    def chunks():
+        for _ in range(4):
+            yield b"x" * (512 * 1024)
+
+    with TestClient(limited_app(1)) as test_client:
+        response = test_client.post('/api/small', content=chunks())
+    assert response.status_code == 413
+
+
+def test_configured_endpoint_limit_applies_to_the_app(client):
+    # conftest sets UPLOAD_LIMITS_MB=css-to-pdf=1
+    source = b"body { color: red; }\n" * 60000
+    response = client.post('/api/css-to-pdf', files={'file': ('big.css', source, 'text/css')})
+    assert response.status_code == 413
+    assert server.UPLOAD_LIMITS_MB['merge'] == server.DEFAULT_UPLOAD_LIMITS_MB['merge']
@@ -0,0 +1,63 @@
+import asyncio
+import os
+
+import pytest
+
+import server
+
+
+def fail_with_invalid_input(message):
+    raise server.InvalidInputError(message)
+
+
+def test_parse_operation_routes_skips_unknown_pools():
+    routes = server.parse_operation_routes("merge=thread, ocr = process,split=gpu,broken")
+    assert routes == {'merge': 'thread', 'ocr': 'process'}
+
+
+def test_route_uses_overrides_and_defaults_to_thread():
+    pool = server.WorkerPool(2, 1, {**server.DEFAULT_OPERATION_ROUTES, 'merge': 'thread'})
+    assert pool.route('merge') == 'thread'
+    assert pool.route('word-to-pdf') == 'process'
+    assert pool.route('not-an-operation') == 'thread'
+
+
+def test_default_routes_keep_document_sessions_on_threads():
+    for operation in ('document-open', 'document-rotate', 'document-reorder', 'document-delete-pages', 'thumbnail'):
+        assert server.DEFAULT_OPERATION_ROUTES[operation] == 'thread'
+
+
+def test_thread_and_process_pools_run_work_and_count_it():
+    pool = server.WorkerPool(2, 1, {'in-thread': 'thread', 'in-process': 'process'})
+
+    async def run():
+        return await asyncio.gather(
+            pool.run('in-thread', os.getpid),
+            pool.run('in-process', os.getpid),
+        )
+
+    try:
+        thread_pid, process_pid = asyncio.run(run())
+        metrics = pool.metrics()
+    finally:
+        pool.shutdown()
+
+    assert thread_pid == os.getpid()
+    assert process_pid != os.getpid()
+    assert metrics['pools']['thread']['completed'] == 1
+    assert metrics['pools']['process']['completed'] == 1
+    assert metrics['operations']['in-process']['pool'] == 'process'
+    assert metrics['operations']['in-thread']['in_flight'] == 0
+
+
+def test_worker_errors_reach_the_caller_and_are_counted():
+    pool = server.WorkerPool(1, 1, {'fails': 'process'})
+    try:
+        with pytest.raises(server.InvalidInputError, match="bad page"):
+            asyncio.run(pool.run('fails', fail_with_invalid_input, "bad page"))
+        metrics = pool.metrics()
+    finally:
+        pool.shutdown()
+
+    assert metrics['pools']['process']['failed'] == 1
+    assert metrics['operations']['fails']['errors'] == 1
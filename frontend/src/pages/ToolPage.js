@@ -29,6 +29,10 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Long-running tools are submitted as background jobs and polled for progress
+const JOB_TOOLS = ["pdf-to-word", "ipynb-to-pdf", "merge"];
+const JOB_POLL_INTERVAL_MS = 1000;
+
 const toolConfigs = {
   merge: {
     title: "Merge PDF",
@@ -48,7 +52,14 @@ const toolConfigs = {
     title: "Compress PDF",
     acceptFiles: ".pdf",
     multiple: false,
-    hasExtraInput: false,
+    hasExtraInput: true,
+    inputType: "select",
+    inputLabel: "Compression Level",
+    options: [
+      { value: "ebook", label: "Recommended (150 dpi images)" },
+      { value: "screen", label: "Smallest file (72 dpi images)" },
+      { value: "print", label: "High quality (300 dpi images)" },
+    ],
   },
   rotate: {
     title: "Rotate PDF",
@@ -296,6 +307,12 @@ export default function ToolPage() {
   const [reorderPages, setReorderPages] = useState([]);
   const [draggedPage, setDraggedPage] = useState(null);
 
+  // Document session for page tools, so the PDF is uploaded only once
+  const [documentId, setDocumentId] = useState(null);
+
+  // Progress of the background job for long-running tools
+  const [jobProgress, setJobProgress] = useState(null);
+
   // Save theme preference to localStorage
   useEffect(() => {
     localStorage.setItem("theme", isDarkMode ? "dark" : "light");
@@ -303,6 +320,52 @@ export default function ToolPage() {
 
   const config = toolConfigs[toolId];
 
+  // Submit a background job, wait for it to finish and download its result
+  const runJob = async formData => {
+    const submitted = await axios.post(`${API}/jobs/${toolId}`, formData, {
+      timeout: 60000,
+    });
+    const jobUrl = `${API}/jobs/${submitted.data.job_id}`;
+    let job = submitted.data;
+    while (job.status === "queued" || job.status === "running") {
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+      job = (await axios.get(jobUrl)).data;
+      setJobProgress(job.progress);
+    }
+    if (job.status !== "succeeded") {
+      const error = new Error(`Job ${job.status}`);
+      error.response = { data: { detail: job.error || `Job ${job.status}` } };
+      throw error;
+    }
+    const response = await axios.get(`${jobUrl}/result`, {
+      responseType: "blob",
+    });
+    axios.delete(jobUrl).catch(() => {});
+    return response;
+  };
+
+  // Upload a PDF once and return the document session used by the page tools
+  const openDocument = async file => {
+    if (documentId) {
+      axios.delete(`${API}/documents/${documentId}`).catch(() => {});
+    }
+    const formData = new FormData();
+    formData.append("file", file);
+
+    const response = await axios.post(`${API}/documents`, formData, {
+      timeout: 60000,
+    });
+    setDocumentId(response.data.document_id);
+    return response.data;
+  };
+
+  // Page previews are rendered on demand, one image per page
+  const withThumbnails = pdfDocument =>
+    pdfDocument.pages.map(page => ({
+      ...page,
+      imageData: `${API}/documents/${pdfDocument.document_id}/pages/${page.page_number}/thumbnail?scale=0.5&format=webp&revision=${pdfDocument.revision}`,
+    }));
+
   // Function to load PDF page previews
   const loadPdfPreviews = async file => {
     console.log("Loading PDF previews for:", file.name);
@@ -311,17 +374,16 @@ export default function ToolPage() {
     setSelectedPages([]);
 
     try {
-      const formData = new FormData();
-      formData.append("file", file);
-
-      console.log("Sending request to:", `${API}/preview-pages`);
-      const response = await axios.post(`${API}/preview-pages`, formData, {
-        timeout: 60000,
-      });
-
-      console.log("Preview response:", response.data);
-      setPdfPages(response.data.pages);
-      toast.success(`Loaded ${response.data.totalPages} pages`);
+      const pdfDocument = await openDocument(file);
+
+      console.log("Document pages:", pdfDocument.total_pages);
+      setPdfPages(
+        withThumbnails(pdfDocument).map(page => ({
+          ...page,
+          pageNumber: page.page_number,
+        }))
+      );
+      toast.success(`Loaded ${pdfDocument.total_pages} pages`);
     } catch (err) {
       console.error("Preview error:", err);
       console.error("Error details:", err.response?.data);
@@ -341,20 +403,15 @@ export default function ToolPage() {
     setReorderPages([]);
 
     try {
-      const formData = new FormData();
-      formData.append("file", file);
+      const pdfDocument = await openDocument(file);
 
-      const response = await axios.post(`${API}/pdf-pages-info`, formData, {
-        timeout: 60000,
-      });
-
-      console.log("Pages info response:", response.data);
-      const pages = response.data.pages.map(page => ({
+      console.log("Document pages:", pdfDocument.total_pages);
+      const pages = withThumbnails(pdfDocument).map(page => ({
         ...page,
         id: `page-${page.page_number}`,
       }));
       setReorderPages(pages);
-      toast.success(`Loaded ${response.data.total_pages} pages`);
+      toast.success(`Loaded ${pdfDocument.total_pages} pages`);
     } catch (err) {
       console.error("Pages info error:", err);
       toast.error(
@@ -475,6 +532,8 @@ export default function ToolPage() {
           formData.append("pages", extraInput);
         } else if (toolId === "rotate") {
           formData.append("angle", extraInput);
+        } else if (toolId === "compress") {
+          formData.append("preset", extraInput);
         } else if (toolId === "watermark") {
           // Handle watermark options
           if (extraInput === "text") {
@@ -510,10 +569,22 @@ export default function ToolPage() {
         formData.append("page_order", pageOrder);
       }
 
-      const response = await axios.post(`${API}/${toolId}`, formData, {
-        responseType: toolId === "ocr" ? "json" : "blob",
-        timeout: 60000,
-      });
+      // Page tools operate on the already uploaded document session
+      const usesDocument =
+        documentId && (toolId === "delete-pages" || toolId === "reorder");
+      if (usesDocument) {
+        formData.delete("file");
+      }
+      const endpoint = usesDocument
+        ? `${API}/documents/${documentId}/${toolId}`
+        : `${API}/${toolId}`;
+
+      const response = JOB_TOOLS.includes(toolId)
+        ? await runJob(formData)
+        : await axios.post(endpoint, formData, {
+            responseType: toolId === "ocr" ? "json" : "blob",
+            timeout: 60000,
+          });
 
       if (toolId === "ocr") {
         setResult({ type: "text", data: response.data });
@@ -564,6 +635,7 @@ export default function ToolPage() {
       toast.error("Processing failed. Please try again.");
     } finally {
       setProcessing(false);
+      setJobProgress(null);
     }
   };
 
@@ -1273,6 +1345,9 @@ export default function ToolPage() {
                             <img
                               src={page.imageData}
                               alt={`Page ${page.pageNumber}`}
+                              width={page.width}
+                              height={page.height}
+                              loading="lazy"
                               className="w-full h-auto"
                             />
                             <div
@@ -1385,6 +1460,7 @@ export default function ToolPage() {
                                 <img
                                   src={page.imageData}
                                   alt={`Page ${page.page_number}`}
+                                  loading="lazy"
                                   className="w-full h-full object-contain"
                                 />
                               ) : (
@@ -1552,6 +1628,17 @@ export default function ToolPage() {
                       >
                         Processing your file...
                       </p>
+                      {jobProgress && (
+                        <p
+                          className="text-sm mt-2 text-gray-500"
+                          data-testid="job-progress"
+                        >
+                          {jobProgress.stage}
+                          {jobProgress.total
+                            ? ` (${jobProgress.done}/${jobProgress.total})`
+                            : ` (${jobProgress.done})`}
+                        </p>
+                      )}
                     </div>
                   </div>
                 )}